@@ -0,0 +1,278 @@
+"""Versioned JSON API for the CV tables, with bulk writes.
+
+Every resource of every profile supports::
+
+    GET    /<profile>/api/v1/<resource>?after=<id>&limit=N   keyset-paginated list
+    GET    /<profile>/api/v1/<resource>/<id>                 one row
+    POST   /<profile>/api/v1/<resource>                      create one object or a list
+    PUT    /<profile>/api/v1/<resource>                      replace a list of objects (each with "id")
+    DELETE /<profile>/api/v1/<resource>                      delete {"ids": [...]}
+
+Reads and writes only ever touch the rows of the profile in the URL; an
+id of another profile's row is not found. Contact messages are not a
+resource here: they are private, and only the inbox shows them.
+
+Bulk writes are validated item by item, then written with ``executemany``
+in chunks of ``batch_size`` rows, one transaction per chunk. If a chunk
+fails it is rolled back and replayed row by row so the response can name
+exactly which items were rejected. Updates and deletes first look up which
+of the chunk's ids the profile has, in the same transaction, and report
+the others as not found; ``executemany`` cannot tell which of its rows
+matched, and MySQL counts an update that changes nothing as no row.
+"""
+import datetime
+
+from flask import Blueprint, jsonify, request
+
+from repository import DatabaseUnavailable
+from schema import PUBLIC_RESOURCES
+from storage import DatabaseError
+
+
+def json_value(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+
+def _is_id(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _row_dict(row):
+    return {column: json_value(value) for column, value in row._asdict().items()}
+
+
+class BulkResult:
+    """Counts and per-item errors of one bulk request."""
+
+    def __init__(self, total):
+        self.total = total
+        self.succeeded = 0
+        self.errors = []
+
+    def fail(self, index, message):
+        self.errors.append({'index': index, 'error': message})
+
+    def response(self):
+        body = {
+            'processed': self.total,
+            'succeeded': self.succeeded,
+            'failed': len(self.errors),
+            'errors': sorted(self.errors, key=lambda e: e['index']),
+        }
+        if not self.errors:
+            status = 200
+        elif self.succeeded:
+            status = 207
+        else:
+            status = 400
+        return jsonify(body), status
+
+
+def make_api_blueprint(repositories, current_profile, batch_size=500, max_items=50000, page_size=100):
+    """Build the ``/<profile>/api/v1`` blueprint around the app's table repositories.
+
+    ``current_profile()`` returns the profile the request's URL names.
+    """
+    api = Blueprint('api_v1', __name__, url_prefix='/<profile>/api/v1')
+
+    def resource_or_404(resource):
+        if resource not in PUBLIC_RESOURCES:
+            return None
+        return repositories[resource]
+
+    def items_from_body():
+        """The request body as a list of items, or an error response."""
+        data = request.get_json(silent=True)
+        if data is None:
+            return None, (jsonify(error="Request body must be JSON."), 400)
+        items = data if isinstance(data, list) else [data]
+        if len(items) > max_items:
+            return None, (jsonify(error=f"At most {max_items} items per request."), 413)
+        return items, None
+
+    def existing(cursor, repo, profile_id, chunk, id_of):
+        """The rows of ``chunk`` whose id is one of the profile's; the others fail as not found."""
+        ids = list({id_of(params) for _, params in chunk})
+        cursor.execute(f"SELECT id FROM {repo.table.name} WHERE profile_id = %s "
+                       f"AND id IN ({', '.join(['%s'] * len(ids))})", [profile_id] + ids)
+        found = {row[0] for row in cursor.fetchall()}
+        return [(index, params) for index, params in chunk if id_of(params) in found]
+
+    def write_chunks(repo, profile_id, sql, rows, result, run_chunk=None, id_of=None):
+        """Write ``[(index, params), ...]`` to a profile, batch_size rows per transaction.
+
+        Chunks go through ``cursor.executemany(sql, ...)`` unless a
+        ``run_chunk(cursor, params_list)`` is given; ``sql`` is also what a
+        failed chunk is replayed with, one row at a time. With ``id_of``,
+        which picks the id out of a row's params, rows writing to an id the
+        profile doesn't have fail as not found.
+        """
+        if run_chunk is None:
+            run_chunk = lambda cursor, params_list: cursor.executemany(sql, params_list)
+        mydb = repo.get_db_connection()
+        if not mydb:
+            for index, _ in rows:
+                result.fail(index, "Database connection failed.")
+            return
+        with mydb:
+            cursor = mydb.cursor()
+            for start in range(0, len(rows), batch_size):
+                chunk = rows[start:start + batch_size]
+                if id_of is not None:
+                    try:
+                        found = existing(cursor, repo, profile_id, chunk, id_of)
+                    except DatabaseError as err:
+                        mydb.rollback()
+                        for index, _ in chunk:
+                            result.fail(index, str(err))
+                        continue
+                    kept = {index for index, _ in found}
+                    for index, _ in chunk:
+                        if index not in kept:
+                            result.fail(index, "Not found.")
+                    chunk = found
+                    if not chunk:
+                        mydb.commit()
+                        continue
+                try:
+                    run_chunk(cursor, [params for _, params in chunk])
+                    mydb.commit()
+                    result.succeeded += len(chunk)
+                except DatabaseError:
+                    mydb.rollback()
+                    # Replay the chunk one row at a time to find the bad items
+                    for index, params in chunk:
+                        try:
+                            cursor.execute(sql, params)
+                            mydb.commit()
+                            result.succeeded += 1
+                        except DatabaseError as err:
+                            mydb.rollback()
+                            result.fail(index, str(err))
+            cursor.close()
+        repo.changed(profile_id)
+
+    def validate(items, columns, require_id):
+        """Split items into ``[(index, params)]`` and per-item errors."""
+        rows, result = [], BulkResult(len(items))
+        allowed = set(columns) | {'id'}
+        for index, item in enumerate(items):
+            if not isinstance(item, dict):
+                result.fail(index, "Item must be a JSON object.")
+                continue
+            missing = [c for c in columns if c not in item]
+            unknown = [k for k in item if k not in allowed]
+            if require_id and not _is_id(item.get('id')):
+                result.fail(index, "Item needs an integer 'id'.")
+            elif missing:
+                result.fail(index, f"Missing fields: {', '.join(missing)}.")
+            elif unknown:
+                result.fail(index, f"Unknown fields: {', '.join(unknown)}.")
+            else:
+                params = tuple(item[c] for c in columns)
+                rows.append((index, params + (item['id'],) if require_id else params))
+        return rows, result
+
+    @api.route('/<resource>', methods=['GET'])
+    def list_items(resource):
+        repo = resource_or_404(resource)
+        if repo is None:
+            return jsonify(error="Unknown resource."), 404
+        after = request.args.get('after', 0, type=int)
+        limit = max(1, min(request.args.get('limit', page_size, type=int), max_items))
+
+        try:
+            rows = repo.page(current_profile().id, after, limit)
+        except DatabaseUnavailable:
+            return jsonify(error="Database connection failed."), 503
+        except DatabaseError as err:
+            print(f"Error listing {repo.table.name}: {err}")
+            return jsonify(error=f"Unable to load {resource}."), 500
+
+        next_after = rows[-1].id if len(rows) == limit else None
+        return jsonify(items=[_row_dict(row) for row in rows], next_after=next_after)
+
+    @api.route('/<resource>/<int:id>', methods=['GET'])
+    def get_item(resource, id):
+        repo = resource_or_404(resource)
+        if repo is None:
+            return jsonify(error="Unknown resource."), 404
+
+        try:
+            row = repo.get(current_profile().id, id)
+        except DatabaseUnavailable:
+            return jsonify(error="Database connection failed."), 503
+        except DatabaseError as err:
+            print(f"Error fetching {repo.table.name} {id}: {err}")
+            return jsonify(error=f"Unable to load {resource}."), 500
+        if row is None:
+            return jsonify(error="Not found."), 404
+        return jsonify(_row_dict(row))
+
+    @api.route('/<resource>', methods=['POST'])
+    def create_items(resource):
+        repo = resource_or_404(resource)
+        if repo is None:
+            return jsonify(error="Unknown resource."), 404
+        items, error = items_from_body()
+        if error:
+            return error
+
+        profile_id = current_profile().id
+        rows, result = validate(items, repo.table.columns, require_id=False)
+        if rows:
+            # The profile goes last, as the statements take it
+            rows = [(index, params + (profile_id,)) for index, params in rows]
+            write_chunks(repo, profile_id, repo.insert_sql, rows, result)
+        return result.response()
+
+    @api.route('/<resource>', methods=['PUT'])
+    def update_items(resource):
+        repo = resource_or_404(resource)
+        if repo is None:
+            return jsonify(error="Unknown resource."), 404
+        items, error = items_from_body()
+        if error:
+            return error
+
+        profile_id = current_profile().id
+        rows, result = validate(items, repo.table.columns, require_id=True)
+        if rows:
+            rows = [(index, params + (profile_id,)) for index, params in rows]
+            write_chunks(repo, profile_id, repo.update_sql, rows, result, id_of=lambda params: params[-2])
+        return result.response()
+
+    @api.route('/<resource>', methods=['DELETE'])
+    def delete_items(resource):
+        repo = resource_or_404(resource)
+        if repo is None:
+            return jsonify(error="Unknown resource."), 404
+        table = repo.table.name
+        data = request.get_json(silent=True)
+        ids = data.get('ids') if isinstance(data, dict) else None
+        if not isinstance(ids, list):
+            return jsonify(error='Request body must be {"ids": [...]}.'), 400
+        if len(ids) > max_items:
+            return jsonify(error=f"At most {max_items} items per request."), 413
+
+        profile_id = current_profile().id
+        result = BulkResult(len(ids))
+        rows = []
+        for index, id in enumerate(ids):
+            if _is_id(id):
+                rows.append((index, (id, profile_id)))
+            else:
+                result.fail(index, "Id must be an integer.")
+        def delete_chunk(cursor, params_list):
+            placeholders = ', '.join(['%s'] * len(params_list))
+            cursor.execute(f"DELETE FROM {table} WHERE profile_id = %s AND id IN ({placeholders})",
+                           [profile_id] + [params[0] for params in params_list])
+
+        if rows:
+            write_chunks(repo, profile_id, repo.delete_sql, rows, result, delete_chunk,
+                         id_of=lambda params: params[0])
+        return result.response()
+
+    return api
@@ -1,7 +1,40 @@
+import atexit
+import hashlib
+import hmac
+import json
+import math
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from dotenv import load_dotenv
-import mysql.connector
-from flask import Flask, render_template, request, redirect, url_for
+from flask import (Flask, Response, abort, g, has_app_context, make_response, render_template, request, redirect,
+                   url_for, jsonify, stream_template)
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from api import json_value, make_api_blueprint
+import assets
+from breaker import CircuitBreaker, CircuitOpen
+from cache import LocalVersionStore, QueryCache, SQLiteVersionStore
+from compression import Compressor
+from contact_queue import ContactWriter, QueueFull
+from db_pool import ConnectionPool, PoolTimeout
+from http_cache import conditional
+import metrics
+import migrations
+from profiler import Profiler, make_profile_blueprint
+import profiles
+from repository import DatabaseUnavailable, Repository
+import retention
+import schema
+from search import SearchIndexes
+from snapshots import SnapshotStore
+import static_site
+import template_cache
+from storage import DatabaseError, create_backend, is_unavailable
+from throttle import ContactThrottle, LocalThrottleStore, SQLiteThrottleStore
+import transfer
 
 # Load environment variables from the .env file
 load_dotenv()
@@ -12,621 +45,953 @@ DB_USER = os.getenv('DB_USER')
 DB_PASSWORD = os.getenv('DB_PASSWORD')
 DB_NAME = os.getenv('DB_NAME')
 
+# Storage backend: 'mysql', or 'sqlite' for an embedded database file
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'mysql')
+SQLITE_PATH = os.getenv('SQLITE_PATH', 'instance/cv.sqlite3')
+SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))  # bytes of the file read through mmap
+DB_AUTO_MIGRATE = os.getenv('DB_AUTO_MIGRATE', '0') == '1'  # apply MySQL migrations on startup (SQLite always does)
+
+# Connection pool settings
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))              # seconds to wait for a free connection
+DB_POOL_MAX_LIFETIME = float(os.getenv('DB_POOL_MAX_LIFETIME', '1800'))  # seconds before a connection is recycled
+DB_POOL_PING_AFTER = float(os.getenv('DB_POOL_PING_AFTER', '30'))        # idle seconds before a health check on borrow
+
+# Database timeouts and circuit breaker: after DB_BREAKER_FAILURES connects or
+# queries in a row fail or time out, the database is left alone for
+# DB_BREAKER_RESET seconds and list pages are served from their last snapshot
+DB_CONNECT_TIMEOUT = float(os.getenv('DB_CONNECT_TIMEOUT', '3'))   # seconds
+DB_QUERY_TIMEOUT = float(os.getenv('DB_QUERY_TIMEOUT', '5'))       # seconds per statement; 0 for no limit
+DB_BREAKER_FAILURES = int(os.getenv('DB_BREAKER_FAILURES', '5'))
+DB_BREAKER_RESET = float(os.getenv('DB_BREAKER_RESET', '30'))      # seconds before a trial query
+SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR', 'instance/snapshots')     # last rows of each list query; empty: memory only
+SNAPSHOT_MAX_ENTRIES = int(os.getenv('SNAPSHOT_MAX_ENTRIES', '512'))
+SNAPSHOT_PROFILE_ENTRIES = int(os.getenv('SNAPSHOT_PROFILE_ENTRIES', str(max(1, SNAPSHOT_MAX_ENTRIES // 4))))  # per profile
+
+# Profiles: every CV is served under /<slug>/. The old unprefixed URLs, and /,
+# redirect to the profile DEFAULT_PROFILE_SLUG names
+DEFAULT_PROFILE_SLUG = os.getenv('DEFAULT_PROFILE_SLUG', 'default')
+PROFILE_DIRECTORY_SIZE = int(os.getenv('PROFILE_DIRECTORY_SIZE', '10000'))  # profiles kept in memory by slug
+PROFILE_MISS_TTL = float(os.getenv('PROFILE_MISS_TTL', '60'))               # seconds an unknown slug stays unknown
+
+# Query cache settings. Entries are partitioned by profile: one profile holds
+# at most CACHE_PROFILE_ENTRIES, so a busy one cannot push out the others
+CACHE_TTL = float(os.getenv('CACHE_TTL', '300'))                   # seconds a cached list stays fresh
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', '256'))
+CACHE_PROFILE_ENTRIES = int(os.getenv('CACHE_PROFILE_ENTRIES', str(max(1, CACHE_MAX_ENTRIES // 4))))
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'local')                # 'local' or 'sqlite' (shared between workers)
+CACHE_EPOCH = os.getenv('CACHE_EPOCH')                             # start of the local counters; gunicorn.conf.py sets it
+CACHE_SQLITE_PATH = os.getenv('CACHE_SQLITE_PATH', 'instance/cache-versions.sqlite3')
+CACHE_CHECK_INTERVAL = float(os.getenv('CACHE_CHECK_INTERVAL', '1'))  # seconds between shared invalidation checks
+
+# Cache-Control header for the list pages; override per route with
+# CACHE_CONTROL_<ENDPOINT>, e.g. CACHE_CONTROL_SKILLS="public, max-age=300"
+CACHE_CONTROL_DEFAULT = os.getenv('CACHE_CONTROL_DEFAULT', 'no-cache')
+
+def cache_control_for(endpoint):
+    return os.getenv(f'CACHE_CONTROL_{endpoint.upper()}', CACHE_CONTROL_DEFAULT)
+
+# List page settings: ?after=<id>&limit=N pages by id, ?sort=[-]column and the
+# table's filters (e.g. ?category=, ?from=) narrow and order the list, ?stream=1
+# streams all matching rows
+LIST_PAGE_SIZE = int(os.getenv('LIST_PAGE_SIZE', '100'))     # rows per page when no limit is given, 0 for all
+LIST_MAX_LIMIT = int(os.getenv('LIST_MAX_LIMIT', '1000'))
+STREAM_CHUNK_SIZE = int(os.getenv('STREAM_CHUNK_SIZE', '500'))  # rows fetched per round trip when streaming
+
+# JSON API bulk write settings
+API_BATCH_SIZE = int(os.getenv('API_BATCH_SIZE', '500'))     # rows per executemany and transaction
+API_MAX_ITEMS = int(os.getenv('API_MAX_ITEMS', '50000'))     # items accepted in one request
+
+# Contact form write-behind: queue messages and insert them in batches
+CONTACT_ASYNC = os.getenv('CONTACT_ASYNC', '0') == '1'
+CONTACT_QUEUE_SIZE = int(os.getenv('CONTACT_QUEUE_SIZE', '1000'))    # messages held before submissions are refused
+CONTACT_BATCH_SIZE = int(os.getenv('CONTACT_BATCH_SIZE', '100'))     # rows per multi-row INSERT
+CONTACT_SPOOL_PATH = os.getenv('CONTACT_SPOOL_PATH')                  # optional path so queued messages survive a crash; each process adds .<pid>
+
+# Contact inbox and retention: /inbox lists messages newest first to anyone
+# with INBOX_TOKEN as the HTTP basic auth password. Once CONTACT_RETENTION_DAYS
+# is set, messages older than that move to gzipped NDJSON files in
+# CONTACT_ARCHIVE_DIR, archived by one worker at a time
+INBOX_TOKEN = os.getenv('INBOX_TOKEN')                                       # unset: no /inbox
+CONTACT_RETENTION_DAYS = float(os.getenv('CONTACT_RETENTION_DAYS', '0'))     # 0 keeps every message
+CONTACT_ARCHIVE_DIR = os.getenv('CONTACT_ARCHIVE_DIR')                       # default: contact-archive in the instance folder
+CONTACT_ARCHIVE_BATCH = int(os.getenv('CONTACT_ARCHIVE_BATCH', '500'))       # messages moved per transaction
+CONTACT_ARCHIVE_INTERVAL = float(os.getenv('CONTACT_ARCHIVE_INTERVAL', '3600'))  # seconds between runs
+
+# Contact form throttling: a token bucket per client IP and one shared by all
+# clients, plus suppression of repeated messages. THROTTLE_BACKEND=sqlite shares
+# the buckets between the workers on a host
+CONTACT_IP_BURST = int(os.getenv('CONTACT_IP_BURST', '5'))                 # messages a client may send at once
+CONTACT_IP_REFILL = float(os.getenv('CONTACT_IP_REFILL', '60'))            # seconds for a client to earn another
+CONTACT_GLOBAL_BURST = int(os.getenv('CONTACT_GLOBAL_BURST', '100'))
+CONTACT_GLOBAL_REFILL = float(os.getenv('CONTACT_GLOBAL_REFILL', '1'))
+CONTACT_DUPLICATE_WINDOW = float(os.getenv('CONTACT_DUPLICATE_WINDOW', '600'))  # seconds; 0 accepts repeats
+THROTTLE_BACKEND = os.getenv('THROTTLE_BACKEND', 'local')                  # 'local' or 'sqlite'
+THROTTLE_SQLITE_PATH = os.getenv('THROTTLE_SQLITE_PATH', 'instance/throttle.sqlite3')
+THROTTLE_MAX_CLIENTS = int(os.getenv('THROTTLE_MAX_CLIENTS', '10000'))     # clients tracked in memory (local backend)
+# Behind a reverse proxy every client has the proxy's address: TRUSTED_PROXIES
+# is how many proxies append to X-Forwarded-For, whose entry then identifies
+# the client. Left at 0 the header is ignored, as a client can forge it
+TRUSTED_PROXIES = int(os.getenv('TRUSTED_PROXIES', '0'))
+
+# Search settings
+SEARCH_RESULTS = int(os.getenv('SEARCH_RESULTS', '20'))          # results on the /search page
+SEARCH_SUGGESTIONS = int(os.getenv('SEARCH_SUGGESTIONS', '8'))   # results from /search/suggest
+SEARCH_MAX_PROFILES = int(os.getenv('SEARCH_MAX_PROFILES', '256'))  # profiles whose index stays in memory
+SEARCH_SNAPSHOT_DIR = os.getenv('SEARCH_SNAPSHOT_DIR')               # optional index files for a fast warm start
+
+# Static export: pre-rendered public pages for nginx or a CDN. When set, the
+# pages showing a table are re-rendered here after every write to it
+STATIC_EXPORT_DIR = os.getenv('STATIC_EXPORT_DIR')
+
+# Static assets: `flask build-assets` writes content-hashed, precompressed copies
+# of the static folder here; url_for('static', ...) links to them once built
+ASSETS_DIR = os.getenv('ASSETS_DIR', 'instance/assets')  # relative to this file's folder
+USE_X_SENDFILE = os.getenv('USE_X_SENDFILE', '0') == '1'  # let the front server send static files
+
+# Compiled templates are kept here across restarts; empty to compile in memory only
+TEMPLATE_CACHE_DIR = os.getenv('TEMPLATE_CACHE_DIR', 'instance/jinja-cache')
+
+# Names the deployed build in every ETag, so a deploy never answers 304 with
+# a page the previous one rendered; unset, a hash of the app's code,
+# templates and asset manifest
+RELEASE_ID = os.getenv('RELEASE_ID')
+
+# Response compression (gzip, or brotli when installed); turn off when a front
+# proxy already compresses
+COMPRESS = os.getenv('COMPRESS', '1') == '1'
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', '1024'))                   # smaller bodies go out as they are
+COMPRESS_GZIP_LEVEL = int(os.getenv('COMPRESS_GZIP_LEVEL', '6'))
+COMPRESS_BROTLI_QUALITY = int(os.getenv('COMPRESS_BROTLI_QUALITY', '5'))
+COMPRESS_CACHE_BYTES = int(os.getenv('COMPRESS_CACHE_BYTES', str(16 * 1024 * 1024)))  # compressed pages kept for reuse
+COMPRESS_PROFILE_BYTES = int(os.getenv('COMPRESS_PROFILE_BYTES', str(COMPRESS_CACHE_BYTES // 4)))  # of them, per profile
+
+# On-demand profiling: a request sent with "X-Profile: <PROFILE_TOKEN>" is
+# profiled, as is a random PROFILE_SAMPLE_RATE of all requests. The results
+# are served under /profile/ to requests carrying the same header
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN')                           # unset: no header profiling and no /profile/
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))   # fraction of requests, e.g. 0.01
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', '0.001'))     # seconds between stack samples
+PROFILE_MAX_STACKS = int(os.getenv('PROFILE_MAX_STACKS', '10000'))   # distinct stacks kept per endpoint
+PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', '50'))                  # recent profiled requests kept whole
+
+# Tables whose changes the /cv page depends on
+CV_TABLES = tuple(table.name for table in schema.CV_SECTIONS)
+
+# Public pages of each profile and the tables each one shows
+STATIC_PAGES = (
+    [static_site.Page('/<profile>/', ['Personal_Info'])]
+    + [static_site.Page('/<profile>/' + table.resource, [table.name]) for table in schema.CV_SECTIONS]
+    + [static_site.Page('/<profile>/cv', CV_TABLES)]
+)
+
+def current_profile():
+    """The profile the current request's URL names."""
+    return g.profile
+
+def current_profile_id():
+    """The id of the current request's profile, or None outside of one."""
+    profile = g.get('profile')
+    return profile.id if profile is not None else None
+
 app = Flask(__name__)
+app.config['USE_X_SENDFILE'] = USE_X_SENDFILE
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
+metrics.init_app(app)
+profiler = Profiler(
+    token=PROFILE_TOKEN,
+    sample_rate=PROFILE_SAMPLE_RATE,
+    interval=PROFILE_INTERVAL,
+    max_stacks=PROFILE_MAX_STACKS,
+    keep=PROFILE_KEEP
+)
+profiler.init_app(app)
+asset_pipeline = assets.AssetPipeline(app, ASSETS_DIR)
+
+def release_hash():
+    """A hash of the modules and templates next to this file and of the asset manifest."""
+    digest = hashlib.sha256()
+    for name in sorted(os.listdir(app.root_path)):
+        if name.endswith(('.py', '.html')):
+            with open(os.path.join(app.root_path, name), 'rb') as f:
+                digest.update(name.encode() + b'\0' + f.read())
+    digest.update(json.dumps(asset_pipeline.manifest, sort_keys=True).encode())
+    return digest.hexdigest()[:12]
+
+release = RELEASE_ID or release_hash()
+template_cache.init_app(app, TEMPLATE_CACHE_DIR)
+compressor = Compressor(
+    min_size=COMPRESS_MIN_SIZE,
+    gzip_level=COMPRESS_GZIP_LEVEL,
+    brotli_quality=COMPRESS_BROTLI_QUALITY,
+    cache_bytes=COMPRESS_CACHE_BYTES,
+    partition=current_profile_id,
+    partition_bytes=COMPRESS_PROFILE_BYTES
+)
+if COMPRESS:
+    compressor.init_app(app)
+
+storage_backend = create_backend(
+    STORAGE_BACKEND,
+    host=DB_HOST,
+    user=DB_USER,
+    password=DB_PASSWORD,
+    database=DB_NAME,
+    sqlite_path=SQLITE_PATH,
+    sqlite_mmap_size=SQLITE_MMAP_SIZE,
+    auto_migrate=DB_AUTO_MIGRATE,
+    connect_timeout=DB_CONNECT_TIMEOUT,
+    query_timeout=DB_QUERY_TIMEOUT
+)
+
+db_breaker = CircuitBreaker(
+    failure_threshold=DB_BREAKER_FAILURES,
+    reset_timeout=DB_BREAKER_RESET,
+    is_failure=is_unavailable
+)
+
+db_pool = ConnectionPool(
+    storage_backend.connect,
+    size=DB_POOL_SIZE,
+    timeout=DB_POOL_TIMEOUT,
+    max_lifetime=DB_POOL_MAX_LIFETIME,
+    ping_after=DB_POOL_PING_AFTER,
+    check=storage_backend.check,
+    cursor_wrapper=metrics.TimedCursor,
+    breaker=db_breaker
+)
+
+if CACHE_BACKEND == 'sqlite':
+    cache_versions = SQLiteVersionStore(CACHE_SQLITE_PATH)
+else:
+    cache_versions = LocalVersionStore(float(CACHE_EPOCH) if CACHE_EPOCH else None)
+
+query_cache = QueryCache(
+    ttl=CACHE_TTL,
+    max_entries=CACHE_MAX_ENTRIES,
+    profile_entries=CACHE_PROFILE_ENTRIES,
+    versions=cache_versions,
+    check_interval=CACHE_CHECK_INTERVAL
+)
 
 def get_db_connection():
+    """Borrow a pooled connection, or return None if none is available.
+
+    Use the result in a ``with`` block so it always goes back to the pool.
+    """
+    start = time.perf_counter()
     try:
-        mydb = mysql.connector.connect(
-            host=DB_HOST,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            database=DB_NAME
-        )
-        return mydb
-    except mysql.connector.Error as err:
+        return db_pool.acquire()
+    except CircuitOpen:
+        return None  # Fail fast; the database is known to be down
+    except (*DatabaseError, PoolTimeout) as err:
         print(f"Error: {err}")
         return None
+    finally:
+        metrics.add_timing('connect', time.perf_counter() - start)
+
+profile_directory = profiles.ProfileDirectory(
+    get_db_connection,
+    max_entries=PROFILE_DIRECTORY_SIZE,
+    miss_ttl=PROFILE_MISS_TTL
+)
+
+def profile_slug(profile_id):
+    """The slug of ``profile_id``, from the current request or the profile directory; None if unknown."""
+    profile = g.get('profile') if has_app_context() else None
+    if profile is not None and profile.id == profile_id:
+        return profile.slug
+    try:
+        return profile_directory.slug_of(profile_id)
+    except (DatabaseUnavailable, *DatabaseError) as err:
+        print(f"Error looking up profile {profile_id}: {err}")
+        return None
 
+def table_changed(table, profile_id=None, changes=None):
+    """Called after every committed write to ``table``.
+
+    ``profile_id`` is the profile whose rows were written, None when rows
+    of any profile may have been. ``changes`` is ``{id: row or None}`` for
+    a single-row write and ``None`` when any row may have changed (bulk
+    writes, imports).
+    """
+    query_cache.invalidate(table, profile_id)
+    if profile_id is None:
+        if table in search_indexes.fields:
+            search_indexes.drop()
+    elif changes is not None:
+        # The invalidation bumped the profile's generation of the table by one
+        table_generation, generation = search_generation(profile_id, table)
+        search_indexes.apply(profile_id, table, changes,
+                             ((table_generation, generation - 1), (table_generation, generation)))
+    elif table in search_indexes.fields:
+        search_executor.submit(reload_search_table, profile_id, table)
+    if static_export:
+        # A write to no one profile, or to one whose slug cannot be found, re-renders every profile
+        static_export.schedule(table, profile_slug(profile_id) if profile_id is not None else None)
+
+# One repository per table, keyed by JSON API resource name
+repositories = {
+    table.resource: Repository(table, get_db_connection, on_change=table_changed, chunk_size=STREAM_CHUNK_SIZE)
+    for table in schema.TABLES
+}
+
+def search_generation(profile_id, table):
+    """The query cache's generation of ``table`` for the profile, shared by the workers."""
+    return query_cache.version(table, profile_id)[0]
+
+def search_loaders(profile_id):
+    return {table.name: partial(repositories[table.resource].stream, profile_id) for table in schema.CV_SECTIONS}
+
+search_indexes = SearchIndexes(
+    {table.name: table.search for table in schema.CV_SECTIONS},
+    {table.name: table.title for table in schema.CV_SECTIONS},
+    search_loaders,
+    max_profiles=SEARCH_MAX_PROFILES,
+    snapshot_dir=SEARCH_SNAPSHOT_DIR,
+    on_loaded=lambda profile_id: search_executor.submit(refresh_search_index, profile_id),
+    version=search_generation
+)
+
+# Builds and reloads search indexes off the request path
+search_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='search-index')
+
+def build_default_search_index():
+    """Build the default profile's index ahead of its first search."""
+    try:
+        profile = profile_directory.get(DEFAULT_PROFILE_SLUG)
+        if profile is not None:
+            search_indexes.index(profile.id)
+    except (DatabaseUnavailable, *DatabaseError, RuntimeError) as err:
+        print(f"Error building search index: {err}")
+
+def refresh_search_index(profile_id):
+    """Bring an index loaded from its snapshot up to date with the database."""
+    try:
+        search_indexes.refresh(profile_id)
+    except (DatabaseUnavailable, *DatabaseError, RuntimeError) as err:
+        print(f"Error building search index: {err}")
 
-# Home Page Route
-@app.route('/')
-def home():
-    return render_template('index.html')
-
-# Personal Information Page Route
-@app.route('/personal-info')
-def personal_info():
-    mydb = get_db_connection()
-    if mydb:
-        try:
-            cursor = mydb.cursor()
-            cursor.execute("SELECT name, email, phone, bio, id FROM Personal_Info")
-            personal_info_data = cursor.fetchall()  # Fetch all rows
-            cursor.close()  # Close the cursor
-            mydb.close()    # Close the connection
-            return render_template('personal_info.html', personal_info=personal_info_data)
-        except mysql.connector.Error as err:
-            print(f"Error fetching personal info: {err}")
-            return render_template('error.html', error_message="Unable to load personal information.")
-    else:
-        return render_template('error.html', error_message="Database connection failed.")
-
-# Route to Add New Personal Information
-@app.route('/add-personal-info', methods=['GET', 'POST'])
-def add_personal_info():
-    if request.method == 'POST':
-        name = request.form['name']
-        email = request.form['email']
-        phone = request.form['phone']
-        bio = request.form['bio']
-
-        mydb = get_db_connection()
-        if mydb:
-            try:
-                cursor = mydb.cursor()
-                sql = "INSERT INTO Personal_Info (name, email, phone, bio) VALUES (%s, %s, %s, %s)"
-                values = (name, email, phone, bio)
-                cursor.execute(sql, values)
-                mydb.commit()
-                cursor.close()
-                mydb.close()
-                return redirect(url_for('personal_info'))
-            except mysql.connector.Error as err:
-                print(f"Error inserting personal information: {err}")
-                return render_template('error.html', error_message="Unable to add personal information.")
-        else:
-            return render_template('error.html', error_message="Database connection failed.")
-    
-    return render_template('add_personal_info.html')
-
-# Route to Edit Personal Information
-@app.route('/edit-personal-info/<int:id>', methods=['GET', 'POST'])
-def edit_personal_info(id):
-    mydb = get_db_connection()
-
-    if request.method == 'POST':
-        name = request.form['name']
-        email = request.form['email']
-        phone = request.form['phone']
-        bio = request.form['bio']
-
-        if mydb:
-            try:
-                cursor = mydb.cursor()
-                sql = """
-                    UPDATE Personal_Info
-                    SET name=%s, email=%s, phone=%s, bio=%s
-                    WHERE id=%s
-                """
-                values = (name, email, phone, bio, id)
-                cursor.execute(sql, values)
-                mydb.commit()
-
-                cursor.close()
-                mydb.close()
-
-                return redirect(url_for('personal_info'))
-            except mysql.connector.Error as err:
-                return render_template('error.html', error_message="Unable to update personal information.")
-        else:
-            return render_template('error.html', error_message="Database connection failed.")
-    else:
-        if mydb:
-            cursor = mydb.cursor()
-            sql = "SELECT name, email, phone, bio FROM Personal_Info WHERE id=%s"
-            cursor.execute(sql, (id,))
-            personal_info_data = cursor.fetchone()
-
-            cursor.close()
-            mydb.close()
-
-            return render_template('edit_personal_info.html', personal_info=personal_info_data)
-        else:
-            return render_template('error.html', error_message="Database connection failed.")
-
-# Route to Delete Personal Information
-@app.route('/delete-personal-info/<int:id>', methods=['GET'])
-def delete_personal_info(id):
-    mydb = get_db_connection()
-
-    if mydb:
-        try:
-            cursor = mydb.cursor()
-            sql = "DELETE FROM Personal_Info WHERE id = %s"
-            cursor.execute(sql, (id,))
-            mydb.commit()
-            cursor.close()
-            mydb.close()
-            return redirect(url_for('personal_info'))
-        except mysql.connector.Error as err:
-            print(f"Error deleting personal info: {err}")
-            return render_template('error.html', error_message="Unable to delete the personal info.")
-    else:
-        return render_template('error.html', error_message="Database connection failed.")
-
-# Education Page Route
-@app.route('/education')
-def education():
-    mydb = get_db_connection()
-    if mydb:
-        try:
-            cursor = mydb.cursor()
-            cursor.execute("SELECT school, achievement, start_year, end_year, description, id FROM Education")
-            education_data = cursor.fetchall()  # Fetch all the records
-            cursor.close()  # Close the cursor
-            mydb.close()    # Close the connection
-            return render_template('education.html', education=education_data)
-        except mysql.connector.Error as err:
-            print(f"Error fetching education data: {err}")
-            return render_template('error.html', error_message="Unable to load education data.")
-    else:
-        return render_template('error.html', error_message="Database connection failed.")
-
-# Route to Add New Education
-@app.route('/add-education', methods=['GET', 'POST'])
-def add_education():
-    if request.method == 'POST':
-        school = request.form['school']
-        achievement = request.form['achievement']
-        start_year = request.form['start_year']
-        end_year = request.form['end_year']
-        description = request.form['description']
-
-        mydb = get_db_connection()
-        if mydb:
-            try:
-                cursor = mydb.cursor()
-                sql = "INSERT INTO Education (school, achievement, start_year, end_year, description) VALUES (%s, %s, %s, %s, %s)"
-                values = (school, achievement, start_year, end_year, description)
-                cursor.execute(sql, values)
-                mydb.commit()
-                cursor.close()
-                mydb.close()
-                return redirect(url_for('education'))
-            except mysql.connector.Error as err:
-                print(f"Error inserting education data: {err}")
-                return render_template('error.html', error_message="Unable to add education.")
-        else:
-            return render_template('error.html', error_message="Database connection failed.")
-    
-    return render_template('add_education.html')
-
-# Route to Edit Education
-@app.route('/edit-education/<int:id>', methods=['GET', 'POST'])
-def edit_education(id):
-    mydb = get_db_connection()
+def reload_search_table(profile_id, table):
+    try:
+        search_indexes.reload_table(profile_id, table)
+    except (DatabaseUnavailable, *DatabaseError, RuntimeError) as err:
+        print(f"Error reindexing {table}: {err}")
+
+def search_results(query, limit):
+    """The current profile's best ``limit`` matches; builds its index on first use."""
+    results = []
+    for score, table_name, id, title in search_indexes.search(g.profile.id, query, limit):
+        table = schema.TABLES_BY_NAME[table_name]
+        results.append({
+            'section': table.label,
+            'id': id,
+            'title': title,
+            'score': score,
+            'url': url_for(f'edit_{table.item}', id=id),
+        })
+    return results
+
+snapshots = SnapshotStore(SNAPSHOT_DIR, max_entries=SNAPSHOT_MAX_ENTRIES,
+                          profile_entries=SNAPSHOT_PROFILE_ENTRIES)
+
+# Refreshes queries answered from a snapshot, off the request path
+revalidate_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='revalidate')
+revalidating = set()
+revalidating_lock = threading.Lock()
+
+def keeps_snapshot(method, args):
+    """Whether to snapshot ``method(*args)``: whole lists and first pages.
+
+    Later pages (``find`` with an ``after`` id) are too many to keep, and a
+    visitor reaches them from the first one.
+    """
+    return method != 'find' or args[4] is None  # find(profile_id, filters, sort, descending, after, ...)
+
+def fresh_rows(repo, method, args, generation):
+    """Query the database; ``generation`` is the table's, as the query cache read it before."""
+    rows = getattr(repo, method)(*args)
+    if keeps_snapshot(method, args):
+        snapshots.save(repo.table.name, (method, args), rows, generation, profile=args[0])
+    return rows
+
+def stale_rows(repo, method, args):
+    """The last rows ``repo.<method>(*args)`` returned, or None; queues a refresh."""
+    snapshot = snapshots.get(repo.table.name, (method, args), repo.table.row._make, profile=args[0])
+    if snapshot is None:
+        return None
+    key = (repo.table.name, method, args)
+    with revalidating_lock:
+        queued = key in revalidating
+        revalidating.add(key)
+    if not queued:
+        revalidate_executor.submit(revalidate, repo, method, args)
+    return snapshot[1]
+
+def revalidate(repo, method, args):
+    table, key = repo.table.name, (method, args)
+    try:
+        found, _, generation = query_cache.lookup(table, key, profile=args[0])
+        if not found:
+            query_cache.store(table, key, generation, fresh_rows(repo, method, args, generation), profile=args[0])
+    except (DatabaseUnavailable, *DatabaseError):
+        pass  # Still down; the next stale read queues another try
+    finally:
+        with revalidating_lock:
+            revalidating.discard((repo.table.name, method, args))
+
+def cached_rows(repo, method, *args):
+    """``repo.<method>(*args)``, served from the query cache when possible.
+
+    The first argument is the profile id, which also picks the cache
+    partition. If the query fails, or the circuit breaker is open and it
+    would fail anyway, the rows it returned last are served from the
+    snapshot store and it is retried in the background.
+    """
+    table, key = repo.table.name, (method, args)
+    found, rows, generation = query_cache.lookup(table, key, profile=args[0])
+    if found:
+        return rows
+    if not db_breaker.closed:
+        rows = stale_rows(repo, method, args)
+        if rows is not None:
+            return rows
+    try:
+        rows = fresh_rows(repo, method, args, generation)
+    except (DatabaseUnavailable, *DatabaseError):
+        rows = stale_rows(repo, method, args)
+        if rows is None:
+            raise
+        return rows
+    query_cache.store(table, key, generation, rows, profile=args[0])
+    return rows
+
+def list_request(repo, default_sort='id'):
+    """Query arguments of the current list request: ``(find_args, limit, stream)``.
+
+    ``?sort=column`` (``-column`` for descending, ``default_sort`` if
+    absent) and the table's filters become an indexed ``WHERE``/``ORDER
+    BY``. Pages are fetched by seeking past the last row's sort value and
+    id (``?key=`` and ``?after=``), so every page costs the same no matter
+    how deep it is. ``find_args`` are the arguments of ``Repository.find()``
+    between the profile id and ``limit``; a ``limit`` of 0 or less asks for
+    every row.
+    """
+    sort = request.args.get('sort', default_sort)
+    descending = sort.startswith('-')
+    sort = sort.lstrip('-')
+    filters = tuple((name, request.args[name]) for name in repo.table.filters if request.args.get(name))
+    after = request.args.get('after', type=int)
+    key = request.args.get('key') if after is not None else None
+    limit = request.args.get('limit', LIST_PAGE_SIZE, type=int)
+    if limit > 0:
+        limit = min(limit, LIST_MAX_LIMIT)
+    stream = bool(request.args.get('stream', 0, type=int))
+    return (filters, sort, descending, after, key), limit, stream
+
+def next_page(rows, limit, sort):
+    """This page's rows and the query args of the next page.
+
+    ``rows`` were fetched with ``limit + 1``; the extra row only tells
+    whether there is another page.
+    """
+    if limit <= 0 or len(rows) <= limit:
+        return rows, None
+    last = rows[limit - 1]
+    next_args = request.args.to_dict()
+    next_args['after'] = last.id
+    next_args.pop('key', None)
+    if sort != 'id' and getattr(last, sort) is not None:
+        next_args['key'] = json_value(getattr(last, sort))
+    return rows[:limit], next_args
+
+def list_rows(repo):
+    """Rows for the current list request and the query args of the next page.
+
+    See ``list_request()`` for the query arguments; ``?stream=1`` returns
+    a live cursor over every matching row instead. Raises ``ValueError``
+    for a sort or filter the table does not support.
+    """
+    find_args, limit, stream = list_request(repo)
+    filters, sort, descending, after, key = find_args
+    profile_id = g.profile.id
+    if stream:
+        return repo.stream(profile_id, filters=filters, sort=sort, descending=descending, after=after, key=key), None
+    if limit <= 0:
+        return cached_rows(repo, 'find', profile_id, *find_args), None
+    return next_page(cached_rows(repo, 'find', profile_id, *find_args, limit + 1), limit, sort)
+
+# Loads the CV sections side by side, one pooled connection each
+section_executor = ThreadPoolExecutor(max_workers=len(schema.CV_SECTIONS), thread_name_prefix='cv-section')
+
+def load_cv(profile_id):
+    """Rows of every CV section of a profile, queried concurrently.
+
+    Each section is read through the query cache on its own pooled
+    connection, so the whole CV takes about as long as the slowest query.
+    """
+    futures = {
+        table.endpoint: section_executor.submit(metrics.bind(cached_rows), repositories[table.resource], 'all',
+                                                profile_id)
+        for table in schema.CV_SECTIONS
+    }
+    return {name: future.result() for name, future in futures.items()}
+
+def cv_json(cv_data):
+    """``load_cv()``'s rows as JSON-ready dicts."""
+    return {
+        name: [{column: json_value(value) for column, value in row._asdict().items()} for row in rows]
+        for name, rows in cv_data.items()
+    }
+
+def make_static_site(output_dir=None):
+    # limit=0: a static list page holds every row, as it cannot follow ?after=
+    return static_site.StaticSite(app, output_dir or STATIC_EXPORT_DIR or 'build', STATIC_PAGES,
+                                  profile_directory.slugs, query='limit=0',
+                                  static_dirs=[app.static_folder, asset_pipeline.directory])
+
+static_export = make_static_site() if STATIC_EXPORT_DIR else None
+
+app.register_blueprint(make_api_blueprint(
+    repositories,
+    current_profile,
+    batch_size=API_BATCH_SIZE,
+    max_items=API_MAX_ITEMS,
+    page_size=LIST_PAGE_SIZE or 100
+))
+
+app.register_blueprint(transfer.make_transfer_blueprint(repositories, current_profile, batch_size=API_BATCH_SIZE))
+if PROFILE_TOKEN:
+    app.register_blueprint(make_profile_blueprint(profiler))
+transfer.init_cli(app, repositories, profile_directory, DEFAULT_PROFILE_SLUG, batch_size=API_BATCH_SIZE)
+profiles.init_cli(app, profile_directory)
+migrations.init_cli(app, storage_backend,
+                    [repositories[table.resource] for table in schema.CV_SECTIONS + (schema.CONTACT,)])
+static_site.init_cli(app, make_static_site)
+assets.init_cli(app, asset_pipeline)
+
+if THROTTLE_BACKEND == 'sqlite':
+    throttle_store = SQLiteThrottleStore(THROTTLE_SQLITE_PATH)
+else:
+    throttle_store = LocalThrottleStore(max_clients=THROTTLE_MAX_CLIENTS)
+
+contact_throttle = ContactThrottle(
+    throttle_store,
+    ip_burst=CONTACT_IP_BURST,
+    ip_refill=CONTACT_IP_REFILL,
+    global_burst=CONTACT_GLOBAL_BURST,
+    global_refill=CONTACT_GLOBAL_REFILL,
+    duplicate_window=CONTACT_DUPLICATE_WINDOW
+)
+
+contact_writer = ContactWriter(
+    get_db_connection,
+    max_depth=CONTACT_QUEUE_SIZE,
+    batch_size=CONTACT_BATCH_SIZE,
+    spool_path=CONTACT_SPOOL_PATH,
+    on_flush=lambda: table_changed('Contact')
+)
+
+contact_archiver = retention.ContactArchiver(
+    get_db_connection,
+    storage_backend.name,
+    CONTACT_ARCHIVE_DIR or os.path.join(app.instance_path, 'contact-archive'),
+    max_age_days=CONTACT_RETENTION_DAYS,
+    batch_size=CONTACT_ARCHIVE_BATCH,
+    interval=CONTACT_ARCHIVE_INTERVAL,
+    on_change=lambda: table_changed('Contact')
+)
+retention.init_cli(app, contact_archiver)
+
+metrics.registry.gauges('cv_db_pool', 'Database connection pool', lambda: db_pool.stats())
+metrics.registry.gauges('cv_db_breaker', 'Database circuit breaker', lambda: db_breaker.stats())
+metrics.registry.gauges('cv_snapshots', 'List snapshots', lambda: snapshots.stats())
+metrics.registry.gauges('cv_query_cache', 'Query cache', lambda: query_cache.stats())
+metrics.registry.gauges('cv_contact_queue', 'Contact write-behind queue', lambda: contact_writer.stats())
+metrics.registry.gauges('cv_contact_throttle', 'Contact form throttling', lambda: contact_throttle.stats())
+metrics.registry.gauges('cv_contact_archive', 'Contact message retention', lambda: contact_archiver.stats())
+metrics.registry.gauges('cv_profiles', 'Profile directory', lambda: profile_directory.stats())
+metrics.registry.gauges('cv_search_index', 'Search indexes', lambda: search_indexes.stats())
+metrics.registry.gauges('cv_compression', 'Response compression', lambda: compressor.stats())
+if profiler.enabled:
+    metrics.registry.gauges('cv_profiler', 'Request profiler', lambda: profiler.stats())
+if static_export:
+    metrics.registry.gauges('cv_static_site', 'Static export', lambda: static_export.stats())
+
+def render_list(template_name, rows, **context):
+    """Render a list page, streaming it if ``rows`` is a live cursor."""
+    if isinstance(rows, list):
+        return render_template(template_name, **context)
+    return app.response_class(stream_template(template_name, **context))
+
+def profile_error(message, status):
+    """Stop the request with an error page, or a JSON error for the APIs."""
+    if request.blueprint in ('api_v1', 'transfer'):
+        abort(make_response(jsonify(error=message), status))
+    abort(make_response(render_template('error.html', error_message=message), status))
+
+# Every URL that starts with a profile slug runs for that profile
+@app.url_value_preprocessor
+def pull_profile(endpoint, values):
+    if not values or 'profile' not in values:
+        return
+    slug = values.pop('profile')
+    try:
+        profile = profile_directory.get(slug)
+    except DatabaseUnavailable:
+        profile_error("Database connection failed.", 503)
+    except DatabaseError as err:
+        print(f"Error looking up profile {slug!r}: {err}")
+        profile_error("Unable to load the profile.", 500)
+    if profile is None:
+        profile_error("No such profile.", 404)
+    g.profile = profile
+
+# url_for() stays within the current profile, or the default one. A list
+# page builds a few URLs per row, so which endpoints take a profile is
+# worked out once each
+profile_endpoints = {}
+
+@app.url_defaults
+def add_profile(endpoint, values):
+    expects = profile_endpoints.get(endpoint)
+    if expects is None:
+        expects = profile_endpoints[endpoint] = app.url_map.is_endpoint_expecting(endpoint, 'profile')
+    if expects and 'profile' not in values:
+        profile = g.get('profile')
+        values['profile'] = profile.slug if profile is not None else DEFAULT_PROFILE_SLUG
 
-    if request.method == 'POST':
-        school = request.form['school']
-        achievement = request.form['achievement']
-        start_year = request.form['start_year']
-        end_year = request.form['end_year']
-        description = request.form['description']
 
-        if mydb:
-            try:
-                cursor = mydb.cursor()
-                sql = """
-                    UPDATE Education
-                    SET school=%s, achievement=%s, start_year=%s, end_year=%s, description=%s
-                    WHERE id=%s
-                """
-                values = (school, achievement, start_year, end_year, description, id)
-                cursor.execute(sql, values)
-                mydb.commit()
-
-                cursor.close()
-                mydb.close()
-
-                return redirect(url_for('education'))
-            except mysql.connector.Error as err:
-                return render_template('error.html', error_message="Unable to update education.")
-        else:
-            return render_template('error.html', error_message="Database connection failed.")
-    else:
-        if mydb:
-            cursor = mydb.cursor()
-            sql = "SELECT school, achievement, start_year, end_year, description FROM Education WHERE id=%s"
-            cursor.execute(sql, (id,))
-            education_data = cursor.fetchone()
-
-            cursor.close()
-            mydb.close()
-
-            return render_template('edit_education.html', education=education_data)
-        else:
-            return render_template('error.html', error_message="Database connection failed.")
+# Home Page Route
+@conditional(query_cache, 'Personal_Info', cache_control_for('home'), profile=current_profile_id, release=release)
+def home():
+    try:
+        info = cached_rows(repositories['personal-info'], 'page', g.profile.id, 0, 1)
+    except DatabaseUnavailable:
+        return render_template('error.html', error_message="Database connection failed."), 503
+    except DatabaseError as err:
+        print(f"Error fetching personal info: {err}")
+        return render_template('error.html', error_message="Unable to load the profile."), 500
+    return render_template('index.html', profile=g.profile, info=info[0] if info else None)
 
-# Route to Delete Education
-@app.route('/delete-education/<int:id>', methods=['GET'])
-def delete_education(id):
-    mydb = get_db_connection()
+app.add_url_rule('/<profile>/', 'home', home)
 
-    if mydb:
-        try:
-            cursor = mydb.cursor()
-            sql = "DELETE FROM Education WHERE id = %s"
-            cursor.execute(sql, (id,))
-            mydb.commit()
-            cursor.close()
-            mydb.close()
-            return redirect(url_for('education'))
-        except mysql.connector.Error as err:
-            print(f"Error deleting education: {err}")
-            return render_template('error.html', error_message="Unable to delete the education.")
-    else:
-        return render_template('error.html', error_message="Database connection failed.")
-
-
-# Work Experience Page Route
-@app.route('/work-experience')
-def work_experience():
-    mydb = get_db_connection()
-    if mydb:
+# The default profile's home page
+@app.route('/')
+def index():
+    return redirect(url_for('home', profile=DEFAULT_PROFILE_SLUG))
+
+# Paths from before there were profiles now belong to the default one
+def legacy_redirect(endpoint):
+    def view():
+        return redirect(url_for(endpoint, profile=DEFAULT_PROFILE_SLUG, **request.args.to_dict(flat=False)), 301)
+    return view
+
+for legacy_endpoint in [table.endpoint for table in schema.CV_SECTIONS] + ['cv', 'api_cv', 'search', 'contact']:
+    legacy_path = '/api/cv' if legacy_endpoint == 'api_cv' else '/' + legacy_endpoint.replace('_', '-')
+    app.add_url_rule(legacy_path, f'legacy_{legacy_endpoint}', legacy_redirect(legacy_endpoint))
+
+# Profile directory statistics
+@app.route('/profiles-stats')
+def profiles_stats():
+    return jsonify(profile_directory.stats())
+
+# Prometheus metrics
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+# Connection pool statistics
+@app.route('/pool-stats')
+def pool_stats():
+    return jsonify(dict(db_pool.stats(), breaker=db_breaker.stats(), snapshots=snapshots.stats()))
+
+# Contact queue statistics
+@app.route('/contact-queue-stats')
+def contact_queue_stats():
+    return jsonify(contact_writer.stats())
+
+# Contact form throttling statistics
+@app.route('/contact-throttle-stats')
+def contact_throttle_stats():
+    return jsonify(contact_throttle.stats())
+
+# Contact retention statistics
+@app.route('/contact-archive-stats')
+def contact_archive_stats():
+    return jsonify(contact_archiver.stats())
+
+# Query cache statistics
+@app.route('/cache-stats')
+def cache_stats():
+    return jsonify(query_cache.stats())
+
+
+def register_table_routes(repo):
+    """List, add, edit and delete routes for one CV section.
+
+    URLs, endpoint names and templates follow the section's table
+    definition, e.g. ``/skills`` (``skills``), ``/add-skill``,
+    ``/edit-skill/<id>`` and ``/delete-skill/<id>`` for ``Skills``.
+    """
+    table = repo.table
+    item_url = table.item.replace('_', '-')
+    noun = table.label.lower()
+
+    # List page
+    @conditional(query_cache, table.name, cache_control_for(table.endpoint), profile=current_profile_id,
+                 release=release)
+    def list_view():
         try:
-            cursor = mydb.cursor()
-            cursor.execute("SELECT company, position, start_year, end_year, description, id FROM Work_Experience")
-            work_experience_data = cursor.fetchall()  # Fetch all the records
-            cursor.close()  # Close the cursor
-            mydb.close()    # Close the connection
-            return render_template('work_experience.html', work_experience=work_experience_data)
-        except mysql.connector.Error as err:
-            print(f"Error fetching work experience data: {err}")
-            return render_template('error.html', error_message="Unable to load work experience data.")
-    else:
-        return render_template('error.html', error_message="Database connection failed.")
-
-# Route to Add New Work Experience
-@app.route('/add-work-experience', methods=['GET', 'POST'])
-def add_work_experience():
-    if request.method == 'POST':
-        company = request.form['company']
-        position = request.form['position']
-        start_year = request.form['start_year']
-        end_year = request.form['end_year']
-        description = request.form['description']
-
-        # Connect to the database and insert new entry
-        mydb = get_db_connection()
-        if mydb:
-            try:
-                cursor = mydb.cursor()
-                sql = "INSERT INTO Work_Experience (company, position, start_year, end_year, description) VALUES (%s, %s, %s, %s, %s)"
-                values = (company, position, start_year, end_year, description)
-                cursor.execute(sql, values)
-                mydb.commit()
-                cursor.close()
-                mydb.close()
-
-                # Redirect back to the Work Experience page after adding the entry
-                return redirect(url_for('work_experience'))
-            except mysql.connector.Error as err:
-                print(f"Error inserting work experience: {err}")
-                return render_template('error.html', error_message="Unable to add work experience.")
-        else:
-            return render_template('error.html', error_message="Database connection failed.")
-    
-    # Render the form to add a new work experience if the request is GET
-    return render_template('add_work_experience.html')
-    
-# Route to Edit Work Experience    
-@app.route('/edit-work-experience/<int:id>', methods=['GET', 'POST'])
-def edit_work_experience(id):
-    mydb = get_db_connection()
-
-    if request.method == 'POST':
-        company = request.form['company']
-        position = request.form['position']
-        start_year = request.form['start_year']
-        end_year = request.form['end_year']
-        description = request.form['description']
-
-        if mydb:
+            rows, next_page = list_rows(repo)
+        except ValueError as err:
+            return render_template('error.html', error_message=str(err)), 400
+        except DatabaseUnavailable:
+            return render_template('error.html', error_message="Database connection failed."), 503
+        except DatabaseError as err:
+            print(f"Error fetching {noun}: {err}")
+            return render_template('error.html', error_message=f"Unable to load {noun}."), 500
+        next_url = url_for(table.endpoint, **next_page) if next_page else None
+        return render_list(f'{table.endpoint}.html', rows, next_url=next_url, **{table.endpoint: rows})
+
+    # Add a row
+    def add_view():
+        if request.method == 'POST':
             try:
-                cursor = mydb.cursor()
-                sql = """
-                    UPDATE Work_Experience
-                    SET company=%s, position=%s, start_year=%s, end_year=%s, description=%s
-                    WHERE id=%s
-                """
-                values = (company, position, start_year, end_year, description, id)
-                cursor.execute(sql, values)
-                mydb.commit()
-
-                cursor.close()
-                mydb.close()
-
-                # Redirect to work experience page after successful update
-                return redirect(url_for('work_experience'))
-            except mysql.connector.Error as err:
-                return render_template('error.html', error_message="Unable to update work experience.")
-        else:
-            return render_template('error.html', error_message="Database connection failed.")
-
-    else:
-        if mydb:
-            cursor = mydb.cursor()
-            sql = "SELECT company, position, start_year, end_year, description FROM Work_Experience WHERE id=%s"
-            cursor.execute(sql, (id,))
-            work_experience_data = cursor.fetchone()
-
-            cursor.close()
-            mydb.close()
-
-            return render_template('edit_work_experience.html', work_experience=work_experience_data)
-        else:
-            return render_template('error.html', error_message="Database connection failed.")
-
-# Route to Delete New Work Experience 
-@app.route('/delete-work-experience/<int:id>', methods=['GET'])
-def delete_work_experience(id):
-    mydb = get_db_connection()
-
-    if mydb:
-        try:
-            cursor = mydb.cursor()
-            sql = "DELETE FROM Work_Experience WHERE id = %s"
-            cursor.execute(sql, (id,))
-            mydb.commit()
-            cursor.close()
-            mydb.close()
-            return redirect(url_for('work_experience'))
-        except mysql.connector.Error as err:
-            print(f"Error deleting work experience: {err}")
-            return render_template('error.html', error_message="Unable to delete the work experience.")
-    else:
-        return render_template('error.html', error_message="Database connection failed.")
-
-
-
-# Skills Page Route
-@app.route('/skills')
-def skills():
-    mydb = get_db_connection()
-    if mydb:
+                repo.insert(g.profile.id, repo.values_from(request.form))
+            except DatabaseUnavailable:
+                return render_template('error.html', error_message="Database connection failed.")
+            except DatabaseError as err:
+                print(f"Error inserting {noun}: {err}")
+                return render_template('error.html', error_message=f"Unable to add {noun}.")
+            return redirect(url_for(table.endpoint))
+
+        return render_template(f'add_{table.item}.html')
+
+    # Edit a row
+    def edit_view(id):
         try:
-            cursor = mydb.cursor()
-            cursor.execute("SELECT skill_name, category, proficiency_level, id FROM Skills")
-            skills_data = cursor.fetchall()  # Fetch all records
-            cursor.close()  # Close the cursor
-            mydb.close()    # Close the connection
-            return render_template('skills.html', skills=skills_data)
-        except mysql.connector.Error as err:
-            return render_template('error.html', error_message="Unable to load skills data.")
-    else:
-        return render_template('error.html', error_message="Database connection failed.")
-
-# Route to Add New Skill
-@app.route('/add-skill', methods=['GET', 'POST'])
-def add_skill():
-    if request.method == 'POST':
-        skill_name = request.form['skill_name']
-        proficiency_level = request.form['proficiency_level']
-
-        mydb = get_db_connection()
-        if mydb:
-            try:
-                cursor = mydb.cursor()
-                sql = "INSERT INTO Skills (skill_name, category, proficiency_level) VALUES (%s,%s, %s)"
-                values = (skill_name, category, proficiency_level)
-                cursor.execute(sql, values)
-                mydb.commit()
-                cursor.close()
-                mydb.close()
-
-                return redirect(url_for('skills'))
-            except mysql.connector.Error as err:
-                return render_template('error.html', error_message="Unable to add skill.")
-        else:
-            return render_template('error.html', error_message="Database connection failed.")
-
-    return render_template('add_skill.html')
-
-# Route to Edit Skill
-@app.route('/edit-skill/<int:id>', methods=['GET', 'POST'])
-def edit_skill(id):
-    mydb = get_db_connection()
-
-    if request.method == 'POST':
-        skill_name = request.form['skill_name']
-        category = request.form['category']
-        proficiency_level = request.form['proficiency_level']
-
-        if mydb:
-            try:
-                cursor = mydb.cursor()
-                sql = """
-                    UPDATE Skills
-                    SET skill_name=%s, category=%s, proficiency_level=%s
-                    WHERE id=%s
-                """
-                values = (skill_name, category, proficiency_level, id)
-                cursor.execute(sql, values)
-                mydb.commit()
-
-                cursor.close()
-                mydb.close()
-
-                return redirect(url_for('skills'))
-            except mysql.connector.Error as err:
-                return render_template('error.html', error_message="Unable to update skill.")
-        else:
+            if request.method == 'POST':
+                repo.update(g.profile.id, id, repo.values_from(request.form))
+                return redirect(url_for(table.endpoint))
+            row = repo.get(g.profile.id, id)
+        except DatabaseUnavailable:
             return render_template('error.html', error_message="Database connection failed.")
-    else:
-        if mydb:
-            cursor = mydb.cursor()
-            sql = "SELECT skill_name, category, proficiency_level FROM Skills WHERE id=%s"
-            cursor.execute(sql, (id,))
-            skill_data = cursor.fetchone()
-
-            cursor.close()
-            mydb.close()
-
-            return render_template('edit_skill.html', skill=skill_data)
-        else:
-            return render_template('error.html', error_message="Database connection failed.")
-
-# Route to Delete Skill
-@app.route('/delete-skill/<int:id>', methods=['GET'])
-def delete_skill(id):
-    mydb = get_db_connection()
-
-    if mydb:
+        except DatabaseError as err:
+            print(f"Error updating {noun}: {err}")
+            return render_template('error.html', error_message=f"Unable to update {noun}.")
+        if row is None:
+            return render_template('error.html', error_message="Record not found."), 404
+        return render_template(f'edit_{table.item}.html', **{table.item: row})
+
+    # Delete a row
+    def delete_view(id):
         try:
-            cursor = mydb.cursor()
-            sql = "DELETE FROM Skills WHERE id = %s"
-            cursor.execute(sql, (id,))
-            mydb.commit()
-            cursor.close()
-            mydb.close()
-
-            return redirect(url_for('skills'))
-        except mysql.connector.Error as err:
-            return render_template('error.html', error_message="Unable to delete the skill.")
-    else:
-        return render_template('error.html', error_message="Database connection failed.")
-
-
-
-# Projects Page Route
-@app.route('/projects')
-def projects():
-    mydb = get_db_connection()
-    if mydb:
-        try:
-            cursor = mydb.cursor()
-            cursor.execute("SELECT project_name, description, start_date, end_date, id FROM Projects")
-            projects_data = cursor.fetchall()  # Fetch all records
-            cursor.close()  # Close the cursor
-            mydb.close()    # Close the connection
-            return render_template('projects.html', projects=projects_data)
-        except mysql.connector.Error as err:
-            print(f"Error fetching projects data: {err}")
-            return render_template('error.html', error_message="Unable to load projects data.")
-    else:
-        return render_template('error.html', error_message="Database connection failed.")
-
-# Route to Add New Project
-@app.route('/add-project', methods=['GET', 'POST'])
-def add_project():
-    if request.method == 'POST':
-        project_name = request.form['project_name']
-        description = request.form['description']
-        start_year = request.form['start_date']
-        end_year = request.form['end_date']
-
-        mydb = get_db_connection()
-        if mydb:
-            try:
-                cursor = mydb.cursor()
-                sql = "INSERT INTO Projects (project_name, description, start_date, end_date) VALUES (%s, %s, %s, %s)"
-                values = (project_name, description, start_date, end_date)
-                cursor.execute(sql, values)
-                mydb.commit()
-                cursor.close()
-                mydb.close()
-                return redirect(url_for('projects'))
-            except mysql.connector.Error as err:
-                print(f"Error inserting project: {err}")
-                return render_template('error.html', error_message="Unable to add project.")
-        else:
+            repo.delete(g.profile.id, id)
+        except DatabaseUnavailable:
             return render_template('error.html', error_message="Database connection failed.")
-    
-    return render_template('add_project.html')
-
-# Route to Edit Project
-@app.route('/edit-project/<int:id>', methods=['GET', 'POST'])
-def edit_project(id):
-    mydb = get_db_connection()
-
-    if request.method == 'POST':
-        project_name = request.form['project_name']
-        description = request.form['description']
-        start_date = request.form['start_date']
-        end_date = request.form['end_date']
-
-        if mydb:
-            try:
-                cursor = mydb.cursor()
-                sql = """
-                    UPDATE Projects
-                    SET project_name=%s, description=%s, start_date=%s, end_date=%s
-                    WHERE id=%s
-                """
-                values = (project_name, description, start_date, end_date, id)
-                cursor.execute(sql, values)
-                mydb.commit()
-
-                cursor.close()
-                mydb.close()
-
-                return redirect(url_for('projects'))
-            except mysql.connector.Error as err:
-                return render_template('error.html', error_message="Unable to update project.")
-        else:
-            return render_template('error.html', error_message="Database connection failed.")
-    else:
-        if mydb:
-            cursor = mydb.cursor()
-            sql = "SELECT project_name, description, start_date, end_date FROM Projects WHERE id=%s"
-            cursor.execute(sql, (id,))
-            project_data = cursor.fetchone()
-
-            cursor.close()
-            mydb.close()
-
-            return render_template('edit_project.html', project=project_data)
-        else:
-            return render_template('error.html', error_message="Database connection failed.")
-
-# Route to Delete Project
-@app.route('/delete-project/<int:id>', methods=['GET'])
-def delete_project(id):
-    mydb = get_db_connection()
-
-    if mydb:
-        try:
-            cursor = mydb.cursor()
-            sql = "DELETE FROM Projects WHERE id = %s"
-            cursor.execute(sql, (id,))
-            mydb.commit()
-            cursor.close()
-            mydb.close()
-            return redirect(url_for('projects'))
-        except mysql.connector.Error as err:
-            print(f"Error deleting project: {err}")
-            return render_template('error.html', error_message="Unable to delete the project.")
-    else:
-        return render_template('error.html', error_message="Database connection failed.")
+        except DatabaseError as err:
+            print(f"Error deleting {noun}: {err}")
+            return render_template('error.html', error_message=f"Unable to delete the {noun}.")
+        return redirect(url_for(table.endpoint))
+
+    app.add_url_rule('/<profile>/' + table.resource, table.endpoint, list_view)
+    app.add_url_rule(f'/<profile>/add-{item_url}', f'add_{table.item}', add_view, methods=['GET', 'POST'])
+    app.add_url_rule(f'/<profile>/edit-{item_url}/<int:id>', f'edit_{table.item}', edit_view, methods=['GET', 'POST'])
+    app.add_url_rule(f'/<profile>/delete-{item_url}/<int:id>', f'delete_{table.item}', delete_view, methods=['GET'])
+
+# Search Page Route
+@app.route('/<profile>/search')
+def search():
+    query = request.args.get('q', '').strip()
+    try:
+        results = search_results(query, SEARCH_RESULTS) if query else []
+    except (DatabaseUnavailable, *DatabaseError, RuntimeError) as err:
+        print(f"Error building search index: {err}")
+        return render_template('error.html', error_message="Search is unavailable. Please try again in a moment."), 503, {'Retry-After': '5'}
+    return render_template('search.html', query=query, results=results)
+
+# Search suggestions as JSON, for typeahead
+@app.route('/<profile>/search/suggest')
+def search_suggest():
+    query = request.args.get('q', '').strip()
+    limit = max(1, min(request.args.get('limit', SEARCH_SUGGESTIONS, type=int), SEARCH_RESULTS))
+    try:
+        results = search_results(query, limit) if query else []
+    except (DatabaseUnavailable, *DatabaseError, RuntimeError) as err:
+        print(f"Error building search index: {err}")
+        return jsonify(error="Search is unavailable."), 503, {'Retry-After': '5'}
+    return jsonify(query=query, results=results)
+
+# Search index statistics
+@app.route('/search-stats')
+def search_stats():
+    return jsonify(search_indexes.stats())
+
+# Template load and render times
+@app.route('/template-stats')
+def template_stats():
+    return jsonify(template_cache.report(template_load_times))
+
+# Personal Information, Education, Work Experience, Skills and Projects pages
+for cv_table in schema.CV_SECTIONS:
+    register_table_routes(repositories[cv_table.resource])
+
+# Full CV Page Route
+@app.route('/<profile>/cv')
+@conditional(query_cache, CV_TABLES, cache_control_for('cv'), profile=current_profile_id, release=release)
+def cv():
+    try:
+        cv_data = load_cv(g.profile.id)
+    except DatabaseUnavailable:
+        return render_template('error.html', error_message="Database connection failed."), 503
+    except DatabaseError as err:
+        print(f"Error fetching CV: {err}")
+        return render_template('error.html', error_message="Unable to load the CV."), 500
+    return render_template('cv.html', **cv_data)
+
+# Full CV as JSON
+@app.route('/<profile>/api/cv')
+@conditional(query_cache, CV_TABLES, cache_control_for('api_cv'), profile=current_profile_id, release=release)
+def api_cv():
+    try:
+        cv_data = load_cv(g.profile.id)
+    except DatabaseUnavailable:
+        return jsonify(error="Database connection failed."), 503
+    except DatabaseError as err:
+        print(f"Error fetching CV: {err}")
+        return jsonify(error="Unable to load the CV."), 500
+    return jsonify(cv_json(cv_data))
 
 
 # Contact Form Route
-@app.route('/contact', methods=['GET', 'POST'])
+@app.route('/<profile>/contact', methods=['GET', 'POST'])
 def contact():
     if request.method == 'POST':
         name = request.form['name']
         email = request.form['email']
         message = request.form['message']
 
-        mydb = get_db_connection()
-        if mydb:
+        # Turned away before any queue or database work
+        verdict, retry_after = contact_throttle.check(request.remote_addr or '', g.profile.id, name, email, message)
+        if verdict == 'duplicate':
+            return redirect(url_for('home'))  # Already received; a second copy adds nothing
+        if verdict != 'ok':
+            return render_template('error.html', error_message="You are sending messages too quickly. Please try again later."), 429, {'Retry-After': str(math.ceil(retry_after))}
+
+        if CONTACT_ASYNC:
             try:
-                cursor = mydb.cursor()
-                sql = "INSERT INTO Contact (name, email, message) VALUES (%s, %s, %s)"
-                values = (name, email, message)
-                cursor.execute(sql, values)
-                mydb.commit()
-                cursor.close()  # Close the cursor
-                mydb.close()    # Close the connection
-                return redirect(url_for('home'))
-            except mysql.connector.Error as err:
-                print(f"Error submitting contact form: {err}")
-                return render_template('error.html', error_message="Unable to submit your message. Please try again.")
-        else:
+                contact_writer.submit(g.profile.id, name, email, message)
+            except QueueFull as err:
+                print(f"Error queueing contact form: {err}")
+                contact_throttle.forget(g.profile.id, name, email, message)
+                return render_template('error.html', error_message="We are receiving a lot of messages right now. Please try again in a minute."), 503, {'Retry-After': '60'}
+            return redirect(url_for('home'))
+
+        try:
+            repositories['contact'].insert(g.profile.id, (name, email, message))
+        except DatabaseUnavailable:
+            contact_throttle.forget(g.profile.id, name, email, message)
             return render_template('error.html', error_message="Database connection failed.")
+        except DatabaseError as err:
+            print(f"Error submitting contact form: {err}")
+            contact_throttle.forget(g.profile.id, name, email, message)
+            return render_template('error.html', error_message="Unable to submit your message. Please try again.")
+        return redirect(url_for('home'))
 
     return render_template('contact.html')
 
-if __name__ == "__main__":
-    app.run(debug=True)
+# Contact inbox of a profile, newest first. Messages are private, so they
+# are read straight from the database: never through the query cache or
+# into snapshots, and never stored by the browser. The token opens the
+# inbox of every profile
+def inbox():
+    auth = request.authorization
+    if auth is None or not hmac.compare_digest(auth.password or '', INBOX_TOKEN):
+        return Response("Sign in with the inbox token as the password.", 401,
+                        {'WWW-Authenticate': 'Basic realm="inbox"'})
+    repo = repositories['contact']
+    try:
+        find_args, limit, _ = list_request(repo, default_sort='-created_at')
+        if limit <= 0:
+            limit = LIST_PAGE_SIZE or 100  # Every message ever received is too many for one page
+        messages, next_args = next_page(repo.find(g.profile.id, *find_args, limit + 1), limit, find_args[1])
+    except ValueError as err:
+        return render_template('error.html', error_message=str(err)), 400
+    except DatabaseUnavailable:
+        return render_template('error.html', error_message="Database connection failed."), 503
+    except DatabaseError as err:
+        print(f"Error fetching contact messages: {err}")
+        return render_template('error.html', error_message="Unable to load messages."), 500
+    next_url = url_for('inbox', **next_args) if next_args else None
+    return render_template('inbox.html', messages=messages, next_url=next_url), {'Cache-Control': 'private, no-store'}
+
+if INBOX_TOKEN:
+    app.add_url_rule('/<profile>/inbox', 'inbox', inbox)
+
+# Process lifecycle. Importing this module opens no connection and starts no
+# thread, so a server may import it once and fork workers from it (see
+# gunicorn.conf.py); each process then opens its own in start_worker()
+template_load_times = {}
+worker_pid = None
+worker_lock = threading.Lock()
+
+def create_app():
+    """Application factory: the app, with every template loaded.
+
+    A server that preloads the app calls this once in its master process,
+    so the workers forked from it share the compiled templates and routing
+    map instead of each building their own.
+    """
+    global template_load_times
+    if not template_load_times:
+        template_load_times = template_cache.warm_up(app)
+    return app
+
+@app.before_request
+def start_worker():
+    """Start this process's background work, once per process.
+
+    Builds (or loads from its snapshot) the default profile's search
+    index and starts the contact writer and the contact archiver.
+    Database connections are opened by the pool on first use, and the
+    caches begin empty, so all of them belong to the process that serves
+    from them.
+    gunicorn.conf.py calls this right after each fork; under any other
+    server it runs before the first request.
+    """
+    global worker_pid
+    if worker_pid == os.getpid():
+        return
+    with worker_lock:
+        if worker_pid == os.getpid():
+            return
+        worker_pid = os.getpid()
+    search_executor.submit(build_default_search_index)
+    if CONTACT_ASYNC:
+        contact_writer.start()
+    if CONTACT_RETENTION_DAYS > 0:
+        contact_archiver.start()
+    atexit.register(stop_worker)
+
+def stop_worker():
+    """Finish this process's background work before it exits."""
+    global worker_pid
+    with worker_lock:
+        if worker_pid != os.getpid():
+            return
+        worker_pid = None
+    contact_writer.stop()
+    contact_archiver.stop()
+    search_indexes.save_all()
+    try:
+        snapshots.wait()
+        if static_export:
+            static_export.wait()
+    except RuntimeError:
+        pass  # At interpreter exit the executors have already finished their work and shut down
+    db_pool.close_all()
 
+if __name__ == "__main__":
+    create_app().run(debug=True)
@@ -0,0 +1,527 @@
+"""ASGI entry point: ``uvicorn asgi:application``.
+
+``app.py`` stays the WSGI app (``gunicorn -c gunicorn.conf.py``); ``application`` here
+serves the same URLs from one event loop:
+
+* the pages that wait on the database for every uncached request (the
+  five section lists, ``/cv`` and ``/api/cv``) are coroutines that query
+  through an async connection pool: ``aiomysql`` on MySQL, and on SQLite,
+  whose queries never wait on a network, the sync pool driven from a few
+  threads. A slow query or a slow client parks a coroutine rather than a
+  thread, so one process keeps hundreds of connections open;
+* every other route (forms, writes, search, the JSON API, streamed
+  ``?stream=1`` lists, which hold a cursor while they are sent) runs the
+  Flask app unchanged on a bounded thread pool.
+
+The async views are the sync ones with ``await`` at the query: they reuse
+each ``Repository``'s SQL, share the query cache with the sync views, and
+run inside Flask's request context, so ``url_for``, conditional GETs, the
+templates, error pages and the ``after_request`` hooks (compression,
+metrics) behave exactly as under WSGI. The profile slug of an async view's
+URL, if this process has not seen it yet, is looked up through the async
+pool before the request context is entered.
+"""
+import asyncio
+import contextvars
+import io
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+from flask import g, jsonify, render_template, request, request_started, url_for
+from werkzeug.exceptions import HTTPException
+from werkzeug.routing import RequestRedirect
+
+import app as cv_app
+from http_cache import conditional
+import metrics
+from repository import DatabaseUnavailable
+import schema
+import storage
+
+try:
+    import aiomysql
+except ImportError:  # Only needed to serve a MySQL database from the ASGI app
+    aiomysql = None
+
+ASGI_DB_POOL_MIN = int(os.getenv('ASGI_DB_POOL_MIN', '1'))
+ASGI_DB_POOL_SIZE = int(os.getenv('ASGI_DB_POOL_SIZE', '20'))  # async connections, each held only while its query runs
+ASGI_SYNC_THREADS = int(os.getenv('ASGI_SYNC_THREADS', '16'))  # threads running the sync routes
+SEND_BUFFER_SIZE = 64 * 1024  # bytes of a streamed sync response collected per send
+
+# What the async views catch around queries
+if aiomysql is not None:
+    DatabaseError = (*storage.DatabaseError, aiomysql.Error)
+else:
+    DatabaseError = storage.DatabaseError
+
+
+class ClientDisconnected(Exception):
+    """The client went away before its request body arrived."""
+
+
+class AsyncMySQLPool:
+    """Non-blocking MySQL connections from ``aiomysql``."""
+
+    def __init__(self, minsize, maxsize, timeout, breaker=None, query_timeout=None, **params):
+        if aiomysql is None:
+            raise RuntimeError("The ASGI app on MySQL needs the aiomysql package")
+        self.minsize = minsize
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.breaker = breaker
+        if query_timeout:
+            params['init_command'] = f"SET SESSION max_execution_time = {int(query_timeout * 1000)}"
+        self.params = params
+        self._pool = None
+
+    async def start(self):
+        try:
+            self._pool = await aiomysql.create_pool(minsize=self.minsize, maxsize=self.maxsize,
+                                                    autocommit=True, **self.params)
+        except (aiomysql.Error, OSError) as err:
+            # Start anyway and connect on demand; pages are served from snapshots meanwhile
+            print(f"Error: {err}")
+            self._pool = await aiomysql.create_pool(minsize=0, maxsize=self.maxsize,
+                                                    autocommit=True, **self.params)
+
+    async def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            await self._pool.wait_closed()
+
+    async def fetchall(self, sql, params=()):
+        if self.breaker is not None and not self.breaker.allow():
+            raise DatabaseUnavailable()
+        start = time.perf_counter()
+        try:
+            conn = await asyncio.wait_for(self._pool.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            raise DatabaseUnavailable() from None
+        except Exception as err:
+            self._record(err)
+            raise
+        finally:
+            metrics.add_timing('connect', time.perf_counter() - start)
+        start = time.perf_counter()
+        try:
+            async with conn.cursor() as cursor:
+                await cursor.execute(sql, params)
+                rows = await cursor.fetchall()
+        except Exception as err:
+            self._record(err)
+            raise
+        finally:
+            self._pool.release(conn)
+            elapsed = time.perf_counter() - start
+            metrics.add_timing('query', elapsed)
+            metrics.query_duration.observe(elapsed, metrics.statement_label(sql))
+        self._record(None)
+        return rows
+
+    def _record(self, err):
+        if self.breaker is None:
+            return
+        # PyMySQL raises OperationalError for lost connections and timeouts
+        # (max_execution_time too), as storage.is_unavailable expects of mysql.connector
+        if isinstance(err, (aiomysql.OperationalError, aiomysql.InterfaceError, OSError)):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def stats(self):
+        if self._pool is None:
+            return {'size': 0, 'free': 0, 'max_size': self.maxsize}
+        return {'size': self._pool.size, 'free': self._pool.freesize, 'max_size': self.maxsize}
+
+
+class ThreadedPool:
+    """The sync connection pool, queried from the event loop through threads."""
+
+    def __init__(self, pool, get_db_connection, threads):
+        self.pool = pool
+        self.get_db_connection = get_db_connection
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='asgi-db')
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        self._executor.shutdown(wait=False)
+
+    def _fetchall(self, sql, params):
+        mydb = self.get_db_connection()
+        if not mydb:
+            raise DatabaseUnavailable()
+        with mydb:
+            cursor = mydb.prepared(sql)
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+    async def fetchall(self, sql, params=()):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, metrics.bind(self._fetchall), sql, params)
+
+    def stats(self):
+        return self.pool.stats()
+
+
+def create_pool():
+    if cv_app.STORAGE_BACKEND == 'mysql':
+        return AsyncMySQLPool(ASGI_DB_POOL_MIN, ASGI_DB_POOL_SIZE, cv_app.DB_POOL_TIMEOUT,
+                              breaker=cv_app.db_breaker, query_timeout=cv_app.DB_QUERY_TIMEOUT,
+                              host=cv_app.DB_HOST, user=cv_app.DB_USER,
+                              password=cv_app.DB_PASSWORD or '', db=cv_app.DB_NAME,
+                              connect_timeout=cv_app.DB_CONNECT_TIMEOUT)
+    return ThreadedPool(cv_app.db_pool, cv_app.get_db_connection, cv_app.DB_POOL_SIZE)
+
+
+class AsyncRepository:
+    """Async reads of one table, with the SQL of its sync ``Repository``."""
+
+    def __init__(self, repo, pool):
+        self.repo = repo
+        self.table = repo.table
+        self.pool = pool
+        self._make_row = repo.table.row._make
+
+    async def find(self, profile_id, filters=(), sort='id', descending=False, after=None, key=None, limit=None):
+        rows = await self.pool.fetchall(*self.repo.query(profile_id, filters, sort, descending, after, key, limit))
+        return list(map(self._make_row, rows))
+
+    async def all(self, profile_id, after=0):
+        return await self.find(profile_id, after=after)
+
+
+# WSGI <-> ASGI
+
+def wsgi_environ(scope, body=b''):
+    """The WSGI environ for an ASGI ``http`` scope."""
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', ()):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        environ[name] = environ[name] + ',' + value if name in environ else value
+    return environ
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise ClientDisconnected()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+def _headers(headers):
+    return [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+
+class WSGIBridge:
+    """Runs a WSGI app for an ASGI server, one request per thread of a bounded pool."""
+
+    def __init__(self, wsgi_app, threads):
+        self.wsgi_app = wsgi_app
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='asgi-sync')
+
+    async def __call__(self, scope, receive, send):
+        environ = wsgi_environ(scope, await read_body(receive))
+        loop = asyncio.get_running_loop()
+        # Each step runs on whichever thread is free, but all in one context,
+        # as a WSGI server would run them on one thread
+        context = contextvars.copy_context()
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            started[:] = [int(status.split(' ', 1)[0]), headers]
+
+        def read(chunks):
+            # A streamed template yields many small pieces; hand them to the
+            # loop in batches rather than one thread hop each
+            data = []
+            size = 0
+            for chunk in chunks:
+                data.append(chunk)
+                size += len(chunk)
+                if size >= SEND_BUFFER_SIZE:
+                    return b''.join(data), False
+            return b''.join(data), True
+
+        def call():
+            # The first batch is read here too, so the headers are known
+            result = self.wsgi_app(environ, start_response)
+            chunks = iter(result)
+            return result, chunks, *read(chunks)
+
+        result, chunks, data, done = await loop.run_in_executor(self._executor, context.run, call)
+        try:
+            status, headers = started
+            await send({'type': 'http.response.start', 'status': status, 'headers': _headers(headers)})
+            while not done:
+                await send({'type': 'http.response.body', 'body': data, 'more_body': True})
+                data, done = await loop.run_in_executor(self._executor, context.run, read, chunks)
+            await send({'type': 'http.response.body', 'body': data})
+        finally:
+            if hasattr(result, 'close'):
+                await loop.run_in_executor(self._executor, context.run, result.close)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+class ASGIApp:
+    """Serves ``views`` (``{endpoint: coroutine function}``) of ``flask_app``
+    in the event loop and all of its other routes on threads."""
+
+    def __init__(self, flask_app, views, pool, sync_threads=ASGI_SYNC_THREADS):
+        self.flask_app = flask_app
+        self.views = views
+        self.pool = pool
+        self.sync = WSGIBridge(flask_app, sync_threads)
+        self._started = False
+        self._start_lock = asyncio.Lock()
+        self._stats_lock = threading.Lock()
+        self.async_requests = 0
+        self.sync_requests = 0
+        self.in_flight = 0
+
+    async def startup(self):
+        async with self._start_lock:
+            if not self._started:
+                await self.pool.start()
+                self._started = True
+
+    async def shutdown(self):
+        if self._started:
+            await self.pool.close()
+            self._started = False
+        self.sync.close()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            raise RuntimeError(f"Unsupported ASGI scope type {scope['type']!r}")
+        self._count('in_flight', 1)
+        try:
+            environ = wsgi_environ(scope)
+            match = self._match(environ)
+            if match is None:
+                self._count('sync_requests', 1)
+                await self.sync(scope, receive, send)
+            else:
+                self._count('async_requests', 1)
+                if not self._started:
+                    await self.startup()  # Servers running without the lifespan protocol
+                await self._serve(environ, *match, send)
+        except ClientDisconnected:
+            pass
+        finally:
+            self._count('in_flight', -1)
+
+    def _count(self, name, amount):
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def _match(self, environ):
+        """``(view, view_args)`` for an async view, or None for the sync app."""
+        if environ['REQUEST_METHOD'] not in ('GET', 'HEAD'):
+            return None
+        try:
+            endpoint, view_args = self.flask_app.url_map.bind_to_environ(environ).match()
+        except (HTTPException, RequestRedirect):
+            return None  # 404s, 405s and redirects come from Flask as usual
+        view = self.views.get(endpoint)
+        if view is None:
+            return None
+        for name, value in parse_qsl(environ['QUERY_STRING']):
+            if name == 'stream' and value.lstrip('-').isdigit() and int(value):
+                return None  # Streamed straight from a cursor
+        return view, view_args
+
+    async def _find_profile(self, slug):
+        """Look ``slug`` up without blocking the loop, unless it is already known."""
+        directory = cv_app.profile_directory
+        if directory.cached(slug)[0]:
+            return
+        try:
+            directory.remember(slug, await self.pool.fetchall(directory.lookup_sql, (slug,)))
+        except (DatabaseUnavailable, *DatabaseError):
+            pass  # The app's own lookup reports it
+
+    async def _serve(self, environ, view, view_args, send):
+        """``Flask.full_dispatch_request`` with an awaited view."""
+        app = self.flask_app
+        if 'profile' in view_args:
+            await self._find_profile(view_args['profile'])
+        with app.request_context(environ):
+            try:
+                try:
+                    request_started.send(app, _async_wrapper=app.ensure_sync)
+                    rv = app.preprocess_request()
+                    if rv is None:
+                        # The URL value preprocessors have taken the profile out
+                        rv = await view(**request.view_args)
+                except Exception as err:
+                    rv = app.handle_user_exception(err)
+                response = app.finalize_request(rv)
+            except Exception as err:
+                response = app.handle_exception(err)
+            body = b'' if environ['REQUEST_METHOD'] == 'HEAD' else response.get_data()
+            headers = _headers(response.headers.items())
+            status = response.status_code
+            response.close()
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self.startup()
+                except Exception as err:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(err)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def stats(self):
+        return {
+            'async_requests': self.async_requests,
+            'sync_requests': self.sync_requests,
+            'in_flight': self.in_flight,
+            **{f'db_{name}': value for name, value in self.pool.stats().items()},
+        }
+
+
+db = create_pool()
+async_repositories = {resource: AsyncRepository(repo, db) for resource, repo in cv_app.repositories.items()}
+
+
+async def cached_rows(repo, method, *args):
+    """``await repo.<method>(*args)`` through the query cache and snapshots
+    the sync views use; see ``app.cached_rows``."""
+    table, key = repo.table.name, (method, args)
+    found, rows, generation = cv_app.query_cache.lookup(table, key, profile=args[0])
+    if found:
+        return rows
+    if not cv_app.db_breaker.closed:
+        rows = cv_app.stale_rows(repo.repo, method, args)
+        if rows is not None:
+            return rows
+    try:
+        rows = await getattr(repo, method)(*args)
+    except (DatabaseUnavailable, *DatabaseError):
+        rows = cv_app.stale_rows(repo.repo, method, args)
+        if rows is None:
+            raise
+        return rows
+    if cv_app.keeps_snapshot(method, args):
+        cv_app.snapshots.save(table, key, rows, generation, profile=args[0])
+    cv_app.query_cache.store(table, key, generation, rows, profile=args[0])
+    return rows
+
+
+async def load_cv(profile_id):
+    """Rows of every CV section of a profile, queried concurrently."""
+    rows = await asyncio.gather(*(cached_rows(async_repositories[table.resource], 'all', profile_id)
+                                  for table in schema.CV_SECTIONS))
+    return {table.endpoint: section for table, section in zip(schema.CV_SECTIONS, rows)}
+
+
+def make_list_view(repo):
+    """The async counterpart of a section's list page in ``register_table_routes``."""
+    table = repo.table
+    noun = table.label.lower()
+
+    @conditional(cv_app.query_cache, table.name, cv_app.cache_control_for(table.endpoint),
+                 profile=cv_app.current_profile_id, release=cv_app.release)
+    async def list_view():
+        try:
+            find_args, limit, _ = cv_app.list_request(repo.repo)
+            if limit <= 0:
+                rows, next_page = await cached_rows(repo, 'find', g.profile.id, *find_args), None
+            else:
+                rows = await cached_rows(repo, 'find', g.profile.id, *find_args, limit + 1)
+                rows, next_page = cv_app.next_page(rows, limit, find_args[1])
+        except ValueError as err:
+            return render_template('error.html', error_message=str(err)), 400
+        except DatabaseUnavailable:
+            return render_template('error.html', error_message="Database connection failed."), 503
+        except DatabaseError as err:
+            print(f"Error fetching {noun}: {err}")
+            return render_template('error.html', error_message=f"Unable to load {noun}."), 500
+        next_url = url_for(table.endpoint, **next_page) if next_page else None
+        return render_template(f'{table.endpoint}.html', next_url=next_url, **{table.endpoint: rows})
+    return list_view
+
+
+# Full CV Page
+@conditional(cv_app.query_cache, cv_app.CV_TABLES, cv_app.cache_control_for('cv'), profile=cv_app.current_profile_id,
+             release=cv_app.release)
+async def cv():
+    try:
+        cv_data = await load_cv(g.profile.id)
+    except DatabaseUnavailable:
+        return render_template('error.html', error_message="Database connection failed."), 503
+    except DatabaseError as err:
+        print(f"Error fetching CV: {err}")
+        return render_template('error.html', error_message="Unable to load the CV."), 500
+    return render_template('cv.html', **cv_data)
+
+
+# Full CV as JSON
+@conditional(cv_app.query_cache, cv_app.CV_TABLES, cv_app.cache_control_for('api_cv'),
+             profile=cv_app.current_profile_id, release=cv_app.release)
+async def api_cv():
+    try:
+        cv_data = await load_cv(g.profile.id)
+    except DatabaseUnavailable:
+        return jsonify(error="Database connection failed."), 503
+    except DatabaseError as err:
+        print(f"Error fetching CV: {err}")
+        return jsonify(error="Unable to load the CV."), 500
+    return jsonify(cv_app.cv_json(cv_data))
+
+
+async_views = {table.endpoint: make_list_view(async_repositories[table.resource]) for table in schema.CV_SECTIONS}
+async_views.update(cv=cv, api_cv=api_cv)
+
+application = ASGIApp(cv_app.create_app(), async_views, db)
+
+metrics.registry.gauges('cv_asgi', 'ASGI server', lambda: application.stats())
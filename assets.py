@@ -0,0 +1,156 @@
+"""Fingerprinted, precompressed static assets.
+
+``flask build-assets`` copies every file of the static folder into
+``ASSETS_DIR`` under a name that carries a hash of its content
+(``styles.3f9c2a1b7d4e.css``), next to ``.gz`` and ``.br`` variants, and
+writes ``manifest.json`` mapping each original name to its hashed one.
+
+``AssetPipeline`` loads the manifest at startup. ``url_for('static', ...)``
+then yields the hashed URL and the static route serves the hashed file,
+choosing the variant the request's ``Accept-Encoding`` allows. A hashed
+name never changes content, so it is sent with a one-year ``immutable``
+Cache-Control and a repeat visitor doesn't request it again, not even to
+revalidate. Files missing from the manifest (added since the last build)
+are served by Flask as before. Files from earlier builds are left in
+place, so pages cached elsewhere keep finding the assets they link to.
+
+Files go out through ``send_file``, which hands the open file to the
+server's ``wsgi.file_wrapper`` (``sendfile(2)`` under gunicorn), or as an
+``X-Sendfile`` header when ``USE_X_SENDFILE`` is on. nginx can also serve
+``ASSETS_DIR`` itself, with ``gzip_static`` and ``brotli_static`` picking up
+the precompressed files.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+
+import click
+from flask import request, send_file
+
+try:
+    import brotli
+except ImportError:  # Only gzip variants are built without it
+    brotli = None
+
+from static_site import write_atomic
+
+MANIFEST = 'manifest.json'
+HASH_LENGTH = 12
+IMMUTABLE = f'public, max-age={365 * 24 * 3600}, immutable'
+
+# Best first: (Accept-Encoding token, file suffix)
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# Already compressed; another pass gains nothing
+COMPRESSED_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.webp', '.avif', '.ico',
+                         '.woff', '.woff2', '.gz', '.br', '.zip', '.mp4', '.webm')
+
+
+def hashed_name(name, data):
+    """``css/site.css`` -> ``css/site.<hash>.css``."""
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}{ext}"
+
+
+def compressed_variants(data):
+    """``{suffix: bytes}`` for every encoding that makes ``data`` smaller."""
+    variants = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(data, quality=11)
+    return {suffix: body for suffix, body in variants.items() if len(body) < len(data)}
+
+
+def build(source, output_dir):
+    """Fingerprint and compress every file under ``source``; returns the manifest."""
+    manifest = {}
+    for root, _, files in os.walk(source):
+        for file_name in sorted(files):
+            path = os.path.join(root, file_name)
+            name = os.path.relpath(path, source).replace(os.sep, '/')
+            with open(path, 'rb') as f:
+                data = f.read()
+            hashed = hashed_name(name, data)
+            target = os.path.join(output_dir, hashed)
+            write_atomic(target, data)
+            if not name.lower().endswith(COMPRESSED_EXTENSIONS):
+                for suffix, body in compressed_variants(data).items():
+                    write_atomic(target + suffix, body)
+            manifest[name] = hashed
+    # Written last, so the manifest never names a file that isn't there yet
+    write_atomic(os.path.join(output_dir, MANIFEST), json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return manifest
+
+
+class AssetPipeline:
+    """Serves ``app``'s static files under the hashed names built into ``directory``.
+
+    A relative ``directory`` is taken from ``app.root_path``, as ``send_file``
+    takes its paths, whatever the working directory.
+    """
+
+    def __init__(self, app, directory):
+        self.app = app
+        self.directory = os.path.join(app.root_path, directory)
+        self.manifest = {}
+        self._variants = {}  # hashed name -> [(encoding, suffix)] on disk
+        self._send_static = app.view_functions['static']
+        app.view_functions['static'] = self.send_static
+        app.url_defaults(self._hashed_url)
+        self.load()
+
+    def load(self):
+        """Read the manifest; returns False (serving unhashed files) if there is none."""
+        try:
+            with open(os.path.join(self.directory, MANIFEST)) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = {}
+        variants = {}
+        for hashed in manifest.values():
+            path = os.path.join(self.directory, hashed)
+            variants[hashed] = [(encoding, suffix) for encoding, suffix in ENCODINGS
+                                if os.path.exists(path + suffix)]
+        self.manifest, self._variants = manifest, variants
+        return bool(manifest)
+
+    def build(self):
+        build(self.app.static_folder, self.directory)
+        return self.load()
+
+    def _hashed_url(self, endpoint, values):
+        if endpoint == 'static':
+            hashed = self.manifest.get(values.get('filename'))
+            if hashed:
+                values['filename'] = hashed
+
+    def send_static(self, filename):
+        variants = self._variants.get(filename)
+        if variants is None:
+            return self._send_static(filename=filename)
+
+        path = os.path.join(self.directory, filename)
+        encoding = next((encoding for encoding, suffix in variants
+                         if request.accept_encodings.quality(encoding) > 0), None)
+        if encoding:
+            path += dict(ENCODINGS)[encoding]
+        response = send_file(path, mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        if variants:
+            response.vary.add('Accept-Encoding')
+        response.headers['Cache-Control'] = IMMUTABLE
+        return response
+
+
+def init_cli(app, pipeline):
+    """Register ``flask build-assets``."""
+
+    @app.cli.command('build-assets')
+    def build_assets_command():
+        """Fingerprint and precompress the static files."""
+        if not pipeline.app.static_folder or not os.path.isdir(pipeline.app.static_folder):
+            raise click.ClickException(f"No static folder at {pipeline.app.static_folder}")
+        pipeline.build()
+        click.echo(f"Built {len(pipeline.manifest)} assets in {pipeline.directory}")
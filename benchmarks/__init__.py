@@ -0,0 +1 @@
+"""Load tests and benchmarks for the CV app (``python -m benchmarks.run``)."""
@@ -0,0 +1,384 @@
+"""Benchmark every route of the app against a local database stand-in.
+
+Usage::
+
+    python -m benchmarks.run                      # run and compare with baseline.json
+    python -m benchmarks.run --rows 5000 --requests 500 --concurrency 4
+    python -m benchmarks.run --mode both --save-baseline  # record the current numbers
+    python -m benchmarks.run --mode both --concurrency 200 --server-threads 16 --client-delay 50
+
+Requests go through Flask's test client, in process, so the numbers cover
+the app itself (routing, pool, cache, queries, templates) and not a network
+stack. The app runs on the embedded SQLite backend, and each table is
+seeded with ``--rows`` rows of generated data in a fresh database file;
+``--profiles`` more profiles with a few rows each share the database with
+the default one. For every scenario the run reports requests per second
+and p50/p95/p99 latency. Every scenario is measured ``--repeat`` times, in
+rounds over all of them: the throughput reported is the median pass's,
+and the latency percentiles are over the requests of every pass, so one
+stall of a busy machine doesn't decide the result. A
+scenario whose throughput drops, or whose p95 rises, by more than
+``--threshold`` against the baseline is flagged as a regression; the
+baseline is recorded with the default settings, in both modes.
+
+``--mode asgi`` sends the same requests through ``asgi.application``
+instead, from ``--concurrency`` tasks on one event loop, and ``--mode both``
+runs the two side by side (ASGI results are named ``asgi:<scenario>``). To
+compare how each holds up under slow clients, ``--client-delay`` keeps
+every response in flight that many milliseconds longer, as a client on a
+slow link would, and ``--server-threads`` caps the WSGI requests in flight
+as a threaded server's worker count does.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+# Run as a script (python benchmarks/run.py) the repository root is not on the path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.seed import create_database
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+DEFAULT_BASELINE = os.path.join(HERE, 'baseline.json')
+
+EDUCATION = dict(school='Bench U', achievement='BSc', start_year='2019', end_year='2022', description='Benchmark entry')
+WORK = dict(company='Bench Co', position='Engineer', start_year='2020', end_year='2023', description='Benchmark entry')
+SKILL = dict(skill_name='Benchmarking', category='Tools', proficiency_level='Expert')
+PROJECT = dict(project_name='Bench', description='Benchmark entry', start_date='2021-01-01', end_date='2021-06-30')
+PERSON = dict(name='Bench Person', email='bench@example.com', phone='000', bio='Benchmark entry')
+CONTACT = dict(name='Bench Visitor', email='visitor@example.com', message='Hello from the benchmark')
+QUERIES = ('python', 'data engineering', 'cloud research', 'teaching', 'mysql flask')
+
+
+def scenarios(rows, profiles=1):
+    """``(name, method, path(i), form data)`` for every route.
+
+    Every scenario but one requests pages of the default profile. Edits
+    target ids in the upper half of each table and deletes walk up from
+    id 1, so the two never collide within a run. ``other_profiles`` visits
+    the other ``profiles - 1`` in turn, to show that a page of one costs
+    the same however many there are.
+    """
+    upper = lambda i: rows - (i % max(1, rows // 2))
+    return [
+        ('home', 'GET', lambda i: '/default/', None),
+        ('personal_info', 'GET', lambda i: '/default/personal-info', None),
+        ('education', 'GET', lambda i: '/default/education', None),
+        ('work_experience', 'GET', lambda i: '/default/work-experience', None),
+        ('skills', 'GET', lambda i: '/default/skills', None),
+        ('projects', 'GET', lambda i: '/default/projects', None),
+        ('education_page', 'GET', lambda i: f'/default/education?after={i % rows}&limit=50', None),
+        ('education_sorted', 'GET', lambda i: '/default/education?sort=-end_year&limit=50', None),
+        ('skills_category', 'GET', lambda i: '/default/skills?category=python&sort=skill_name', None),
+        ('projects_from', 'GET', lambda i: '/default/projects?from=2015&sort=start_date&limit=50', None),
+        ('projects_stream', 'GET', lambda i: '/default/projects?stream=1', None),
+        ('search', 'GET', lambda i: f'/default/search?q={QUERIES[i % len(QUERIES)]}', None),
+        ('search_suggest', 'GET', lambda i: f'/default/search/suggest?q={QUERIES[i % len(QUERIES)][:2 + i % 4]}', None),
+        ('cv', 'GET', lambda i: '/default/cv', None),
+        ('api_cv', 'GET', lambda i: '/default/api/cv', None),
+        ('edit_education_form', 'GET', lambda i: f'/default/edit-education/{upper(i)}', None),
+        ('edit_education', 'POST', lambda i: f'/default/edit-education/{upper(i)}', EDUCATION),
+        ('edit_work_experience', 'POST', lambda i: f'/default/edit-work-experience/{upper(i)}', WORK),
+        ('edit_skill', 'POST', lambda i: f'/default/edit-skill/{upper(i)}', SKILL),
+        ('edit_project', 'POST', lambda i: f'/default/edit-project/{upper(i)}', PROJECT),
+        ('add_personal_info', 'POST', lambda i: '/default/add-personal-info', PERSON),
+        ('add_education', 'POST', lambda i: '/default/add-education', EDUCATION),
+        ('add_work_experience', 'POST', lambda i: '/default/add-work-experience', WORK),
+        ('add_skill', 'POST', lambda i: '/default/add-skill', SKILL),
+        ('add_project', 'POST', lambda i: '/default/add-project', PROJECT),
+        ('contact', 'POST', lambda i: '/default/contact', CONTACT),
+        ('delete_education', 'GET', lambda i: f'/default/delete-education/{i + 1}', None),
+        ('delete_skill', 'GET', lambda i: f'/default/delete-skill/{i + 1}', None),
+        ('delete_project', 'GET', lambda i: f'/default/delete-project/{i + 1}', None),
+    ] + ([
+        ('other_profiles', 'GET', lambda i: f'/cv-{2 + i % (profiles - 1)}/skills', None),
+    ] if profiles > 1 else [])
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def app_environ(db_path, pool_size, no_cache):
+    """Environment that configures the app for the SQLite database at ``db_path``."""
+    return dict(
+        STORAGE_BACKEND='sqlite',
+        SQLITE_PATH=db_path,
+        DB_POOL_SIZE=str(pool_size),
+        CACHE_MAX_ENTRIES='0' if no_cache else os.environ.get('CACHE_MAX_ENTRIES', '256'),
+        # One client sends the same message over and over: measure the insert, not the throttle
+        CONTACT_IP_BURST='1000000000',
+        CONTACT_GLOBAL_BURST='1000000000',
+        CONTACT_DUPLICATE_WINDOW='0',
+    )
+
+
+def load_app(db_path=None, pool_size=5, no_cache=False, start=True):
+    """Import the app configured for the SQLite database at ``db_path``
+    (None: as the environment already says) and call ``create_app()``.
+
+    With ``start``, also start this process's background work, as a worker
+    does, and wait for the search index.
+    """
+    if db_path:
+        os.environ.update(app_environ(db_path, pool_size, no_cache))
+    sys.path.insert(0, ROOT)
+    import app as cv_app
+
+    flask_app = cv_app.app
+    flask_app.logger.disabled = True  # Failed requests are counted, not logged
+    # Templates and styles.css sit next to app.py in this repository
+    if not os.path.isdir(os.path.join(flask_app.root_path, flask_app.template_folder)):
+        flask_app.template_folder = ROOT
+        flask_app.jinja_loader.searchpath = [ROOT]
+    cv_app.create_app()
+    if start:
+        cv_app.start_worker()
+        cv_app.search_executor.submit(lambda: None).result()  # Wait for the search index build
+    return cv_app
+
+
+def summarize(latencies, errors, requests, elapsed):
+    latencies.sort()
+    return {
+        'requests': requests,
+        'errors': errors,
+        'rps': round(requests / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+def combine(passes):
+    """One result for repeated passes, ``[(latencies, errors, elapsed)]``: the
+    throughput of the median pass, and latency percentiles over the requests
+    of them all."""
+    latencies = [latency for pass_latencies, _, _ in passes for latency in pass_latencies]
+    elapsed = sorted(pass_elapsed for _, _, pass_elapsed in passes)[len(passes) // 2]
+    return summarize(latencies, sum(errors for _, errors, _ in passes), len(latencies), elapsed * len(passes))
+
+
+def run_scenario(flask_app, method, path, data, requests, concurrency, offset, server_threads=None, client_delay=0.0):
+    """One pass: ``(latencies, errors, elapsed)``."""
+    latencies = []
+    errors = 0
+    # A threaded server's workers: each stays busy until its client has the whole response
+    workers = threading.BoundedSemaphore(server_threads or concurrency)
+
+    def worker(indexes):
+        nonlocal errors
+        client = flask_app.test_client()
+        local = []
+        for i in indexes:
+            start = time.perf_counter()
+            with workers:
+                response = client.open(path(i), method=method, data=data)
+                response.get_data()  # Drain streamed bodies
+                if client_delay:
+                    time.sleep(client_delay)
+            local.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+        return local
+
+    indexes = list(range(offset, offset + requests))
+    shards = [indexes[n::concurrency] for n in range(concurrency)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for local in pool.map(worker, shards):
+            latencies.extend(local)
+    return latencies, errors, time.perf_counter() - started
+
+
+async def asgi_request(application, method, url, data, client_delay=0.0):
+    """Send one request through ``application``; returns the status code."""
+    path, _, query = url.partition('?')
+    body = urlencode(data).encode() if data else b''
+    headers = [(b'host', b'localhost')]
+    if data:
+        headers += [(b'content-type', b'application/x-www-form-urlencoded'),
+                    (b'content-length', str(len(body)).encode())]
+    scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method,
+             'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+             'root_path': '', 'headers': headers, 'client': ('127.0.0.1', 0), 'server': ('localhost', 80)}
+    received = False
+    status = None
+
+    async def receive():
+        nonlocal received
+        if received:
+            return {'type': 'http.disconnect'}
+        received = True
+        return {'type': 'http.request', 'body': body}
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+        elif client_delay and not message.get('more_body'):
+            await asyncio.sleep(client_delay)  # The last bytes reach a slow client
+
+    await application(scope, receive, send)
+    return status
+
+
+async def run_scenario_asgi(application, method, path, data, requests, concurrency, offset, client_delay=0.0):
+    """One pass: ``(latencies, errors, elapsed)``."""
+    latencies = []
+    errors = 0
+
+    async def client(indexes):
+        nonlocal errors
+        for i in indexes:
+            start = time.perf_counter()
+            status = await asgi_request(application, method, path(i), data, client_delay)
+            latencies.append(time.perf_counter() - start)
+            if status >= 400:
+                errors += 1
+
+    indexes = list(range(offset, offset + requests))
+    started = time.perf_counter()
+    await asyncio.gather(*(client(indexes[n::concurrency]) for n in range(concurrency)))
+    return latencies, errors, time.perf_counter() - started
+
+
+async def run_asgi(application, selected, args, offset):
+    """Every selected scenario through ``application``, in one event loop."""
+    await application.startup()
+    runs = {'asgi:' + name: [] for name, _, _, _ in selected}
+    try:
+        for name, method, path, data in selected:
+            await run_scenario_asgi(application, method, path, data, args.warmup, 1, offset)
+        for n in range(args.repeat):
+            for name, method, path, data in selected:
+                runs['asgi:' + name].append(await run_scenario_asgi(
+                    application, method, path, data, args.requests, args.concurrency,
+                    offset + args.warmup + n * args.requests, args.client_delay / 1000.0))
+    finally:
+        await application.shutdown()
+    return {name: combine(passes) for name, passes in runs.items()}
+
+
+def compare(results, baseline, threshold):
+    """Print results next to the baseline; return the names that regressed."""
+    regressions = []
+    print(f"{'scenario':<24}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}  vs baseline")
+    for name, r in results.items():
+        note = ''
+        base = baseline.get(name)
+        if base:
+            rps_change = (r['rps'] - base['rps']) / base['rps'] if base['rps'] else 0.0
+            p95_change = (r['p95_ms'] - base['p95_ms']) / base['p95_ms'] if base['p95_ms'] else 0.0
+            note = f"rps {rps_change:+.0%}, p95 {p95_change:+.0%}"
+            if rps_change < -threshold or p95_change > threshold:
+                regressions.append(name)
+                note += '  REGRESSION'
+        print(f"{name:<24}{r['rps']:>10}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}{r['errors']:>8}  {note}")
+    return regressions
+
+
+def compare_modes(results):
+    """Print each scenario's WSGI and ASGI numbers next to each other."""
+    print(f"{'scenario':<24}{'wsgi rps':>10}{'asgi rps':>10}{'wsgi p95':>10}{'asgi p95':>10}")
+    for name, r in results.items():
+        a = results.get('asgi:' + name)
+        if a:
+            print(f"{name:<24}{r['rps']:>10}{a['rps']:>10}{r['p95_ms']:>10}{a['p95_ms']:>10}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=2500, help='rows seeded into each table')
+    parser.add_argument('--profiles', type=int, default=100, help='profiles in the database, the default one included')
+    parser.add_argument('--requests', type=int, default=200, help='measured requests per scenario')
+    parser.add_argument('--warmup', type=int, default=10, help='unmeasured requests per scenario')
+    parser.add_argument('--repeat', type=int, default=3, help='measured passes per scenario; the median is kept')
+    parser.add_argument('--concurrency', type=int, default=1, help='concurrent clients per scenario')
+    parser.add_argument('--mode', choices=('wsgi', 'asgi', 'both'), default='wsgi',
+                        help='serve through the Flask app, asgi.application, or each in turn')
+    parser.add_argument('--server-threads', type=int, help='WSGI requests in flight at once (default: --concurrency)')
+    parser.add_argument('--client-delay', type=float, default=0.0,
+                        help='milliseconds each response stays in flight after it is ready')
+    parser.add_argument('--pool-size', type=int, default=5)
+    parser.add_argument('--no-cache', action='store_true', help='disable the query cache')
+    parser.add_argument('--only', nargs='*', help='run only these scenarios')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='write the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.25, help='relative change counted as a regression')
+    parser.add_argument('--fail-on-regression', action='store_true')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args(argv)
+
+    modes = ('wsgi', 'asgi') if args.mode == 'both' else (args.mode,)
+    if args.repeat < 1:
+        parser.error('--repeat must be at least 1')
+    if args.rows < 2 * len(modes) * (args.repeat * args.requests + args.warmup):
+        parser.error('--rows must be at least twice --repeat x --requests + --warmup (per mode) '
+                     'so deletes and edits never overlap')
+
+    workdir = tempfile.mkdtemp(prefix='cv-bench-')
+    db_path = os.path.join(workdir, 'bench.sqlite3')
+    create_database(db_path, args.rows, profiles=args.profiles)
+    cv_app = load_app(db_path, args.pool_size, args.no_cache)
+
+    selected = [scenario for scenario in scenarios(args.rows, args.profiles)
+                if not args.only or scenario[0] in args.only]
+    results = {}
+    if 'wsgi' in modes:
+        runs = {name: [] for name, _, _, _ in selected}
+        for name, method, path, data in selected:
+            run_scenario(cv_app.app, method, path, data, args.warmup, 1, 0)
+        for n in range(args.repeat):
+            for name, method, path, data in selected:
+                runs[name].append(run_scenario(cv_app.app, method, path, data, args.requests, args.concurrency,
+                                               args.warmup + n * args.requests, args.server_threads,
+                                               args.client_delay / 1000.0))
+        results = {name: combine(passes) for name, passes in runs.items()}
+    if 'asgi' in modes:
+        import asgi
+        # Past the ids the WSGI run edited and deleted
+        offset = args.repeat * args.requests + args.warmup if 'wsgi' in modes else 0
+        results.update(asyncio.run(run_asgi(asgi.application, selected, args, offset)))
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f).get('results', {})
+    regressions = compare(results, baseline, args.threshold)
+    if len(modes) > 1:
+        print()
+        compare_modes(results)
+
+    report = {'settings': {k: v for k, v in vars(args).items()
+                           if k in ('rows', 'profiles', 'requests', 'repeat', 'concurrency', 'pool_size', 'no_cache',
+                                    'mode', 'server_threads', 'client_delay')},
+              'results': results}
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+
+    if regressions:
+        print(f"Regressions: {', '.join(regressions)}")
+        if args.fail_on_regression:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
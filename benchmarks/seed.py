@@ -0,0 +1,76 @@
+"""Generated CV data for the benchmarks.
+
+The benchmarks run the app on the embedded SQLite backend
+(``STORAGE_BACKEND=sqlite``) so they work offline, without a MySQL server.
+The default profile holds the bulk of the rows; further profiles, named
+``cv-2``, ``cv-3`` and so on, hold a few each.
+"""
+import datetime
+import os
+import random
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import migrations
+
+
+def create_database(path, rows, seed=42, profiles=1, profile_rows=20):
+    """Create the schema at ``path`` and fill each table with ``rows`` rows
+    of the default profile, then ``profile_rows`` rows of each of
+    ``profiles - 1`` more. The default profile's rows get ids 1 to ``rows``.
+    """
+    rng = random.Random(seed)
+    words = ("data engineering python flask mysql research teaching cloud "
+             "analysis statistics algebra modelling leadership design testing").split()
+
+    def text(n):
+        return ' '.join(rng.choice(words) for _ in range(n))
+
+    def day(year):
+        return datetime.date(year, rng.randint(1, 12), rng.randint(1, 28)).isoformat()
+
+    def fill(profile_id, rows):
+        conn.executemany(
+            "INSERT INTO Personal_Info (name, email, phone, bio, profile_id) VALUES (?, ?, ?, ?, ?)",
+            [(f"Person {i}", f"person{i}@example.com", f"+27 {rng.randint(10**8, 10**9)}", text(40), profile_id)
+             for i in range(max(1, rows // 100))]
+        )
+        conn.executemany(
+            "INSERT INTO Education (school, achievement, start_year, end_year, description, profile_id) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [(f"School {i}", text(3), y, y + rng.randint(1, 5), text(30), profile_id)
+             for i, y in ((i, rng.randint(1990, 2022)) for i in range(rows))]
+        )
+        conn.executemany(
+            "INSERT INTO Work_Experience (company, position, start_year, end_year, description, profile_id) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [(f"Company {i}", text(2), y, y + rng.randint(0, 8), text(40), profile_id)
+             for i, y in ((i, rng.randint(1990, 2022)) for i in range(rows))]
+        )
+        conn.executemany(
+            "INSERT INTO Skills (skill_name, category, proficiency_level, profile_id) VALUES (?, ?, ?, ?)",
+            [(f"{rng.choice(words)} {i}", rng.choice(words), rng.choice(('Beginner', 'Intermediate', 'Expert')),
+              profile_id)
+             for i in range(rows)]
+        )
+        conn.executemany(
+            "INSERT INTO Projects (project_name, description, start_date, end_date, profile_id) VALUES (?, ?, ?, ?, ?)",
+            [(f"Project {i}", text(50), day(y), day(y + 1), profile_id)
+             for i, y in ((i, rng.randint(2000, 2023)) for i in range(rows))]
+        )
+        conn.executemany(
+            "INSERT INTO Contact (name, email, message, profile_id) VALUES (?, ?, ?, ?)",
+            [(f"Visitor {i}", f"visitor{i}@example.com", text(25), profile_id) for i in range(rows)]
+        )
+
+    conn = sqlite3.connect(path)
+    migrations.migrate(conn, 'sqlite')
+    with conn:
+        fill(1, rows)  # The default profile, created by the migrations
+        for number in range(2, profiles + 1):
+            profile_id = conn.execute("INSERT INTO Profiles (slug, name) VALUES (?, ?)",
+                                      (f"cv-{number}", f"Person {number}")).lastrowid
+            fill(profile_id, profile_rows)
+    conn.close()
@@ -0,0 +1,234 @@
+"""Benchmark startup and steady-state throughput of the production serving profile.
+
+Usage::
+
+    python -m benchmarks.serve                      # workers and threads as gunicorn.conf.py sizes them
+    python -m benchmarks.serve --workers 4 --threads 8 --concurrency 32
+    python -m benchmarks.serve --no-preload         # every worker imports the app itself
+    python -m benchmarks.serve --max-requests 500   # with workers being replaced during the run
+
+Starts gunicorn with ``gunicorn.conf.py`` on a local port, against a fresh
+SQLite database seeded with ``--rows`` rows per table (as
+``benchmarks/run.py`` does), and reports:
+
+* startup: seconds until the first page is served, and how long the
+  master took to import the app and load its templates;
+* memory: proportional set size of the master and of the workers, which
+  shows how much of the preloaded app they share;
+* steady state: requests per second and p50/p95/p99 latency of
+  ``--requests`` GETs spread over ``--paths``, from ``--concurrency``
+  keep-alive clients, after ``--warmup`` unmeasured ones per path;
+* shutdown: seconds from SIGTERM until the master has exited.
+
+Unlike ``benchmarks/run.py`` this goes over real sockets and processes,
+so the numbers include gunicorn and the HTTP stack. gunicorn must be
+installed.
+"""
+import argparse
+import http.client
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Run as a script (python benchmarks/serve.py) the repository root is not on the path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.run import ROOT, app_environ, load_app, summarize
+from benchmarks.seed import create_database
+
+PATHS = ('/default/', '/default/skills', '/default/education?limit=50', '/default/cv', '/default/api/cv',
+         '/default/search?q=python')
+
+
+def bench_app():
+    """``create_app()`` for gunicorn, recording how long the import took.
+
+    Runs in the master, or in every worker with ``--no-preload``.
+    """
+    start = time.perf_counter()
+    cv_app = load_app(start=False)
+    startup = {
+        'load_s': round(time.perf_counter() - start, 4),
+        'templates_s': round(sum(cv_app.template_load_times.values()), 4),
+    }
+    with open(os.environ['BENCH_STARTUP_FILE'], 'w') as f:
+        json.dump(startup, f)
+    return cv_app.app
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_serving(port, timeout):
+    """Seconds until the default profile's home page answers 200, polling;
+    raises RuntimeError on timeout."""
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+            conn.request('GET', PATHS[0])
+            status = conn.getresponse().status
+            conn.close()
+            if status == 200:
+                return time.perf_counter() - start
+        except OSError:
+            pass
+        time.sleep(0.01)
+    raise RuntimeError(f"gunicorn did not serve {PATHS[0]} within {timeout:g}s")
+
+
+def proportional_set_size(pid):
+    """Kilobytes of memory ``pid`` uses, shared pages split between their users (Linux only)."""
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                if line.startswith('Pss:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def worker_pids(master_pid):
+    try:
+        with open(f'/proc/{master_pid}/task/{master_pid}/children') as f:
+            return [int(pid) for pid in f.read().split()]
+    except OSError:
+        return []
+
+
+def run_load(port, paths, requests, concurrency, offset=0):
+    latencies = []
+    errors = 0
+
+    def client(indexes):
+        nonlocal errors
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        local = []
+        for i in indexes:
+            start = time.perf_counter()
+            for attempt in range(2):
+                try:
+                    conn.request('GET', paths[i % len(paths)], headers={'Accept-Encoding': 'gzip, br'})
+                    response = conn.getresponse()
+                    response.read()
+                    if response.status >= 400:
+                        errors += 1
+                    break
+                except (OSError, http.client.HTTPException):
+                    # A replaced worker closes its idle keep-alive connections; as
+                    # browsers do, retry once on a new one
+                    conn.close()
+                    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                    if attempt:
+                        errors += 1
+            local.append(time.perf_counter() - start)
+        conn.close()
+        return local
+
+    indexes = list(range(offset, offset + requests))
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for local in pool.map(client, [indexes[n::concurrency] for n in range(concurrency)]):
+            latencies.extend(local)
+    return summarize(latencies, errors, requests, time.perf_counter() - started)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=200, help='rows seeded into each table')
+    parser.add_argument('--requests', type=int, default=2000, help='measured requests')
+    parser.add_argument('--warmup', type=int, default=20, help='unmeasured requests per path')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent keep-alive clients')
+    parser.add_argument('--paths', nargs='*', default=list(PATHS), help='paths requested in turn')
+    parser.add_argument('--workers', type=int, help='WEB_WORKERS (default: as gunicorn.conf.py)')
+    parser.add_argument('--threads', type=int, help='WEB_THREADS (default: as gunicorn.conf.py)')
+    parser.add_argument('--max-requests', type=int, help='WEB_MAX_REQUESTS (default: as gunicorn.conf.py)')
+    parser.add_argument('--no-preload', action='store_true', help='import the app in each worker')
+    parser.add_argument('--pool-size', type=int, default=5)
+    parser.add_argument('--startup-timeout', type=float, default=60.0)
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='cv-serve-')
+    db_path = os.path.join(workdir, 'bench.sqlite3')
+    create_database(db_path, args.rows)
+    startup_file = os.path.join(workdir, 'startup.json')
+    port = free_port()
+
+    env = dict(os.environ, **app_environ(db_path, args.pool_size, False),
+               SNAPSHOT_DIR=os.path.join(workdir, 'snapshots'),
+               BENCH_STARTUP_FILE=startup_file,
+               WEB_PRELOAD='0' if args.no_preload else '1')
+    for name, value in (('WEB_WORKERS', args.workers), ('WEB_THREADS', args.threads),
+                        ('WEB_MAX_REQUESTS', args.max_requests)):
+        if value is not None:
+            env[name] = str(value)
+    command = [sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn.conf.py'),
+               '--bind', f'127.0.0.1:{port}', '--chdir', ROOT, 'benchmarks.serve:bench_app()']
+
+    log_path = os.path.join(workdir, 'gunicorn.log')
+    with open(log_path, 'w') as log:
+        master = subprocess.Popen(command, env=env, cwd=ROOT, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        try:
+            first_response = wait_until_serving(port, args.startup_timeout)
+        except RuntimeError:
+            with open(log_path) as f:
+                sys.stderr.write(f.read())
+            raise
+        for path in args.paths:
+            run_load(port, [path], args.warmup, 1)
+        results = run_load(port, args.paths, args.requests, args.concurrency)
+        workers = worker_pids(master.pid)
+        memory = {
+            'master_pss_kb': proportional_set_size(master.pid),
+            'workers_pss_kb': [proportional_set_size(pid) for pid in workers],
+        }
+    finally:
+        stopping = time.perf_counter()
+        master.send_signal(signal.SIGTERM)
+        try:
+            master.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            master.kill()
+        shutdown = time.perf_counter() - stopping
+
+    with open(startup_file) as f:
+        startup = json.load(f)
+    report = {
+        'settings': {k: v for k, v in vars(args).items()
+                     if k in ('rows', 'requests', 'concurrency', 'paths', 'workers', 'threads', 'max_requests',
+                              'no_preload', 'pool_size')},
+        'startup': dict(startup, first_response_s=round(first_response, 4)),
+        'memory': memory,
+        'steady_state': results,
+        'shutdown_s': round(shutdown, 4),
+    }
+
+    print(f"startup      first response {first_response:.3f}s, app loaded in {startup['load_s']:.3f}s "
+          f"(templates {startup['templates_s']:.3f}s)")
+    if memory['master_pss_kb'] is not None:
+        pss = [kb for kb in memory['workers_pss_kb'] if kb is not None]
+        print(f"memory       master {memory['master_pss_kb'] / 1024:.1f} MiB, "
+              f"{len(pss)} workers {sum(pss) / 1024:.1f} MiB")
+    print(f"steady state {results['rps']} rps, p50 {results['p50_ms']} ms, p95 {results['p95_ms']} ms, "
+          f"p99 {results['p99_ms']} ms, {results['errors']} errors")
+    print(f"shutdown     {shutdown:.3f}s")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,104 @@
+"""Circuit breaker for the database.
+
+When the database is down, every query waits for the driver's connect or
+query timeout before it fails, so each request takes seconds to produce
+an error. ``CircuitBreaker`` counts consecutive failures; after
+``failure_threshold`` of them it *opens* and ``allow()`` turns every call
+away at once for ``reset_timeout`` seconds. Then it lets a single trial
+call through (*half-open*): a success closes it again, a failure reopens
+it for another ``reset_timeout``.
+
+Only errors for which ``is_failure(err)`` is true count: a lost
+connection or a timeout says the database is unwell, a constraint
+violation or a bad statement does not.
+"""
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitOpen(Exception):
+    """Raised instead of trying the database while the breaker is open."""
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, is_failure=None):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.is_failure = is_failure or (lambda err: True)
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_at = 0.0
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.rejected = 0
+
+    @property
+    def closed(self):
+        return self.state == CLOSED
+
+    def allow(self):
+        """Whether a call may go to the database now."""
+        if self.state == CLOSED:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            if self.state == OPEN and now - self._opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self._trial_at = now
+                return True
+            if self.state == HALF_OPEN and now - self._trial_at >= self.reset_timeout:
+                # The trial call never reported back; let another through
+                self._trial_at = now
+                return True
+            if self.state == CLOSED:
+                return True
+            self.rejected += 1
+            return False
+
+    def check(self):
+        """Raise ``CircuitOpen`` unless ``allow()``."""
+        if not self.allow():
+            raise CircuitOpen(f"database circuit open, retrying in at most {self.reset_timeout:g}s")
+
+    def record_success(self):
+        if self.state == CLOSED and not self._failures:
+            return
+        with self._lock:
+            self.state = CLOSED
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self._failures >= self.failure_threshold):
+                if self.state == CLOSED:
+                    print(f"Error: {self._failures} database failures in a row; "
+                          f"serving without it for {self.reset_timeout:g}s")
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+                self.opened += 1
+
+    def record(self, error):
+        """Record the outcome of a call that raised ``error`` (None if it succeeded).
+
+        An error that isn't a failure still means the database answered.
+        """
+        if error is not None and self.is_failure(error):
+            self.record_failure()
+        else:
+            self.record_success()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'open': int(self.state != CLOSED),
+                'consecutive_failures': self._failures,
+                'opened': self.opened,
+                'rejected': self.rejected,
+            }
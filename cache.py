@@ -0,0 +1,296 @@
+"""In-process read-through cache for table queries.
+
+Entries are keyed by ``(table, key)`` within a partition, one per profile,
+and bounded by a TTL and an LRU size limit (``PartitionedLRU``). Every
+table of every profile has a generation number kept in a version store; a
+write bumps it, which makes all of that profile's entries for the table
+stale at once without touching any other table or profile.
+
+Stores also record when each table last changed. Together with the store's
+``epoch`` (when its counters started) that is enough to build validators
+for conditional GETs.
+
+``LocalVersionStore`` keeps generations in memory, which is enough for a
+single worker; its epoch is when it was made, unless it is given one.
+``SQLiteVersionStore`` keeps them in a small SQLite file so several workers
+on one host see each other's invalidations and share one epoch.
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class LocalVersionStore:
+    """Per-table generation counters for a single process."""
+
+    def __init__(self, epoch=None):
+        self.epoch = time.time() if epoch is None else epoch
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, table):
+        """Return ``(generation, updated_at)`` for ``table``."""
+        return self._versions.get(table, (0, self.epoch))
+
+    def bump(self, table):
+        with self._lock:
+            version = (self.get(table)[0] + 1, time.time())
+            self._versions[table] = version
+            return version
+
+
+class SQLiteVersionStore:
+    """Per-table generation counters shared through a local SQLite file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        # An SQLite connection must not be used on both sides of a fork
+        os.register_at_fork(after_in_child=self._after_fork)
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS table_versions ("
+                "name TEXT PRIMARY KEY, generation INTEGER NOT NULL, updated_at REAL NOT NULL)"
+            )
+            # The reserved '' row remembers when the counters started
+            conn.execute(
+                "INSERT OR IGNORE INTO table_versions (name, generation, updated_at) VALUES ('', 0, ?)",
+                (time.time(),)
+            )
+        self.epoch = self.get('')[1]
+        # None stays open for a server to fork workers with
+        conn.close()
+        self._local = threading.local()
+
+    def _after_fork(self):
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, table):
+        """Return ``(generation, updated_at)`` for ``table``."""
+        row = self._conn().execute(
+            "SELECT generation, updated_at FROM table_versions WHERE name = ?", (table,)
+        ).fetchone()
+        return tuple(row) if row else (0, self.epoch)
+
+    def bump(self, table):
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT INTO table_versions (name, generation, updated_at) VALUES (?, 1, ?) "
+                "ON CONFLICT(name) DO UPDATE SET generation = generation + 1, "
+                "updated_at = excluded.updated_at",
+                (table, time.time())
+            )
+        return self.get(table)
+
+
+class PartitionedLRU:
+    """An LRU mapping split into partitions, such as one per profile.
+
+    Each value has a size (``sizeof``, 1 by default). A partition holds at
+    most ``partition_size`` and drops its own least recently used entries
+    beyond that; when all of them together hold more than ``max_size``,
+    entries go from the partition used least recently. One busy partition
+    can so take no more than its share, and cannot push out the entries of
+    every other. Not thread-safe: callers hold their own lock.
+    """
+
+    def __init__(self, max_size, partition_size=None, sizeof=None):
+        self.max_size = max_size
+        self.partition_size = partition_size or max_size
+        self._sizeof = sizeof
+        self._partitions = OrderedDict()  # partition -> OrderedDict(key -> (size, value)), least recently used first
+        self._sizes = {}                  # partition -> total size
+        self.size = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return sum(len(entries) for entries in self._partitions.values())
+
+    @property
+    def partitions(self):
+        return len(self._partitions)
+
+    def get(self, partition, key):
+        """The value of ``key``, marked as just used, or None."""
+        entries = self._partitions.get(partition)
+        if entries is None:
+            return None
+        entry = entries.get(key)
+        if entry is None:
+            return None
+        entries.move_to_end(key)
+        self._partitions.move_to_end(partition)
+        return entry[1]
+
+    def put(self, partition, key, value):
+        size = self._sizeof(value) if self._sizeof else 1
+        self.discard(partition, key)
+        entries = self._partitions.get(partition)
+        if entries is None:
+            entries = self._partitions[partition] = OrderedDict()
+            self._sizes[partition] = 0
+        entries[key] = (size, value)
+        self._partitions.move_to_end(partition)
+        self._sizes[partition] += size
+        self.size += size
+        while self._sizes.get(partition, 0) > self.partition_size:
+            self._evict(partition)
+        while self.size > self.max_size:
+            self._evict(next(iter(self._partitions)))
+
+    def _evict(self, partition):
+        entries = self._partitions[partition]
+        _, (size, _) = entries.popitem(last=False)
+        self._shrink(partition, entries, size)
+        self.evictions += 1
+
+    def discard(self, partition, key):
+        entries = self._partitions.get(partition)
+        if entries is not None and key in entries:
+            size, _ = entries.pop(key)
+            self._shrink(partition, entries, size)
+
+    def discard_if(self, partition, predicate):
+        """Drop the keys of ``partition`` (of every partition if None) that ``predicate`` accepts."""
+        partitions = list(self._partitions) if partition is None else [partition]
+        for name in partitions:
+            entries = self._partitions.get(name, {})
+            for key in [key for key in entries if predicate(key)]:
+                self.discard(name, key)
+
+    def _shrink(self, partition, entries, size):
+        self._sizes[partition] -= size
+        self.size -= size
+        if not entries:
+            del self._partitions[partition]
+            del self._sizes[partition]
+
+    def clear(self):
+        self._partitions.clear()
+        self._sizes.clear()
+        self.size = 0
+
+
+class QueryCache:
+    """TTL + LRU cache of query results, invalidated per table and profile.
+
+    ``profile`` names the partition an entry belongs to (None for queries
+    of no profile): a profile keeps at most ``profile_entries`` entries,
+    and past ``max_entries`` in all the profile read least recently loses
+    its entries first. ``check_interval`` is how often (in seconds) the
+    version store is asked for a table's generation; with a shared store
+    it bounds how long another worker's write can go unnoticed. Writes made
+    by this process are seen immediately.
+    """
+
+    def __init__(self, ttl=300.0, max_entries=256, profile_entries=None, versions=None, check_interval=1.0):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.versions = versions or LocalVersionStore()
+        self.check_interval = check_interval
+        self._entries = PartitionedLRU(max_entries, profile_entries)
+        self._known = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _scope(table, profile):
+        # The version store's name for one table of one profile
+        return table if profile is None else f"{table}:{profile}"
+
+    def _check(self, scope, now):
+        known = self._known.get(scope)
+        if known is None or now - known[1] >= self.check_interval:
+            known = (self.versions.get(scope), now)
+            self._known[scope] = known
+        return known[0]
+
+    def _version(self, table, profile, now):
+        # A write to any profile's rows at once (a bulk job) bumps the table's own
+        table_version = self._check(table, now)
+        if profile is None:
+            return table_version
+        version = self._check(self._scope(table, profile), now)
+        return (table_version[0], version[0]), max(table_version[1], version[1])
+
+    def version(self, table, profile=None):
+        """``(generation, updated_at)`` of ``table`` for ``profile`` as this cache currently sees it."""
+        with self._lock:
+            return self._version(table, profile, time.monotonic())
+
+    def lookup(self, table, key, profile=None):
+        """``(True, value, generation)`` on a hit, ``(False, None, generation)`` on a miss.
+
+        Pass ``generation`` to ``store()`` with the value loaded after a miss.
+        """
+        now = time.monotonic()
+        cache_key = (table, key)
+        with self._lock:
+            generation = self._version(table, profile, now)[0]
+            entry = self._entries.get(profile, cache_key)
+            if entry is not None and entry[0] == generation and entry[1] > now:
+                self.hits += 1
+                return True, entry[2], generation
+            self.misses += 1
+            return False, None, generation
+
+    def store(self, table, key, generation, value, profile=None):
+        with self._lock:
+            # A write that landed while we were loading has already bumped the
+            # generation, so this entry is simply never served
+            self._entries.put(profile, (table, key), (generation, time.monotonic() + self.ttl, value))
+
+    def get_or_load(self, table, key, loader, profile=None):
+        """Return the cached value for ``(table, key)``, calling ``loader()`` on a miss."""
+        found, value, generation = self.lookup(table, key, profile)
+        if not found:
+            value = loader()
+            self.store(table, key, generation, value, profile)
+        return value
+
+    def invalidate(self, table, profile=None):
+        """Drop every entry for ``table`` of ``profile`` (of every profile if None)
+        here and in workers sharing the store."""
+        scope = self._scope(table, profile)
+        version = self.versions.bump(scope)
+        with self._lock:
+            self._known[scope] = (version, time.monotonic())
+            self._entries.discard_if(profile, lambda cache_key: cache_key[0] == table)
+            self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._known.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'profile_entries': self._entries.partition_size,
+                'profiles': self._entries.partitions,
+                'evictions': self._entries.evictions,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'invalidations': self.invalidations,
+            }
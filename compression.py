@@ -0,0 +1,175 @@
+"""gzip / brotli compression of HTML, JSON and other text responses.
+
+``Compressor.init_app`` adds an ``after_request`` hook that picks an
+encoding from ``Accept-Encoding`` (brotli when the ``brotli`` module is
+installed and the client takes it, else gzip) and compresses the body:
+
+* bodies shorter than ``min_size`` go out as they are; compressing them
+  costs more time than the bytes it saves;
+* a streamed response (``?stream=1``, exports) is compressed chunk by
+  chunk as it is generated and flushed every ``flush_size`` input bytes,
+  so it is never buffered whole and the client keeps receiving data;
+* a response with an ``ETag`` (the pages behind the query cache and
+  conditional GETs) is compressed once per URL, ETag and encoding: the
+  compressed bytes are kept in a small LRU and reused until the tables
+  behind the page change and the ETag with them. The LRU is partitioned
+  by ``partition()``, the profile a page shows, so pages of one profile
+  take at most ``partition_bytes`` of it.
+
+A compressed response gets ``Vary: Accept-Encoding`` and its ETag turns
+weak, since the bytes differ from the identity encoding; ``If-None-Match``
+uses weak comparison, so conditional GETs keep answering 304. Files sent
+by ``send_file`` (the precompressed assets) are left alone.
+"""
+import gzip
+import threading
+import time
+import zlib
+
+from flask import request
+
+from cache import PartitionedLRU
+import metrics
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+COMPRESSIBLE_TYPES = frozenset((
+    'text/html', 'text/plain', 'text/css', 'text/csv', 'text/javascript',
+    'application/json', 'application/javascript', 'application/x-ndjson',
+    'application/xml', 'image/svg+xml',
+))
+
+
+class Compressor:
+    """Negotiates and applies ``Content-Encoding`` to responses."""
+
+    def __init__(self, min_size=1024, gzip_level=6, brotli_quality=5, flush_size=64 * 1024,
+                 cache_bytes=16 * 1024 * 1024, partition=None, partition_bytes=None):
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.flush_size = flush_size
+        self.cache_bytes = cache_bytes
+        self.partition = partition
+        self.encodings = ('br', 'gzip') if brotli is not None else ('gzip',)
+        self._cache = PartitionedLRU(cache_bytes, partition_bytes, sizeof=len)  # (url, etag, encoding) -> bytes
+        self._lock = threading.Lock()
+        self.compressed = 0
+        self.streamed = 0
+        self.cache_hits = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def init_app(self, app):
+        app.after_request(self.compress_response)
+
+    def choose(self, accept_encodings):
+        """The best encoding the client accepts, or None."""
+        best, best_quality = None, 0
+        for encoding in self.encodings:
+            quality = accept_encodings.quality(encoding)
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+        return best
+
+    def compress(self, data, encoding):
+        if encoding == 'br':
+            return brotli.compress(data, quality=self.brotli_quality)
+        return gzip.compress(data, compresslevel=self.gzip_level, mtime=0)
+
+    def _stream_compressor(self, encoding):
+        """``(compress(chunk), flush(), finish())`` for one streamed body."""
+        if encoding == 'br':
+            compressor = brotli.Compressor(quality=self.brotli_quality)
+            return compressor.process, compressor.flush, compressor.finish
+        compressor = zlib.compressobj(self.gzip_level, zlib.DEFLATED, 31)  # 31: gzip container
+        return compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+    def _compress_stream(self, chunks, encoding):
+        compress, flush, finish = self._stream_compressor(encoding)
+        pending = 0
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode('utf-8')
+                self.bytes_in += len(chunk)
+                out = compress(chunk)
+                pending += len(chunk)
+                if pending >= self.flush_size:
+                    out += flush()
+                    pending = 0
+                if out:
+                    self.bytes_out += len(out)
+                    yield out
+            out = finish()
+            self.bytes_out += len(out)
+            yield out
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+
+    def _cached(self, key, data, encoding):
+        partition = self.partition() if self.partition else None
+        with self._lock:
+            body = self._cache.get(partition, key)
+            if body is not None:
+                self.cache_hits += 1
+                return body
+        body = self.compress(data, encoding)
+        with self._lock:
+            self._cache.put(partition, key, body)  # Dropped again at once if larger than the partition
+        return body
+
+    def compress_response(self, response):
+        if (response.status_code < 200 or response.status_code in (204, 206, 304)
+                or response.direct_passthrough
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in COMPRESSIBLE_TYPES):
+            return response
+        if not response.is_streamed and response.content_length is not None and response.content_length < self.min_size:
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = self.choose(request.accept_encodings)
+        if encoding is None:
+            return response
+
+        start = time.perf_counter()
+        etag, weak = response.get_etag()
+        if response.is_streamed:
+            response.response = self._compress_stream(response.response, encoding)
+            response.headers.pop('Content-Length', None)
+            self.streamed += 1
+        else:
+            data = response.get_data()
+            if etag:
+                body = self._cached((request.full_path, etag, encoding), data, encoding)
+            else:
+                body = self.compress(data, encoding)
+            if len(body) >= len(data):
+                return response
+            response.set_data(body)
+            self.bytes_in += len(data)
+            self.bytes_out += len(body)
+        self.compressed += 1
+        response.headers['Content-Encoding'] = encoding
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        metrics.add_timing('compress', time.perf_counter() - start)
+        return response
+
+    def stats(self):
+        with self._lock:
+            cached, cached_bytes = len(self._cache), self._cache.size
+        return {
+            'compressed': self.compressed,
+            'streamed': self.streamed,
+            'cache_hits': self.cache_hits,
+            'cached_pages': cached,
+            'cached_bytes': cached_bytes,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+        }
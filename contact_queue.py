@@ -0,0 +1,269 @@
+"""Write-behind queue for contact form submissions.
+
+``submit()`` only appends the message to a bounded in-memory queue (and,
+optionally, to a spool file) and returns. A background thread drains the
+queue into the ``Contact`` table with multi-row inserts, so a burst of
+submissions costs one round trip per batch instead of one per message.
+
+With a spool file every accepted message is on disk before ``submit()``
+returns. Each process writes its own spool, ``<spool_path>.<pid>``, and
+holds an ``flock`` on it for as long as it runs. Each message carries a
+sequence number; the writer records the last one it committed in
+``<spool>.committed``. On ``start()`` the writer takes over the spool of
+every process that is gone (its lock is free) and queues the messages it
+had not committed, so several workers can share one ``spool_path`` and a
+message is replayed by exactly one of them. The takeover runs under
+``<spool_path>.lock``. Delivery is at-least-once: a crash between the
+commit and the marker update can insert a batch twice. Spool lines written
+before messages carried their profile belong to the first one, and a
+spool written at ``spool_path`` itself, before spools were per process, is
+taken over like any other.
+"""
+import fcntl
+import json
+import os
+import threading
+import time
+from collections import deque
+
+INSERT_SQL = "INSERT INTO Contact (profile_id, name, email, message) VALUES (%s, %s, %s, %s)"
+
+
+class QueueFull(Exception):
+    """Raised by ``submit()`` when the queue is at ``max_depth``."""
+
+
+class ContactWriter:
+    def __init__(self, get_db_connection, max_depth=1000, batch_size=100,
+                 retry_delay=1.0, spool_path=None, on_flush=None):
+        self._get_db_connection = get_db_connection
+        self.max_depth = max_depth
+        self.batch_size = batch_size
+        self.retry_delay = retry_delay
+        self.spool_path = spool_path
+        self._on_flush = on_flush
+
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._spool = None
+        self._spool_file = None
+        self._thread = None
+        self._stopping = False
+
+        self.accepted = 0
+        self.rejected = 0
+        self.flushed = 0
+        self.batches = 0
+        self.flush_errors = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self._flush_time = 0.0
+
+    # Spool files
+
+    def _spool_paths(self):
+        """Every process's spool under ``spool_path``, and ``spool_path`` itself."""
+        directory, base = os.path.split(os.path.abspath(self.spool_path))
+        paths = []
+        for name in os.listdir(directory):
+            suffix = name[len(base) + 1:]
+            if name == base or (name.startswith(base + '.') and suffix.isdigit()):
+                paths.append(os.path.join(directory, name))
+        return paths
+
+    @staticmethod
+    def _uncommitted(path, f):
+        """The records in spool ``f`` after its committed marker."""
+        try:
+            with open(path + '.committed') as marker:
+                committed = int(marker.read().strip() or 0)
+        except (OSError, ValueError):
+            committed = 0
+        records = []
+        for line in f:
+            try:
+                seq, *record = json.loads(line)
+                if len(record) == 3:
+                    record.insert(0, 1)
+                profile_id, name, email, message = record
+            except ValueError:
+                continue  # Torn last line from a crash mid-write
+            if seq > committed:
+                records.append((profile_id, name, email, message))
+        return records
+
+    def _open_spool(self):
+        """Open this process's spool, moving into it what gone processes left uncommitted."""
+        os.makedirs(os.path.dirname(os.path.abspath(self.spool_path)), exist_ok=True)
+        own = f'{self.spool_path}.{os.getpid()}'
+        with open(self.spool_path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)  # One takeover at a time across processes
+            records = []
+            claimed = []
+            for path in self._spool_paths():
+                with open(path, 'r+', encoding='utf-8') as f:
+                    try:
+                        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue  # Its process is still running
+                    records.extend(self._uncommitted(path, f))
+                claimed.append(path)
+
+            tmp = own + '.tmp'
+            spool = open(tmp, 'w', encoding='utf-8')
+            fcntl.flock(spool, fcntl.LOCK_EX)  # Held until this process exits
+            for seq, record in enumerate(records, 1):
+                spool.write(json.dumps([seq, *record]) + '\n')
+            spool.flush()
+            os.fsync(spool.fileno())
+            os.replace(tmp, own)
+            self._spool_file = own
+            self._mark_committed(0)
+            for path in claimed:
+                if path != own:
+                    os.remove(path)
+                    try:
+                        os.remove(path + '.committed')
+                    except FileNotFoundError:
+                        pass
+
+        self._seq = len(records)
+        self._pending.extend(enumerate(records, 1))
+        self._spool = spool
+
+    def _mark_committed(self, seq):
+        marker = self._spool_file + '.committed'
+        tmp = marker + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(str(seq))
+        os.replace(tmp, marker)
+
+    # Producer side
+
+    def submit(self, profile_id, name, email, message):
+        """Queue a message to a profile for insertion; raises ``QueueFull`` when saturated."""
+        with self._cond:
+            if len(self._pending) >= self.max_depth:
+                self.rejected += 1
+                raise QueueFull(f"contact queue is full ({self.max_depth} messages waiting)")
+            self._seq += 1
+            record = (profile_id, name, email, message)
+            if self._spool:
+                self._spool.write(json.dumps([self._seq, *record]) + '\n')
+                self._spool.flush()
+                os.fsync(self._spool.fileno())
+            self._pending.append((self._seq, record))
+            self.accepted += 1
+            self._cond.notify()
+
+    # Writer side
+
+    def start(self):
+        """Start the writer, first queueing what gone processes left in their spools.
+
+        The spools are opened here rather than on construction, so each
+        process forked from a server's master writes its own.
+        """
+        if self.spool_path and self._spool is None:
+            self._open_spool()
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name='contact-writer', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5.0):
+        """Flush what is queued (within ``timeout``) and stop the writer.
+
+        A spool left with nothing uncommitted is removed; otherwise it stays
+        for the next process to take over.
+        """
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self._spool and not (self._thread and self._thread.is_alive()):
+            with open(self.spool_path + '.lock', 'a') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                with self._cond:
+                    drained = not self._pending
+                if drained:
+                    os.remove(self._spool_file)
+                    os.remove(self._spool_file + '.committed')
+                self._spool.close()
+                self._spool = None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopping:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                batch = [self._pending[i] for i in range(min(self.batch_size, len(self._pending)))]
+
+            if self._flush(batch):
+                with self._cond:
+                    for _ in batch:
+                        self._pending.popleft()
+                    drained = not self._pending
+                if self._spool:
+                    self._mark_committed(batch[-1][0])
+                    if drained:
+                        self._truncate_spool()
+            elif self._stopping:
+                return  # The spool still holds the batch for the next start
+            else:
+                time.sleep(self.retry_delay)
+
+    def _flush(self, batch):
+        start = time.monotonic()
+        mydb = self._get_db_connection()
+        if not mydb:
+            self.flush_errors += 1
+            return False
+        try:
+            with mydb:
+                cursor = mydb.cursor()
+                cursor.executemany(INSERT_SQL, [record for _, record in batch])
+                mydb.commit()
+                cursor.close()
+        except Exception as err:
+            print(f"Error flushing contact messages: {err}")
+            self.flush_errors += 1
+            return False
+
+        latency = time.monotonic() - start
+        self.flushed += len(batch)
+        self.batches += 1
+        self.last_flush_latency = latency
+        self.max_flush_latency = max(self.max_flush_latency, latency)
+        self._flush_time += latency
+        if self._on_flush:
+            self._on_flush()
+        return True
+
+    def _truncate_spool(self):
+        with self._cond:
+            # Only safe while nothing new has been accepted since the check
+            if not self._pending:
+                self._spool.truncate(0)
+                self._spool.seek(0)
+
+    def stats(self):
+        with self._cond:
+            depth = len(self._pending)
+        return {
+            'depth': depth,
+            'max_depth': self.max_depth,
+            'accepted': self.accepted,
+            'rejected': self.rejected,
+            'flushed': self.flushed,
+            'batches': self.batches,
+            'flush_errors': self.flush_errors,
+            'last_flush_latency': round(self.last_flush_latency, 6),
+            'avg_flush_latency': round(self._flush_time / self.batches, 6) if self.batches else 0.0,
+            'max_flush_latency': round(self.max_flush_latency, 6),
+            'spooled': bool(self.spool_path),
+        }
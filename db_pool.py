@@ -0,0 +1,265 @@
+"""Bounded, thread-safe database connection pool.
+
+Connections are created lazily up to ``size``, handed out through
+``acquire()`` and returned to the pool when the borrowed connection is
+closed or its ``with`` block exits, so a failing query can no longer leak
+a connection. Every connection is rolled back on its way back, so no
+borrower inherits another's open transaction, or the snapshot a
+REPEATABLE READ one reads from.
+
+A process forked from one holding a pool starts with an empty pool: the
+connections opened before the fork stay with the parent, since two
+processes talking over one socket would corrupt each other's queries.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes free within the checkout timeout."""
+
+
+class _Slot:
+    __slots__ = ('conn', 'created_at', 'last_used', 'statements')
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = self.last_used = time.monotonic()
+        self.statements = {}  # SQL -> prepared cursor, lives as long as conn
+
+
+class PooledConnection:
+    """A borrowed connection; ``close()`` hands it back to the pool."""
+
+    def __init__(self, pool, slot):
+        self._pool = pool
+        self._slot = slot
+
+    def __getattr__(self, name):
+        if self._slot is None:
+            raise AttributeError(f"connection already returned to the pool ({name})")
+        return getattr(self._slot.conn, name)
+
+    def cursor(self, *args, **kwargs):
+        if self._slot is None:
+            raise AttributeError("connection already returned to the pool (cursor)")
+        cursor = self._slot.conn.cursor(*args, **kwargs)
+        if self._pool.cursor_wrapper is not None:
+            cursor = self._pool.cursor_wrapper(cursor)
+        return cursor
+
+    def prepared(self, sql):
+        """A cursor for ``sql``, prepared once per underlying connection.
+
+        The cursor is kept with the connection and handed to every later
+        borrower that runs the same statement, so the server parses it once
+        per connection. It must only ever execute ``sql``, its results must
+        be fully fetched, and it must not be closed.
+        """
+        if self._slot is None:
+            raise AttributeError("connection already returned to the pool (prepared)")
+        statements = self._slot.statements
+        cursor = statements.get(sql)
+        if cursor is None:
+            cursor = statements[sql] = self.cursor(prepared=True)
+        return cursor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._pool.breaker is not None and (exc is None or isinstance(exc, Exception)):
+            self._pool.breaker.record(exc)
+        self._release(False)
+        return False
+
+    def close(self):
+        self._release(False)
+
+    def __del__(self):
+        # Safety net for a borrow that was dropped without being closed, e.g.
+        # a streamed response whose generator never started
+        if self.__dict__.get('_slot') is not None:
+            self._release(True)
+
+    def discard(self):
+        """Close the underlying connection instead of returning it."""
+        self._release(True)
+
+    def _release(self, discard):
+        slot, self._slot = self._slot, None
+        if slot is None:
+            return
+        if not discard:
+            # Never hand a half-finished transaction, or a read-only one
+            # pinning an old snapshot, to the next borrower
+            try:
+                slot.conn.rollback()
+            except Exception:
+                discard = True
+        self._pool._release(slot, discard)
+
+
+class ConnectionPool:
+    """Hands out at most ``size`` connections made by ``connect()``.
+
+    ``timeout`` bounds how long ``acquire()`` waits for a free connection,
+    connections older than ``max_lifetime`` seconds are recycled, and a
+    connection that sat idle for more than ``ping_after`` seconds is run
+    through ``check(conn)`` before it is lent out (``0`` checks on every
+    borrow). ``cursor_wrapper``, if given, wraps every cursor handed out,
+    e.g. to time queries.
+
+    With a ``breaker`` (see ``breaker.CircuitBreaker``), ``acquire()``
+    raises ``CircuitOpen`` at once while it is open, and failed connects
+    and the errors that end a ``with`` block are reported to it.
+    """
+
+    def __init__(self, connect, size=5, timeout=10.0, max_lifetime=1800.0,
+                 ping_after=30.0, check=None, cursor_wrapper=None, breaker=None):
+        if size < 1:
+            raise ValueError("pool size must be at least 1")
+        self._connect = connect
+        self._check = check
+        self.cursor_wrapper = cursor_wrapper
+        self.breaker = breaker
+        self.size = size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.ping_after = ping_after
+
+        self._idle = deque()
+        self._in_use = 0
+        self._cond = threading.Condition()
+
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._max_wait = 0.0
+        self._timeouts = 0
+        self._created = 0
+        self._recycled = 0
+        self._discarded = 0
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # Forget the parent's connections without closing them: closing would end its sessions too
+        self._idle = deque()
+        self._in_use = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """Borrow a connection, waiting up to ``timeout`` seconds for one."""
+        if self.breaker is not None:
+            self.breaker.check()
+        start = time.monotonic()
+        deadline = start + self.timeout
+        with self._cond:
+            while True:
+                if self._idle:
+                    slot = self._idle.pop()  # Most recently used is warmest
+                    break
+                if self._in_use < self.size:
+                    slot = None  # Room to open a new one
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(f"no database connection free after {self.timeout:g}s")
+                self._cond.wait(remaining)
+            self._in_use += 1
+            self._checkouts += 1
+            waited = time.monotonic() - start
+            if waited > 0.001:
+                self._waits += 1
+                self._wait_time += waited
+                self._max_wait = max(self._max_wait, waited)
+
+        # Connecting and pinging happen outside the lock
+        try:
+            slot = self._prepare(slot)
+        except BaseException:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return PooledConnection(self, slot)
+
+    def _prepare(self, slot):
+        now = time.monotonic()
+        if slot is not None and now - slot.created_at > self.max_lifetime:
+            self._close(slot)
+            with self._cond:
+                self._recycled += 1
+            slot = None
+        elif slot is not None and self._check and now - slot.last_used >= self.ping_after:
+            try:
+                healthy = self._check(slot.conn)
+            except Exception:
+                healthy = False
+            if not healthy:
+                self._close(slot)
+                with self._cond:
+                    self._discarded += 1
+                slot = None
+        if slot is None:
+            try:
+                conn = self._connect()
+            except Exception as err:
+                if self.breaker is not None:
+                    self.breaker.record(err)
+                raise
+            slot = _Slot(conn)
+            with self._cond:
+                self._created += 1
+        return slot
+
+    def _release(self, slot, discard=False):
+        if not discard and time.monotonic() - slot.created_at > self.max_lifetime:
+            discard = True
+            with self._cond:
+                self._recycled += 1
+        elif discard:
+            with self._cond:
+                self._discarded += 1
+        if discard:
+            self._close(slot)
+        with self._cond:
+            self._in_use -= 1
+            if not discard:
+                slot.last_used = time.monotonic()
+                self._idle.append(slot)
+            self._cond.notify()
+
+    @staticmethod
+    def _close(slot):
+        try:
+            slot.conn.close()
+        except Exception:
+            pass
+
+    def close_all(self):
+        """Close every idle connection; borrowed ones are closed on return."""
+        with self._cond:
+            idle, self._idle = list(self._idle), deque()
+        for slot in idle:
+            self._close(slot)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'size': self.size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'wait_time_total': round(self._wait_time, 6),
+                'wait_time_avg': round(self._wait_time / self._waits, 6) if self._waits else 0.0,
+                'wait_time_max': round(self._max_wait, 6),
+                'timeouts': self._timeouts,
+                'created': self._created,
+                'recycled': self._recycled,
+                'discarded': self._discarded,
+            }
@@ -0,0 +1,58 @@
+"""Production serving profile: ``gunicorn -c gunicorn.conf.py``.
+
+The master process imports the app and loads every template once
+(``preload_app`` and ``app.create_app()``), then forks the workers, which
+share that memory. Importing the app opens no connection and starts no
+thread: each worker opens its own database connections, builds the default
+profile's search index and starts its contact writer after the fork
+(``post_fork``), and its caches start empty.
+
+A worker is replaced once it has served about ``max_requests`` requests;
+it finishes the requests in flight first, and the jitter keeps the workers
+from restarting all at once. ``python -m benchmarks.serve`` reports the
+startup time and throughput of this profile.
+"""
+import os
+import time
+
+try:
+    cpus = len(os.sched_getaffinity(0))  # The CPUs this process may run on, e.g. a container's share
+except AttributeError:
+    cpus = os.cpu_count() or 1
+
+wsgi_app = 'app:create_app()'
+bind = os.getenv('WEB_BIND', '0.0.0.0:8000')
+
+# One process per CPU renders pages and compresses responses in parallel;
+# the threads of each overlap the time its requests wait on the database.
+# Every worker holds up to DB_POOL_SIZE connections
+worker_class = 'gthread'
+workers = int(os.getenv('WEB_WORKERS', str(cpus)))
+threads = int(os.getenv('WEB_THREADS', '4'))
+
+preload_app = os.getenv('WEB_PRELOAD', '1') == '1'
+max_requests = int(os.getenv('WEB_MAX_REQUESTS', '10000'))  # requests before a worker is replaced; 0 never
+max_requests_jitter = max_requests // 10
+timeout = int(os.getenv('WEB_TIMEOUT', '30'))               # seconds a worker may go silent before it is killed
+graceful_timeout = int(os.getenv('WEB_GRACEFUL_TIMEOUT', '30'))  # seconds to finish requests on restart or stop
+keepalive = int(os.getenv('WEB_KEEPALIVE', '5'))
+
+# Workers must agree on a page's ETag. With several, the query cache's table
+# versions default to the SQLite store all of them share; with the local
+# one, CACHE_EPOCH at least gives every worker of this server the same epoch
+if workers > 1:
+    os.environ.setdefault('CACHE_BACKEND', 'sqlite')
+os.environ['CACHE_EPOCH'] = repr(time.time())
+
+# With CONTACT_SPOOL_PATH each worker spools to its own <path>.<pid>, and a
+# new worker takes over the messages a replaced one left uncommitted
+
+
+def post_fork(server, worker):
+    import app
+    app.start_worker()
+
+
+def worker_exit(server, worker):
+    import app
+    app.stop_worker()
@@ -0,0 +1,98 @@
+"""Conditional GET support for pages built from database tables.
+
+Validators come from the tables' versions in the query cache, so a request
+carrying a matching ``If-None-Match`` or ``If-Modified-Since`` gets its 304
+before the view runs: no query and no template render.
+"""
+import hashlib
+import inspect
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import make_response, request
+
+
+def table_etag(versions, tables, generations, profile=None, release=''):
+    """Strong ETag for ``tables`` of ``profile`` at ``generations``.
+
+    The store's epoch is mixed in so counters that restart from zero never
+    reproduce an old tag, and so is ``release``, which identifies the code,
+    templates and assets the page was rendered with, so a tag from before a
+    deploy never matches after it.
+    """
+    parts = ",".join(f"{table}:{generation}" for table, generation in zip(tables, generations))
+    if profile is not None:
+        parts = f"{profile}/{parts}"
+    raw = f"{release}:{versions.epoch:.6f}:{parts}".encode()
+    return hashlib.sha1(raw).hexdigest()[:20]
+
+
+def conditional(query_cache, tables, cache_control=None, profile=None, release=''):
+    """Answer conditional GETs for a view that renders ``tables``.
+
+    ``tables`` is a table name or a tuple of them for pages that combine
+    several; the page changes whenever any of them does. ``profile()``
+    returns the profile the current request shows, whose rows of ``tables``
+    are the ones that count. ``release`` names the deployed build (see
+    ``table_etag``).
+
+    ``cache_control`` is sent as-is on 200 and 304 responses, e.g.
+    ``"public, max-age=60"`` to let a CDN serve the page for a minute.
+    Coroutine views, those of the ASGI app, are wrapped the same way.
+    """
+    if isinstance(tables, str):
+        tables = (tables,)
+
+    def validators():
+        partition = profile() if profile else None
+        versions = [query_cache.version(table, partition) for table in tables]
+        etag = table_etag(query_cache.versions, tables, [v[0] for v in versions], partition, release)
+        updated_at = max(v[1] for v in versions)
+        last_modified = datetime.fromtimestamp(int(updated_at), tz=timezone.utc)
+
+        if request.if_none_match:
+            # Weak comparison, as If-None-Match specifies: compression
+            # weakens the tag of the responses it encodes
+            not_modified = request.if_none_match.contains_weak(etag)
+        elif request.if_modified_since:
+            not_modified = last_modified <= request.if_modified_since
+        else:
+            not_modified = False
+        return etag, last_modified, not_modified
+
+    def finish(response, etag, last_modified):
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        if cache_control:
+            response.headers['Cache-Control'] = cache_control
+        return response
+
+    def decorator(view):
+        if inspect.iscoroutinefunction(view):
+            # The ASGI app's views
+            @wraps(view)
+            async def async_wrapper(*args, **kwargs):
+                if request.method not in ('GET', 'HEAD'):
+                    return await view(*args, **kwargs)
+                etag, last_modified, not_modified = validators()
+                if not_modified:
+                    return finish(make_response('', 304), etag, last_modified)
+                response = make_response(await view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                return finish(response, etag, last_modified)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(*args, **kwargs)
+            etag, last_modified, not_modified = validators()
+            if not_modified:
+                return finish(make_response('', 304), etag, last_modified)
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            return finish(response, etag, last_modified)
+        return wrapper
+    return decorator
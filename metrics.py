@@ -0,0 +1,300 @@
+"""Low-overhead request, query and template timing.
+
+Three things are collected:
+
+* per-request phase timings (``connect``, ``query``, ``render``,
+  ``compress``) that are
+  sent back in a ``Server-Timing`` header;
+* latency histograms per route, per SQL statement and per template;
+* request and error counters per route.
+
+``Registry.render()`` produces the Prometheus text format served from
+``/metrics``; gauges such as pool usage are pulled from callbacks at scrape
+time, so they cost nothing between scrapes. Recording an observation is a
+bucket search and two additions under a lock.
+"""
+import bisect
+import re
+import threading
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Per request: a thread under WSGI, a task under ASGI, where many requests share a thread
+_timings = ContextVar('timings', default=None)
+_started = ContextVar('started', default=None)
+_render_started = ContextVar('render_started', default=None)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] += amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield f"{self.name}{_labels(self.labelnames, labels)} {value:g}"
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # Per-bucket counts (last slot is +Inf), then sum
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def snapshot(self):
+        """``{labels: (count, sum)}`` for every series."""
+        with self._lock:
+            return {labels: (sum(s[:-1]), s[-1]) for labels, s in self._series.items()}
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = [(labels, list(series)) for labels, series in self._series.items()]
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound:g}"'
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {series[-1]:.6f}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._gauges = []
+
+    def counter(self, name, help, labelnames=()):
+        metric = Counter(name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def gauges(self, prefix, help, collect):
+        """Expose every numeric value of ``collect()`` as ``<prefix>_<key>``."""
+        self._gauges.append((prefix, help, collect))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for prefix, help, collect in self._gauges:
+            for key, value in collect().items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                lines.append(f"# HELP {prefix}_{key} {help} ({key})")
+                lines.append(f"# TYPE {prefix}_{key} gauge")
+                lines.append(f"{prefix}_{key} {value:g}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+request_duration = registry.histogram(
+    'cv_request_duration_seconds', 'Time spent handling a request.', ('route',))
+requests_total = registry.counter(
+    'cv_requests_total', 'Requests handled.', ('route', 'method', 'status'))
+request_errors = registry.counter(
+    'cv_request_errors_total', 'Requests answered with a 5xx status.', ('route',))
+query_duration = registry.histogram(
+    'cv_query_duration_seconds', 'Time spent executing and fetching a SQL statement.', ('statement',))
+render_duration = registry.histogram(
+    'cv_template_render_seconds', 'Time spent rendering a template.', ('template',))
+
+
+# Per-request phase timings
+
+class Timings:
+    __slots__ = ('connect', 'query', 'render', 'compress', '_lock')
+
+    def __init__(self):
+        self.connect = self.query = self.render = self.compress = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, phase, seconds):
+        with self._lock:
+            setattr(self, phase, getattr(self, phase) + seconds)
+
+    def header(self, total):
+        return (f"connect;dur={self.connect * 1000:.2f}, query;dur={self.query * 1000:.2f}, "
+                f"render;dur={self.render * 1000:.2f}, compress;dur={self.compress * 1000:.2f}, "
+                f"total;dur={total * 1000:.2f}")
+
+
+def current_timings():
+    return _timings.get()
+
+
+def add_timing(phase, seconds):
+    """Charge ``seconds`` to ``phase`` of the request running in this context."""
+    timings = _timings.get()
+    if timings is not None:
+        timings.add(phase, seconds)
+
+
+def bind(fn):
+    """Wrap ``fn`` so timings it records on another thread count for this request."""
+    timings = current_timings()
+
+    def bound(*args, **kwargs):
+        token = _timings.set(timings)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _timings.reset(token)
+    return bound
+
+
+# SQL statement timing
+
+_WHITESPACE = re.compile(r'\s+')
+_IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+
+
+def statement_label(sql):
+    """Collapse whitespace and IN-lists so one statement shape is one label."""
+    return _IN_LIST.sub('IN (...)', _WHITESPACE.sub(' ', sql).strip())
+
+
+class TimedCursor:
+    """Cursor proxy timing each statement from ``execute`` to its last fetch."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._statement = None
+        self._elapsed = 0.0
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def _timed(self, fn, *args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            self._elapsed += elapsed
+            add_timing('query', elapsed)
+
+    def _finish(self):
+        if self._statement is not None:
+            query_duration.observe(self._elapsed, self._statement)
+            self._statement = None
+            self._elapsed = 0.0
+
+    def execute(self, sql, *args, **kwargs):
+        self._finish()
+        self._statement = statement_label(sql)
+        return self._timed(lambda: self._cursor.execute(sql, *args, **kwargs))
+
+    def executemany(self, sql, *args, **kwargs):
+        self._finish()
+        self._statement = statement_label(sql)
+        return self._timed(lambda: self._cursor.executemany(sql, *args, **kwargs))
+
+    def fetchone(self):
+        return self._timed(self._cursor.fetchone)
+
+    def fetchmany(self, *args):
+        return self._timed(self._cursor.fetchmany, *args)
+
+    def fetchall(self):
+        try:
+            return self._timed(self._cursor.fetchall)
+        finally:
+            # Nothing left to fetch; don't wait for a reused cursor's next execute
+            self._finish()
+
+    def close(self):
+        self._finish()
+        return self._cursor.close()
+
+
+# Flask integration
+
+def init_app(app):
+    """Time every request, expose ``Server-Timing`` and record route metrics."""
+    from flask import before_render_template, request, template_rendered
+
+    @app.before_request
+    def start_timer():
+        _timings.set(Timings())
+        _started.set(time.perf_counter())
+
+    @app.after_request
+    def record_request(response):
+        timings = current_timings()
+        if timings is None:
+            return response
+        total = time.perf_counter() - _started.get()
+        route = request.endpoint or 'unmatched'
+        request_duration.observe(total, route)
+        requests_total.inc(route, request.method, str(response.status_code))
+        if response.status_code >= 500:
+            request_errors.inc(route)
+        response.headers['Server-Timing'] = timings.header(total)
+        return response
+
+    @app.teardown_request
+    def clear_timer(exc):
+        _timings.set(None)
+
+    def render_started(sender, template, context, **extra):
+        _render_started.set(time.perf_counter())
+
+    def render_finished(sender, template, context, **extra):
+        started = _render_started.get()
+        if started is not None:
+            elapsed = time.perf_counter() - started
+            _render_started.set(None)
+            render_duration.observe(elapsed, template.name)
+            add_timing('render', elapsed)
+
+    before_render_template.connect(render_started, app, weak=False)
+    template_rendered.connect(render_finished, app, weak=False)
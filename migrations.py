@@ -0,0 +1,365 @@
+"""Versioned schema migrations for MySQL and SQLite.
+
+Each migration has a version number, a name and the statements to run for
+each dialect. ``migrate()`` records applied versions in
+``schema_migrations`` and runs only the ones that are missing, in order,
+while holding a lock so two workers starting at once don't both apply
+them. Migration 1 uses ``CREATE TABLE IF NOT EXISTS`` so a database that
+predates migrations is adopted as it is.
+
+Add a migration by appending to ``MIGRATIONS``; never edit one that has
+shipped.
+"""
+import datetime
+
+# The tables migration 4 scopes by profile, and its indexes for them
+PROFILE_TABLES = ('Personal_Info', 'Education', 'Work_Experience', 'Skills', 'Projects', 'Contact')
+PROFILE_INDEXES = [
+    "CREATE INDEX idx_personal_info_profile ON Personal_Info (profile_id)",
+    "CREATE INDEX idx_education_profile ON Education (profile_id)",
+    "CREATE INDEX idx_education_profile_start_year ON Education (profile_id, start_year)",
+    "CREATE INDEX idx_education_profile_end_year ON Education (profile_id, end_year)",
+    "CREATE INDEX idx_work_experience_profile ON Work_Experience (profile_id)",
+    "CREATE INDEX idx_work_experience_profile_start_year ON Work_Experience (profile_id, start_year)",
+    "CREATE INDEX idx_work_experience_profile_end_year ON Work_Experience (profile_id, end_year)",
+    "CREATE INDEX idx_skills_profile ON Skills (profile_id)",
+    "CREATE INDEX idx_skills_profile_category_name ON Skills (profile_id, category, skill_name)",
+    "CREATE INDEX idx_skills_profile_skill_name ON Skills (profile_id, skill_name)",
+    "CREATE INDEX idx_projects_profile ON Projects (profile_id)",
+    "CREATE INDEX idx_projects_profile_start_date ON Projects (profile_id, start_date)",
+    "CREATE INDEX idx_projects_profile_end_date ON Projects (profile_id, end_date)",
+    "CREATE INDEX idx_contact_profile ON Contact (profile_id)",
+    "CREATE INDEX idx_contact_profile_created_at ON Contact (profile_id, created_at)",
+]
+# The indexes migration 5 adds
+ORDERED_INDEXES = [
+    "CREATE INDEX idx_education_profile_id_start_year ON Education (profile_id, id, start_year)",
+    "CREATE INDEX idx_education_profile_end_year_start_year ON Education (profile_id, end_year, id, start_year)",
+    "CREATE INDEX idx_work_experience_profile_id_start_year ON Work_Experience (profile_id, id, start_year)",
+    "CREATE INDEX idx_work_experience_profile_end_year_start_year "
+    "ON Work_Experience (profile_id, end_year, id, start_year)",
+    "CREATE INDEX idx_skills_profile_category ON Skills (profile_id, category)",
+    "CREATE INDEX idx_projects_profile_id_start_date ON Projects (profile_id, id, start_date)",
+    "CREATE INDEX idx_projects_profile_end_date_start_date ON Projects (profile_id, end_date, id, start_date)",
+]
+
+MIGRATIONS = [
+    (1, 'create tables', {
+        'sqlite': [
+            """CREATE TABLE IF NOT EXISTS Personal_Info (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT, email TEXT, phone TEXT, bio TEXT
+            )""",
+            """CREATE TABLE IF NOT EXISTS Education (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                school TEXT, achievement TEXT, start_year INTEGER, end_year INTEGER, description TEXT
+            )""",
+            """CREATE TABLE IF NOT EXISTS Work_Experience (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                company TEXT, position TEXT, start_year INTEGER, end_year INTEGER, description TEXT
+            )""",
+            """CREATE TABLE IF NOT EXISTS Skills (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                skill_name TEXT, category TEXT, proficiency_level TEXT
+            )""",
+            """CREATE TABLE IF NOT EXISTS Projects (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                project_name TEXT, description TEXT, start_date TEXT, end_date TEXT
+            )""",
+            """CREATE TABLE IF NOT EXISTS Contact (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT, email TEXT, message TEXT
+            )""",
+        ],
+        'mysql': [
+            """CREATE TABLE IF NOT EXISTS Personal_Info (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                name VARCHAR(255), email VARCHAR(255), phone VARCHAR(50), bio TEXT
+            )""",
+            """CREATE TABLE IF NOT EXISTS Education (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                school VARCHAR(255), achievement VARCHAR(255), start_year INT, end_year INT, description TEXT
+            )""",
+            """CREATE TABLE IF NOT EXISTS Work_Experience (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                company VARCHAR(255), position VARCHAR(255), start_year INT, end_year INT, description TEXT
+            )""",
+            """CREATE TABLE IF NOT EXISTS Skills (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                skill_name VARCHAR(255), category VARCHAR(255), proficiency_level VARCHAR(50)
+            )""",
+            """CREATE TABLE IF NOT EXISTS Projects (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                project_name VARCHAR(255), description TEXT, start_date DATE, end_date DATE
+            )""",
+            """CREATE TABLE IF NOT EXISTS Contact (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                name VARCHAR(255), email VARCHAR(255), message TEXT
+            )""",
+        ],
+    }),
+    # One index per sortable column and one per filter. Both engines append
+    # the primary key to every secondary index, so (start_year) also
+    # serves ORDER BY start_year, id and the keyset seek after a page.
+    (2, 'list page indexes', {
+        'all': [
+            "CREATE INDEX idx_education_start_year ON Education (start_year)",
+            "CREATE INDEX idx_education_end_year ON Education (end_year)",
+            "CREATE INDEX idx_work_experience_start_year ON Work_Experience (start_year)",
+            "CREATE INDEX idx_work_experience_end_year ON Work_Experience (end_year)",
+            "CREATE INDEX idx_skills_category_name ON Skills (category, skill_name)",
+            "CREATE INDEX idx_skills_skill_name ON Skills (skill_name)",
+            "CREATE INDEX idx_projects_start_date ON Projects (start_date)",
+            "CREATE INDEX idx_projects_end_date ON Projects (end_date)",
+        ],
+    }),
+    # When each message arrived, for the inbox (newest first, seeking on
+    # (created_at, id)) and the retention job (oldest first). SQLite cannot
+    # add a column defaulting to CURRENT_TIMESTAMP, so the table is rebuilt;
+    # on both engines the messages already there are stamped with the
+    # time of the migration.
+    (3, 'contact timestamps', {
+        'sqlite': [
+            """CREATE TABLE Contact_new (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT, email TEXT, message TEXT,
+                created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )""",
+            "INSERT INTO Contact_new (id, name, email, message) SELECT id, name, email, message FROM Contact",
+            # Carry the id counter over, so ids of deleted messages are not handed out again
+            """UPDATE sqlite_sequence SET seq = MAX(seq, COALESCE(
+                (SELECT seq FROM sqlite_sequence WHERE name = 'Contact'), 0)) WHERE name = 'Contact_new'""",
+            "DROP TABLE Contact",
+            "ALTER TABLE Contact_new RENAME TO Contact",
+            "CREATE INDEX idx_contact_created_at ON Contact (created_at)",
+        ],
+        'mysql': [
+            """ALTER TABLE Contact
+                ADD COLUMN created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                ADD INDEX idx_contact_created_at (created_at)""",
+        ],
+    }),
+    # Many CVs in one database. Every row belongs to a profile, and the rows
+    # already there to the first one, 'default'. Every list query now starts
+    # with profile_id = ?, so the indexes of migration 2 get profile_id in
+    # front; (profile_id) alone serves the pages ordered by id. The
+    # retention job reads Contact across profiles, by created_at alone.
+    (4, 'profiles', {
+        'sqlite': [
+            """CREATE TABLE Profiles (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                slug TEXT NOT NULL UNIQUE, name TEXT
+            )""",
+            "INSERT INTO Profiles (id, slug, name) VALUES (1, 'default', NULL)",
+        ] + [f"ALTER TABLE {table} ADD COLUMN profile_id INTEGER NOT NULL DEFAULT 1" for table in PROFILE_TABLES] + [
+            "DROP INDEX idx_education_start_year",
+            "DROP INDEX idx_education_end_year",
+            "DROP INDEX idx_work_experience_start_year",
+            "DROP INDEX idx_work_experience_end_year",
+            "DROP INDEX idx_skills_category_name",
+            "DROP INDEX idx_skills_skill_name",
+            "DROP INDEX idx_projects_start_date",
+            "DROP INDEX idx_projects_end_date",
+        ] + PROFILE_INDEXES,
+        'mysql': [
+            """CREATE TABLE Profiles (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                slug VARCHAR(64) NOT NULL UNIQUE, name VARCHAR(255)
+            )""",
+            "INSERT INTO Profiles (id, slug, name) VALUES (1, 'default', NULL)",
+        ] + [f"ALTER TABLE {table} ADD COLUMN profile_id INT NOT NULL DEFAULT 1" for table in PROFILE_TABLES] + [
+            "DROP INDEX idx_education_start_year ON Education",
+            "DROP INDEX idx_education_end_year ON Education",
+            "DROP INDEX idx_work_experience_start_year ON Work_Experience",
+            "DROP INDEX idx_work_experience_end_year ON Work_Experience",
+            "DROP INDEX idx_skills_category_name ON Skills",
+            "DROP INDEX idx_skills_skill_name ON Skills",
+            "DROP INDEX idx_projects_start_date ON Projects",
+            "DROP INDEX idx_projects_end_date ON Projects",
+        ] + PROFILE_INDEXES + [
+            # The app always names the profile; MySQL, unlike SQLite, can drop the default
+            f"ALTER TABLE {table} ALTER COLUMN profile_id DROP DEFAULT" for table in PROFILE_TABLES
+        ],
+    }),
+    # Every list page read in index order, with no sort step. A range filter
+    # on start_year (or start_date) combined with another sort is checked on
+    # the sort's index instead of seeked on (see ``Repository.query``), so
+    # those indexes carry the filtered column after the id they order by:
+    # (profile_id, end_year, id, start_year) for sort=end_year and
+    # (profile_id, id, start_year) for sort=id, which replaces (profile_id).
+    # (profile_id, category) orders Skills by category, id and serves
+    # ?category= with sort=id.
+    (5, 'ordered list page indexes', {
+        'sqlite': [
+            "DROP INDEX idx_education_profile",
+            "DROP INDEX idx_education_profile_end_year",
+            "DROP INDEX idx_work_experience_profile",
+            "DROP INDEX idx_work_experience_profile_end_year",
+            "DROP INDEX idx_projects_profile",
+            "DROP INDEX idx_projects_profile_end_date",
+        ] + ORDERED_INDEXES,
+        'mysql': [
+            "DROP INDEX idx_education_profile ON Education",
+            "DROP INDEX idx_education_profile_end_year ON Education",
+            "DROP INDEX idx_work_experience_profile ON Work_Experience",
+            "DROP INDEX idx_work_experience_profile_end_year ON Work_Experience",
+            "DROP INDEX idx_projects_profile ON Projects",
+            "DROP INDEX idx_projects_profile_end_date ON Projects",
+        ] + ORDERED_INDEXES,
+    }),
+]
+
+LATEST = MIGRATIONS[-1][0]
+
+
+def _statements(statements, dialect):
+    return statements.get(dialect, statements.get('all', []))
+
+
+def applied_versions(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT version FROM schema_migrations")
+    versions = {row[0] for row in cursor.fetchall()}
+    cursor.close()
+    return versions
+
+
+def migrate(conn, dialect, target=None):
+    """Apply pending migrations to a raw DB-API connection.
+
+    ``dialect`` is ``'mysql'`` or ``'sqlite'``. Returns the versions that
+    were applied, oldest first.
+    """
+    target = LATEST if target is None else target
+    param = '?' if dialect == 'sqlite' else '%s'
+    cursor = conn.cursor()
+    cursor.execute("CREATE TABLE IF NOT EXISTS schema_migrations ("
+                   "version INTEGER PRIMARY KEY, name VARCHAR(255), applied_at VARCHAR(32))")
+    conn.commit()
+
+    if dialect == 'sqlite':
+        cursor.execute("BEGIN IMMEDIATE")  # Serializes concurrent migrators
+    else:
+        cursor.execute("SELECT GET_LOCK('cv_schema_migrations', 60)")
+        cursor.fetchall()
+    applied = []
+    try:
+        done = applied_versions(conn)
+        for version, name, statements in MIGRATIONS:
+            if version in done or version > target:
+                continue
+            for statement in _statements(statements, dialect):
+                cursor.execute(statement)
+            cursor.execute(
+                f"INSERT INTO schema_migrations (version, name, applied_at) VALUES ({param}, {param}, {param})",
+                (version, name, datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'))
+            )
+            applied.append(version)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        if dialect != 'sqlite':
+            cursor.execute("SELECT RELEASE_LOCK('cv_schema_migrations')")
+            cursor.fetchall()
+        cursor.close()
+    return applied
+
+
+# Index checks
+
+def list_queries(table):
+    """Every sort, direction, filter and page-cursor combination of a list page.
+
+    Yields ``query()`` keyword arguments for the first profile; filters
+    get a sample value.
+    """
+    filter_names = sorted(table.filters)
+    subsets = [()]
+    for name in filter_names:
+        subsets += [subset + (name,) for subset in subsets]
+    for sort in table.sorts:
+        cursors = [dict()]
+        if sort == 'id':
+            cursors.append(dict(after=1))
+        elif sort in table.generated:
+            cursors.append(dict(after=1, key='2020'))  # Never NULL
+        else:
+            cursors += [dict(after=1, key=None), dict(after=1, key='2020')]
+        for descending in (False, True):
+            for subset in subsets:
+                for cursor in cursors:
+                    yield dict(profile_id=1, filters=tuple((name, '2020') for name in subset), sort=sort,
+                               descending=descending, limit=101, **cursor)
+
+
+def explain(mydb, dialect, sql, params):
+    """The plan of ``sql`` as ``(unindexed, description)`` per step.
+
+    Every list query names its profile, so each step should seek into an
+    index on ``profile_id`` and read it in the page's order. A step is
+    unindexed if it reads the whole table or a whole index (SQLite
+    ``SCAN``, MySQL ``type=ALL`` or ``type=index``) or sorts the rows it
+    found (SQLite ``USE TEMP B-TREE``, MySQL ``Using filesort`` or
+    ``Using temporary``).
+    """
+    cursor = mydb.cursor()
+    if dialect == 'sqlite':
+        cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+        steps = [(detail.startswith('SCAN ') or 'TEMP B-TREE' in detail, detail)
+                 for _, _, _, detail in cursor.fetchall()]
+    else:
+        cursor.execute("EXPLAIN " + sql, params)
+        names = [d[0] for d in cursor.description]
+        steps = []
+        for row in cursor.fetchall():
+            step = dict(zip(names, row))
+            extra = step.get('Extra') or ''
+            steps.append((step['type'] in ('ALL', 'index') or 'filesort' in extra or 'temporary' in extra,
+                          f"{step['table']}: type={step['type']} key={step['key']} {extra}".strip()))
+    cursor.close()
+    return steps
+
+
+def query_plans(repositories, dialect):
+    """Yield ``(table, query kwargs, sql, plan)`` for every list page query."""
+    for repo in repositories:
+        with repo.connection() as mydb:
+            for query in list_queries(repo.table):
+                sql, params = repo.query(**query)
+                yield repo.table.name, query, sql, explain(mydb, dialect, sql, params)
+
+
+def init_cli(app, backend, repositories):
+    """Register ``flask migrate`` and ``flask check-indexes``."""
+    import click
+
+    @app.cli.command('migrate')
+    def migrate_command():
+        """Apply pending schema migrations."""
+        applied = backend.migrate()
+        if applied:
+            click.echo(f"Applied migrations {', '.join(map(str, applied))}")
+        else:
+            click.echo(f"Schema is up to date (version {LATEST})")
+
+    @app.cli.command('check-indexes')
+    @click.option('--verbose', is_flag=True, help='Print the plan of every query, not just failures.')
+    def check_indexes_command(verbose):
+        """EXPLAIN every list page query; fail if any scans or sorts.
+
+        MySQL may prefer a full scan on a nearly empty table, so run this
+        against a database with realistic row counts.
+        """
+        failures = 0
+        for table, query, sql, plan in query_plans(repositories, backend.name):
+            unindexed = any(step for step, _ in plan)
+            if unindexed or verbose:
+                label = "UNINDEXED" if unindexed else "ok"
+                click.echo(f"{label} {table} {query}\n  {sql}\n    "
+                           + "\n    ".join(text for _, text in plan), err=unindexed)
+            failures += unindexed
+        if failures:
+            raise click.ClickException(f"{failures} list queries are not index-backed")
+        click.echo("All list queries read an index in order")
@@ -0,0 +1,291 @@
+"""On-demand sampling profiler for individual requests.
+
+A request is profiled when it carries ``X-Profile: <token>`` or when it
+falls in the random ``sample_rate`` fraction of traffic. While it runs, a
+background thread takes the stack of the thread serving it every
+``interval`` seconds, down through the view, the database driver and
+Jinja. Each sample is recorded as one call stack, root first, so the
+output is the collapsed-stack format that ``flamegraph.pl``, speedscope
+and similar tools read: one ``frame;frame;frame count`` line per stack.
+
+Profiles are kept per endpoint, and the ``keep`` most recent ones are
+also kept whole: a profiled response names its own in ``X-Profile-Id``.
+``make_profile_blueprint`` serves them under ``/profile/``, behind the same
+token, together with the top-N functions by samples spent in them.
+
+With no token and a zero ``sample_rate``, ``init_app`` registers nothing
+and requests pay nothing. Otherwise an unprofiled request costs a header
+lookup and a random number, and the sampler thread only runs while a
+profiled request is in flight. Under the ASGI server the async views share
+the event loop's thread, so their samples include whatever else the loop
+ran meanwhile.
+"""
+import hmac
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+
+from flask import Blueprint, Response, abort, jsonify, request
+
+HEADER = 'X-Profile'
+TRUNCATED = '(more stacks than max_stacks)'
+
+# The profile of the request running in this context, if it is profiled
+_profile = ContextVar('profile', default=None)
+
+
+class Profile:
+    """The samples of one request: ``{stack: count}``."""
+
+    def __init__(self, id, thread, endpoint, path):
+        self.id = id
+        self.thread = thread
+        self.endpoint = endpoint
+        self.path = path
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self.stacks = Counter()
+
+    def summary(self):
+        return {
+            'id': self.id,
+            'endpoint': self.endpoint,
+            'path': self.path,
+            'duration_ms': round(self.duration * 1000, 3),
+            'samples': sum(self.stacks.values()),
+        }
+
+
+def collapsed(stacks):
+    """``{stack: count}`` as collapsed-stack text, most sampled first."""
+    return ''.join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+def top_functions(stacks, n=20):
+    """The ``n`` functions with the most samples of their own, from ``{stack: count}``.
+
+    ``self`` counts the samples in which a function was running, ``total``
+    those in which it was anywhere on the stack.
+    """
+    own = Counter()
+    total = Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(';')
+        own[frames[-1]] += count
+        for frame in set(frames):
+            total[frame] += count
+    samples = sum(stacks.values()) or 1
+    return [
+        {'function': frame, 'self': count, 'total': total[frame],
+         'self_pct': round(100.0 * count / samples, 1), 'total_pct': round(100.0 * total[frame] / samples, 1)}
+        for frame, count in own.most_common(n)
+    ]
+
+
+class Profiler:
+    def __init__(self, token=None, sample_rate=0.0, interval=0.001, max_stacks=10000, keep=50):
+        self.token = token
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self._recent = deque(maxlen=keep)
+        self._endpoints = {}  # endpoint -> Counter of stacks
+        self._targets = {}    # profile id -> Profile being sampled
+        self._labels = {}     # code object -> frame label
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._thread = None
+        self._switch_interval = None
+        self.profiled = 0
+        self.samples = 0
+        self.sample_time = 0.0
+
+    @property
+    def enabled(self):
+        return bool(self.token) or self.sample_rate > 0
+
+    def authorized(self, value):
+        return bool(self.token) and value is not None and hmac.compare_digest(value, self.token)
+
+    def init_app(self, app):
+        if not self.enabled:
+            return
+
+        @app.before_request
+        def start_profile():
+            if request.blueprint == 'profile':
+                return  # Reading profiles is not what is being profiled
+            if self.authorized(request.headers.get(HEADER)) or (
+                    self.sample_rate and random.random() < self.sample_rate):
+                self.start(request.endpoint or 'unmatched', request.full_path)
+
+        @app.after_request
+        def name_profile(response):
+            profile = _profile.get()
+            if profile is not None:
+                response.headers['X-Profile-Id'] = str(profile.id)
+            return response
+
+        @app.teardown_request
+        def stop_profile(exc):
+            self.stop()
+
+    # Sampling
+
+    def start(self, endpoint, path):
+        """Start sampling the calling thread, for the request running in this context."""
+        profile = Profile(next(self._ids), threading.get_ident(), endpoint, path)
+        _profile.set(profile)
+        with self._lock:
+            self._targets[profile.id] = profile
+            if self._switch_interval is None:
+                # Let the sampler take the GIL as often as it samples, not every 5ms
+                self._switch_interval = sys.getswitchinterval()
+                sys.setswitchinterval(min(self._switch_interval, self.interval))
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+                self._thread.start()
+            self._wake.notify()
+        return profile
+
+    def stop(self):
+        """Stop sampling for the request running in this context and keep its profile."""
+        profile = _profile.get()
+        if profile is None:
+            return None
+        _profile.set(None)
+        with self._lock:
+            del self._targets[profile.id]
+            if not self._targets:
+                sys.setswitchinterval(self._switch_interval)
+                self._switch_interval = None
+            profile.duration = time.perf_counter() - profile.started
+            stacks = self._endpoints.setdefault(profile.endpoint, Counter())
+            for stack, count in profile.stacks.items():
+                if stack not in stacks and len(stacks) >= self.max_stacks:
+                    stack = TRUNCATED
+                stacks[stack] += count
+            self._recent.append(profile)
+            self.profiled += 1
+        return profile
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            filename = code.co_filename
+            for prefix in sorted(set(sys.path), key=len, reverse=True):
+                if prefix and filename.startswith(prefix + os.sep):
+                    filename = filename[len(prefix) + 1:]
+                    break
+            name = getattr(code, 'co_qualname', code.co_name)
+            label = self._labels[code] = f"{name} ({filename}:{code.co_firstlineno})".replace(';', ':')
+        return label
+
+    def _stack(self, frame):
+        labels = []
+        while frame is not None:
+            labels.append(self._label(frame.f_code))
+            frame = frame.f_back
+        labels.reverse()
+        return ';'.join(labels)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._targets:
+                    self._wake.wait()
+            time.sleep(self.interval)
+            start = time.perf_counter()
+            frames = sys._current_frames()
+            with self._lock:
+                for profile in self._targets.values():
+                    frame = frames.get(profile.thread)
+                    if frame is not None:
+                        profile.stacks[self._stack(frame)] += 1
+                        self.samples += 1
+                self.sample_time += time.perf_counter() - start
+            del frames
+
+    # Results
+
+    def stacks(self, endpoint=None):
+        """``{stack: count}`` of one endpoint, or of all of them."""
+        with self._lock:
+            if endpoint is not None:
+                return Counter(self._endpoints.get(endpoint, ()))
+            merged = Counter()
+            for stacks in self._endpoints.values():
+                merged.update(stacks)
+            return merged
+
+    def recent(self, id=None):
+        """The kept profiles, newest first, or the one numbered ``id`` (None if gone)."""
+        with self._lock:
+            profiles = list(reversed(self._recent))
+        if id is None:
+            return profiles
+        return next((profile for profile in profiles if profile.id == id), None)
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+            self._recent.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'sample_rate': self.sample_rate,
+                'in_flight': len(self._targets),
+                'profiled': self.profiled,
+                'samples': self.samples,
+                'sample_time_total': round(self.sample_time, 6),
+                'endpoints': len(self._endpoints),
+            }
+
+
+def make_profile_blueprint(profiler):
+    """Profiles under ``/profile/``, for requests carrying the profiler's token."""
+    bp = Blueprint('profile', __name__, url_prefix='/profile')
+
+    @bp.before_request
+    def require_token():
+        if not profiler.authorized(request.headers.get(HEADER)):
+            abort(404)  # Not even the existence of the profiler is given away
+
+    @bp.route('/top')
+    def top():
+        """``?endpoint=`` (default: all) and ``?n=`` (default 20)."""
+        n = request.args.get('n', 20, type=int)
+        stacks = profiler.stacks(request.args.get('endpoint'))
+        return jsonify(samples=sum(stacks.values()), functions=top_functions(stacks, n), stats=profiler.stats())
+
+    @bp.route('/collapsed')
+    def collapsed_stacks():
+        """Collapsed stacks of ``?endpoint=`` (default: all), for a flame graph."""
+        return Response(collapsed(profiler.stacks(request.args.get('endpoint'))), mimetype='text/plain')
+
+    @bp.route('/requests')
+    def recent_requests():
+        return jsonify([profile.summary() for profile in profiler.recent()])
+
+    @bp.route('/requests/<int:id>')
+    def request_profile(id):
+        """Collapsed stacks of one profiled request (see its ``X-Profile-Id``)."""
+        profile = profiler.recent(id)
+        if profile is None:
+            return jsonify(error="No such profile; only the most recent are kept."), 404
+        return Response(collapsed(profile.stacks), mimetype='text/plain')
+
+    @bp.route('/reset', methods=['POST'])
+    def reset():
+        profiler.reset()
+        return jsonify(profiler.stats())
+
+    return bp
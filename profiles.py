@@ -0,0 +1,179 @@
+"""Profiles: the CVs one app hosts, each addressed by its slug.
+
+Every page of a CV lives under its profile's slug (``/<slug>/skills``) and
+every row of every table carries the id of the profile it belongs to. The
+``ProfileDirectory`` turns the slug of each request into its profile.
+
+Profiles are created but never renamed, so a profile once found is kept
+for good, in an LRU of ``max_entries``: a visit costs a dictionary lookup,
+whatever the number of profiles, and pages of a profile seen before keep
+being served while the database is down. Slugs that name no profile are
+remembered too, for ``miss_ttl`` seconds and in a separate LRU, so clients
+probing made-up slugs cost one query a minute each and never push real
+profiles out. A profile created in another worker is found here once the
+miss expires.
+"""
+import re
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from repository import DatabaseUnavailable
+
+Profile = namedtuple('Profile', 'id slug name')
+
+# Lower-case letters, digits and inner dashes, as they appear in a URL
+SLUG = re.compile(r'[a-z0-9](?:[a-z0-9-]{0,62}[a-z0-9])?')
+
+
+class ProfileDirectory:
+    """Profiles by slug, read through from the ``Profiles`` table."""
+
+    lookup_sql = "SELECT id, slug, name FROM Profiles WHERE slug = %s"
+
+    def __init__(self, get_db_connection, max_entries=10000, miss_ttl=60.0):
+        self._get_db_connection = get_db_connection
+        self.max_entries = max_entries
+        self.miss_ttl = miss_ttl
+        self._profiles = OrderedDict()  # slug -> Profile, least recently used first
+        self._missing = OrderedDict()   # slug -> monotonic time the miss expires, oldest first
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.lookups = 0
+
+    def _connection(self):
+        mydb = self._get_db_connection()
+        if not mydb:
+            raise DatabaseUnavailable()
+        return mydb
+
+    def cached(self, slug):
+        """``(True, profile or None)`` if this process knows ``slug``, else ``(False, None)``."""
+        if not SLUG.fullmatch(slug):
+            return True, None
+        with self._lock:
+            profile = self._profiles.get(slug)
+            if profile is not None:
+                self._profiles.move_to_end(slug)
+                self.hits += 1
+                return True, profile
+            expires = self._missing.get(slug)
+            if expires is not None and expires > time.monotonic():
+                self.hits += 1
+                return True, None
+            self.misses += 1
+            return False, None
+
+    def remember(self, slug, rows):
+        """Keep the result of ``lookup_sql`` for ``slug``; returns the profile or None."""
+        profile = Profile._make(rows[0]) if rows else None
+        with self._lock:
+            self.lookups += 1
+            if profile is not None:
+                self._missing.pop(slug, None)
+                self._profiles[slug] = profile
+                self._profiles.move_to_end(slug)
+                if len(self._profiles) > self.max_entries:
+                    self._profiles.popitem(last=False)
+            else:
+                self._missing.pop(slug, None)
+                self._missing[slug] = time.monotonic() + self.miss_ttl
+                if len(self._missing) > self.max_entries:
+                    self._missing.popitem(last=False)
+        return profile
+
+    def get(self, slug):
+        """The profile with ``slug``, or None if there is none.
+
+        Raises ``DatabaseUnavailable`` or a database error when the slug is
+        not known here and the database cannot be asked.
+        """
+        found, profile = self.cached(slug)
+        if found:
+            return profile
+        with self._connection() as mydb:
+            cursor = mydb.prepared(self.lookup_sql)
+            cursor.execute(self.lookup_sql, (slug,))
+            rows = cursor.fetchall()
+        return self.remember(slug, rows)
+
+    def slug_of(self, profile_id):
+        """The slug of the profile with id ``profile_id``, or None if there is none.
+
+        Looks through the profiles held here first; raises like ``get`` when
+        it must ask the database and cannot.
+        """
+        with self._lock:
+            for profile in self._profiles.values():
+                if profile.id == profile_id:
+                    return profile.slug
+        with self._connection() as mydb:
+            cursor = mydb.cursor()
+            cursor.execute("SELECT id, slug, name FROM Profiles WHERE id = %s", (profile_id,))
+            rows = cursor.fetchall()
+            cursor.close()
+        return self.remember(rows[0][1], rows).slug if rows else None
+
+    def slugs(self):
+        """The slug of every profile, oldest first."""
+        with self._connection() as mydb:
+            cursor = mydb.cursor()
+            cursor.execute("SELECT slug FROM Profiles ORDER BY id")
+            rows = cursor.fetchall()
+            cursor.close()
+        return [row[0] for row in rows]
+
+    def create(self, slug, name=None, reserved=()):
+        """Add a profile; raises ``ValueError`` for a malformed, reserved or taken slug."""
+        if not SLUG.fullmatch(slug):
+            raise ValueError(f"Invalid slug {slug!r}: use lower-case letters, digits and dashes.")
+        if slug in reserved:
+            raise ValueError(f"The slug {slug!r} is taken by one of the app's own pages.")
+        with self._connection() as mydb:
+            cursor = mydb.cursor()
+            try:
+                cursor.execute(self.lookup_sql, (slug,))
+                if cursor.fetchall():
+                    raise ValueError(f"The slug {slug!r} is already taken.")
+                cursor.execute("INSERT INTO Profiles (slug, name) VALUES (%s, %s)", (slug, name))
+                id = cursor.lastrowid
+                mydb.commit()
+            except BaseException:
+                mydb.rollback()
+                raise
+            finally:
+                cursor.close()
+        return self.remember(slug, [(id, slug, name)])
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'profiles': len(self._profiles),
+                'missing': len(self._missing),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'lookups': self.lookups,
+            }
+
+
+def init_cli(app, directory):
+    """Register ``flask create-profile``."""
+    import click
+
+    @app.cli.command('create-profile')
+    @click.argument('slug')
+    @click.option('--name', help='Shown on the profile\'s home page.')
+    def create_profile_command(slug, name):
+        """Add a CV, served under /SLUG/."""
+        # A slug may not shadow the first segment of the app's other URLs
+        reserved = {rule.rule.split('/')[1] for rule in app.url_map.iter_rules()
+                    if not rule.rule.startswith('/<')}
+        try:
+            profile = directory.create(slug, name, reserved)
+        except ValueError as err:
+            raise click.ClickException(str(err))
+        click.echo(f"Created profile {profile.id} at /{profile.slug}/")
@@ -0,0 +1,232 @@
+"""Data access for the tables defined in ``schema``.
+
+A ``Repository`` builds every statement for its table once, from the
+table definition, and returns rows as the table's named tuple. Statements
+run on cursors prepared once per pooled connection (see
+``PooledConnection.prepared``): on MySQL that is a server-side prepared
+statement, so the server parses each statement once per connection rather
+than on every call; SQLite keeps compiled statements per connection
+anyway, and the reused cursor saves an allocation per query.
+
+Every table belongs to profiles (see ``profiles``): each method takes the
+``profile_id`` first and every statement is limited to that profile's
+rows, through indexes that lead with ``profile_id``. The column is not
+part of the rows returned.
+"""
+
+
+class DatabaseUnavailable(Exception):
+    """Raised when no pooled connection could be borrowed."""
+
+
+def stream_query(get_db_connection, sql, params=(), chunk_size=500, make_row=None):
+    """Iterate over a query's rows, fetching ``chunk_size`` at a time.
+
+    The connection stays borrowed until the rows are exhausted, so only
+    one chunk is ever held in memory. The first chunk is read before this
+    returns, so a failing query raises here and not halfway through a
+    response.
+    """
+    mydb = get_db_connection()
+    if not mydb:
+        raise DatabaseUnavailable()
+    try:
+        cursor = mydb.cursor()
+        cursor.execute(sql, params)
+        chunk = cursor.fetchmany(chunk_size)
+    except BaseException:
+        mydb.discard()
+        raise
+
+    def rows(chunk):
+        try:
+            while chunk:
+                if make_row is None:
+                    yield from chunk
+                else:
+                    yield from map(make_row, chunk)
+                chunk = cursor.fetchmany(chunk_size)
+            cursor.close()
+            mydb.close()
+        finally:
+            # Stopped early with unread rows left: don't reuse the connection
+            mydb.discard()
+    return rows(chunk)
+
+
+class Repository:
+    """Reads and writes one table.
+
+    ``on_change(table_name, profile_id, changes)`` is called after every
+    committed write, which is where the app invalidates its caches.
+    ``changes`` is ``{id: row}`` for the rows a single-row write touched
+    (``None`` as the row for a delete), or ``None`` when any row of the
+    profile may have changed, as after a bulk write or an import; a
+    ``profile_id`` of None means rows of any profile may have.
+    """
+
+    def __init__(self, table, get_db_connection, on_change=None, chunk_size=500):
+        self.table = table
+        self.get_db_connection = get_db_connection
+        self._on_change = on_change
+        self.chunk_size = chunk_size
+
+        name, fields, columns = table.name, ', '.join(table.fields), table.columns
+        self.select_sql = f"SELECT {fields} FROM {name}"
+        # The profile_id parameter comes last in every statement
+        self._get_sql = f"{self.select_sql} WHERE id = %s AND profile_id = %s"
+        self.insert_sql = (f"INSERT INTO {name} ({', '.join(columns)}, profile_id) "
+                           f"VALUES ({', '.join(['%s'] * (len(columns) + 1))})")
+        self.update_sql = f"UPDATE {name} SET {', '.join(f'{c}=%s' for c in columns)} WHERE id=%s AND profile_id=%s"
+        self.delete_sql = f"DELETE FROM {name} WHERE id = %s AND profile_id = %s"
+        self._make_row = table.row._make
+        self._unknown = (None,) * len(table.generated)  # Generated values aren't read back after a write
+
+    def connection(self):
+        mydb = self.get_db_connection()
+        if not mydb:
+            raise DatabaseUnavailable()
+        return mydb
+
+    def changed(self, profile_id=None, changes=None):
+        if self._on_change:
+            self._on_change(self.table.name, profile_id, changes)
+
+    def _fetch(self, sql, params):
+        with self.connection() as mydb:
+            cursor = mydb.prepared(sql)
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+        return list(map(self._make_row, rows))
+
+    def _write(self, sql, params):
+        with self.connection() as mydb:
+            cursor = mydb.prepared(sql)
+            cursor.execute(sql, params)
+            mydb.commit()
+            return cursor.lastrowid if sql is self.insert_sql else cursor.rowcount
+
+    # Reads
+
+    def query(self, profile_id, filters=(), sort='id', descending=False, after=None, key=None, limit=None):
+        """SQL and parameters for a filtered, sorted list of a profile's rows.
+
+        ``filters`` holds ``(name, raw value)`` pairs for filters of the
+        table definition and ``sort`` is one of its sortable columns. A
+        page continues after the row whose id is ``after`` and whose sort
+        column held ``key`` (``None`` for NULL), seeking through the sort
+        column's index instead of skipping rows. Raises ``ValueError`` for
+        an unknown sort or filter, or a value the filter rejects.
+        """
+        table = self.table
+        if sort not in table.sorts:
+            raise ValueError(f"Cannot sort by {sort!r}; use one of: {', '.join(table.sorts)}.")
+        where, params = ["profile_id = %s"], [profile_id]
+        pinned = False  # An equality filter holds the sort column to one value
+        for name, raw in sorted(dict(filters).items()):
+            spec = table.filters.get(name)
+            if spec is None:
+                raise ValueError(f"Unknown filter {name!r}.")
+            try:
+                params.append(spec.convert(raw))
+            except (TypeError, ValueError):
+                raise ValueError(f"Invalid value for {name}: {raw!r}.") from None
+            pinned = pinned or (spec.op == '=' and spec.column == sort)
+            if spec.op == '=' or spec.column == sort:
+                where.append(f"{spec.column} {spec.op} %s")
+            else:
+                # A range on another column than the sort would have the
+                # database seek on it and then sort every match; hidden from
+                # the planner this way, it is checked on the sort column's
+                # index, which also holds the column, and the page stops at
+                # the LIMIT
+                where.append(f"COALESCE({spec.column}, NULL) {spec.op} %s")
+
+        direction = ' DESC' if descending else ''
+        if sort == 'id':
+            order = f"id{direction}"
+            if not descending:
+                where.append("id > %s")
+                params.append(after or 0)
+            elif after is not None:
+                where.append("id < %s")
+                params.append(after)
+        else:
+            order = f"{sort}{direction}, id{direction}"
+            # NULLs sort first ascending and last descending on both engines
+            if after is None:
+                pass
+            elif pinned and key is not None:
+                # Only the id varies within the page
+                where.append("id < %s" if descending else "id > %s")
+                params.append(after)
+            elif key is None and not descending:
+                where.append(f"({sort} IS NULL AND id > %s OR {sort} IS NOT NULL)")
+                params.append(after)
+            elif key is None:
+                where.append(f"{sort} IS NULL AND id < %s")
+                params.append(after)
+            elif not descending:
+                where.append(f"({sort}, id) > (%s, %s)")
+                params.extend((key, after))
+            elif sort in table.generated:
+                # Never NULL, so a plain seek down the index
+                where.append(f"({sort}, id) < (%s, %s)")
+                params.extend((key, after))
+            else:
+                where.append(f"(({sort}, id) < (%s, %s) OR {sort} IS NULL)")
+                params.extend((key, after))
+
+        sql = f"{self.select_sql} WHERE {' AND '.join(where)} ORDER BY {order}"
+        if limit is not None:
+            sql += " LIMIT %s"
+            params.append(limit)
+        return sql, tuple(params)
+
+    def find(self, profile_id, filters=(), sort='id', descending=False, after=None, key=None, limit=None):
+        """Rows matching ``query()``'s arguments."""
+        return self._fetch(*self.query(profile_id, filters, sort, descending, after, key, limit))
+
+    def all(self, profile_id, after=0):
+        """Every row of the profile with an id above ``after``, in id order."""
+        return self.find(profile_id, after=after)
+
+    def page(self, profile_id, after, limit):
+        """At most ``limit`` rows of the profile with an id above ``after``, in id order."""
+        return self.find(profile_id, after=after, limit=limit)
+
+    def get(self, profile_id, id):
+        rows = self._fetch(self._get_sql, (id, profile_id))
+        return rows[0] if rows else None
+
+    def stream(self, profile_id, **query):
+        """Like ``find()``, but fetched ``chunk_size`` rows at a time."""
+        sql, params = self.query(profile_id, **query)
+        return stream_query(self.get_db_connection, sql, params, self.chunk_size, self._make_row)
+
+    # Writes
+
+    def values_from(self, form):
+        """The writable columns of ``form`` (a mapping), in column order."""
+        return tuple(form[column] for column in self.table.columns)
+
+    def insert(self, profile_id, values):
+        """Insert one row of writable column values; returns its id."""
+        values = tuple(values)
+        id = self._write(self.insert_sql, values + (profile_id,))
+        self.changed(profile_id, {id: self._make_row(values + self._unknown + (id,))})
+        return id
+
+    def update(self, profile_id, id, values):
+        """Replace the writable columns of row ``id``; returns rows changed."""
+        values = tuple(values)
+        count = self._write(self.update_sql, values + (id, profile_id))
+        if count:  # 0 for a missing row or another profile's, and on MySQL for an unchanged one
+            self.changed(profile_id, {id: self._make_row(values + self._unknown + (id,))})
+        return count
+
+    def delete(self, profile_id, id):
+        count = self._write(self.delete_sql, (id, profile_id))
+        if count:
+            self.changed(profile_id, {id: None})
+        return count
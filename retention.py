@@ -0,0 +1,219 @@
+"""Retention for the ``Contact`` table: old messages move to archive files.
+
+``ContactArchiver.run_once()`` moves every message older than
+``max_age_days`` out of the table, oldest first, ``batch_size`` at a time.
+Each batch is one short transaction: the rows are locked (``BEGIN
+IMMEDIATE`` on SQLite, ``SELECT ... FOR UPDATE`` on MySQL), appended to
+``<profile id>/contact-YYYY-MM.ndjson.gz`` in ``archive_dir`` by the
+profile they were sent to and the month they arrived in, synced to disk,
+and only then deleted by id. One run covers every profile. Between batches the
+archiver pauses for ``pause`` seconds, so the contact form and the inbox
+are never kept waiting for more than one batch.
+
+Every batch is a complete gzip member, so an archive file is valid however
+many runs appended to it and ``gzip -d`` reads it whole. Delivery is
+at-least-once: a crash after the sync but before the commit archives the
+batch again on the next run. To restore a month, decompress it and load it
+with ``flask import-table contact contact-YYYY-MM.ndjson --profile SLUG
+--keep-ids``; the records carry their original ids and ``created_at``.
+
+Retention is off unless ``max_age_days`` is set. The background thread
+of ``start()`` runs in one process at a time: every worker starts it, and
+the one holding ``.lock`` in ``archive_dir`` archives while the others
+wait to take over when it exits. A manual run (``flask archive-contacts``)
+may overlap it; the row locks make them take turns, and the one that
+comes second finds the rows already gone.
+"""
+import fcntl
+import gzip
+import os
+import threading
+import time
+
+from api import json_value
+import schema
+from transfer import encode_rows
+
+
+class ContactArchiver:
+    def __init__(self, get_db_connection, dialect, archive_dir, max_age_days=0, batch_size=500,
+                 pause=0.1, interval=3600.0, on_change=None):
+        self._get_db_connection = get_db_connection
+        self.dialect = dialect
+        self.archive_dir = archive_dir
+        self.max_age = int(max_age_days * 86400)  # seconds
+        self.batch_size = batch_size
+        self.pause = pause
+        self.interval = interval
+        self._on_change = on_change
+
+        table = schema.CONTACT
+        self.fields = table.fields
+        self._cutoff_sql = ("SELECT datetime('now', %s)" if dialect == 'sqlite'
+                            else "SELECT NOW() - INTERVAL %s SECOND")
+        self._select_sql = (f"SELECT profile_id, {', '.join(table.fields)} FROM {table.name} "
+                            f"WHERE created_at < %s ORDER BY created_at, id LIMIT %s")
+        if dialect != 'sqlite':
+            self._select_sql += " FOR UPDATE"
+        self._delete_sql = f"DELETE FROM {table.name} WHERE id IN (%s)"
+
+        self._lock = threading.Lock()  # One run at a time in this process
+        self._stopping = threading.Event()
+        self._thread = None
+        self._leader = None  # .lock in archive_dir, open and locked while this process archives
+
+        self.runs = 0
+        self.archived = 0
+        self.batches = 0
+        self.errors = 0
+        self.last_run = 0.0
+        self.last_run_duration = 0.0
+        self.max_batch_duration = 0.0
+
+    def _cutoff(self, cursor):
+        """The database's own clock, ``max_age`` ago, in ``created_at``'s type."""
+        cursor.execute(self._cutoff_sql, (f'-{self.max_age} seconds' if self.dialect == 'sqlite' else self.max_age,))
+        return cursor.fetchone()[0]
+
+    def _write(self, rows):
+        """Append ``rows`` (``(profile_id, *fields)``) to the archive of the
+        profile and month each belongs to, and sync it."""
+        months = {}
+        created_at = self.fields.index('created_at')
+        for profile_id, *row in rows:
+            months.setdefault((profile_id, json_value(row[created_at])[:7]), []).append(row)
+        for (profile_id, month), month_rows in months.items():
+            directory = os.path.join(self.archive_dir, str(profile_id))
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f'contact-{month}.ndjson.gz')
+            with open(path, 'ab') as raw:
+                with gzip.GzipFile(fileobj=raw, mode='wb') as out:
+                    for chunk in encode_rows(self.fields, month_rows, 'ndjson'):
+                        out.write(chunk.encode('utf-8'))
+                raw.flush()
+                os.fsync(raw.fileno())
+
+    def _archive_batch(self, mydb, cutoff):
+        """Move one batch; returns the number of messages moved (0 when done)."""
+        start = time.monotonic()
+        cursor = mydb.cursor()
+        try:
+            if self.dialect == 'sqlite':
+                cursor.execute("BEGIN IMMEDIATE")  # Holds off other writers for this batch only
+            cursor.execute(self._select_sql, (cutoff, self.batch_size))
+            rows = cursor.fetchall()
+            if rows:
+                self._write(rows)
+                ids = [row[-1] for row in rows]
+                cursor.execute(self._delete_sql % ', '.join(['%s'] * len(ids)), ids)
+            mydb.commit()
+        except BaseException:
+            mydb.rollback()
+            raise
+        finally:
+            cursor.close()
+        if rows:
+            self.max_batch_duration = max(self.max_batch_duration, time.monotonic() - start)
+            self.batches += 1
+            self.archived += len(rows)
+            if self._on_change:
+                self._on_change()
+        return len(rows)
+
+    def run_once(self):
+        """Archive every message older than ``max_age_days``; returns how many were moved."""
+        if self.max_age <= 0:
+            return 0  # Retention is off; a cutoff of now would take every message
+        with self._lock:
+            start = time.monotonic()
+            moved = 0
+            mydb = self._get_db_connection()
+            if not mydb:
+                self.errors += 1
+                return 0
+            try:
+                with mydb:
+                    cursor = mydb.cursor()
+                    cutoff = self._cutoff(cursor)
+                    cursor.close()
+                    mydb.commit()
+                    while not self._stopping.is_set():
+                        count = self._archive_batch(mydb, cutoff)
+                        moved += count
+                        if count < self.batch_size:
+                            break
+                        self._stopping.wait(self.pause)
+            except Exception as err:
+                print(f"Error archiving contact messages: {err}")
+                self.errors += 1
+            self.runs += 1
+            self.last_run = time.time()
+            self.last_run_duration = time.monotonic() - start
+            return moved
+
+    def start(self):
+        """Run every ``interval`` seconds in a background thread, starting now."""
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='contact-archiver', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5.0):
+        """Stop after the batch in progress, if any."""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _lead(self):
+        """Whether this process is the one to archive, taking ``.lock`` if it is free."""
+        if self._leader is None:
+            try:
+                os.makedirs(self.archive_dir, exist_ok=True)
+                f = open(os.path.join(self.archive_dir, '.lock'), 'a')
+            except OSError as err:
+                print(f"Error opening the contact archive lock: {err}")
+                return False
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                f.close()  # Another process archives
+                return False
+            self._leader = f
+        return True
+
+    def _run(self):
+        try:
+            while not self._stopping.is_set():
+                if self._lead():
+                    self.run_once()
+                self._stopping.wait(self.interval)
+        finally:
+            if self._leader is not None:
+                self._leader.close()  # Releases the lock for another process to take over
+                self._leader = None
+
+    def stats(self):
+        return {
+            'max_age_days': self.max_age / 86400,
+            'leader': self._leader is not None,
+            'runs': self.runs,
+            'archived': self.archived,
+            'batches': self.batches,
+            'errors': self.errors,
+            'last_run': round(self.last_run, 3),
+            'last_run_duration': round(self.last_run_duration, 6),
+            'max_batch_duration': round(self.max_batch_duration, 6),
+        }
+
+
+def init_cli(app, archiver):
+    """Register ``flask archive-contacts``."""
+    import click
+
+    @app.cli.command('archive-contacts')
+    def archive_contacts_command():
+        """Move contact messages past their retention age into archive files."""
+        if archiver.max_age <= 0:
+            raise click.ClickException("Retention is off: set CONTACT_RETENTION_DAYS to archive messages.")
+        moved = archiver.run_once()
+        click.echo(f"Archived {moved} messages to {archiver.archive_dir}")
@@ -0,0 +1,109 @@
+"""Table definitions for the CV database.
+
+Each ``Table`` names its writable columns once. The repository builds its
+SQL from them, the routes read form fields and pick templates by them, and
+the JSON API and import/export use them to validate records. Rows come
+back as a named tuple with the writable columns, then the ``generated``
+ones the database fills in and are never NULL (``Contact.created_at``),
+then ``id``, so templates can say ``skill.category`` instead of
+``skill[1]``.
+
+Every table also has a ``profile_id`` column naming the CV a row belongs
+to; the repository scopes every statement by it and leaves it out of the
+rows. ``sorts`` and ``filters`` list what the list pages accept as
+``?sort=`` and filter parameters; migrations 4 and 5 index every one of
+them after ``profile_id``, and ``flask check-indexes`` verifies that each
+combination reads an index in order, with no sort step.
+``search`` weights the columns ``/search`` looks in and ``title`` names
+the column a search result is shown by.
+"""
+from collections import namedtuple
+
+
+class Filter:
+    """A list page query parameter compared against a column.
+
+    ``convert`` turns the raw parameter into the value bound to the query
+    and raises ``ValueError`` for bad input.
+    """
+
+    def __init__(self, column, op, convert=str):
+        self.column = column
+        self.op = op
+        self.convert = convert
+
+
+def year_start(value):
+    return f"{int(value):04d}-01-01"
+
+
+def year_end(value):
+    return f"{int(value):04d}-12-31"
+
+
+class Table:
+    """One table and the names the app uses for it.
+
+    ``endpoint`` is the list route and template (``skills``), ``item`` the
+    stem of the add/edit/delete routes and templates (``skill``) and
+    ``resource`` the JSON API name (``skills``).
+    """
+
+    def __init__(self, name, columns, endpoint, item, label, sorts=(), filters=None,
+                 search=None, title=None, generated=()):
+        self.name = name
+        self.columns = tuple(columns)
+        self.generated = tuple(generated)
+        self.fields = self.columns + self.generated + ('id',)
+        self.endpoint = endpoint
+        self.item = item
+        self.label = label
+        self.resource = endpoint.replace('_', '-')
+        self.row = namedtuple(name.title().replace('_', ''), self.fields)
+        self.sorts = ('id',) + tuple(sorts)
+        self.filters = filters or {}
+        self.search = search or {}
+        self.title = title or self.columns[0]
+
+    def __repr__(self):
+        return f"Table({self.name!r})"
+
+
+PERSONAL_INFO = Table('Personal_Info', ('name', 'email', 'phone', 'bio'),
+                      'personal_info', 'personal_info', 'Personal Information',
+                      search={'name': 3, 'bio': 1})
+EDUCATION = Table('Education', ('school', 'achievement', 'start_year', 'end_year', 'description'),
+                  'education', 'education', 'Education',
+                  sorts=('start_year', 'end_year'),
+                  filters={'from': Filter('start_year', '>=', int), 'to': Filter('start_year', '<=', int)},
+                  search={'school': 3, 'achievement': 2, 'description': 1})
+WORK_EXPERIENCE = Table('Work_Experience', ('company', 'position', 'start_year', 'end_year', 'description'),
+                        'work_experience', 'work_experience', 'Work Experience',
+                        sorts=('start_year', 'end_year'),
+                        filters={'from': Filter('start_year', '>=', int), 'to': Filter('start_year', '<=', int)},
+                        search={'company': 3, 'position': 2, 'description': 1})
+SKILLS = Table('Skills', ('skill_name', 'category', 'proficiency_level'),
+               'skills', 'skill', 'Skills',
+               sorts=('skill_name', 'category'),
+               filters={'category': Filter('category', '=')},
+               search={'skill_name': 3, 'category': 1})
+PROJECTS = Table('Projects', ('project_name', 'description', 'start_date', 'end_date'),
+                 'projects', 'project', 'Projects',
+                 sorts=('start_date', 'end_date'),
+                 filters={'from': Filter('start_date', '>=', year_start), 'to': Filter('start_date', '<=', year_end)},
+                 search={'project_name': 3, 'description': 1})
+CONTACT = Table('Contact', ('name', 'email', 'message'),
+                'contact', 'contact', 'Contact Messages',
+                sorts=('created_at',),
+                generated=('created_at',))
+
+# The sections of the CV, in page order
+CV_SECTIONS = (PERSONAL_INFO, EDUCATION, WORK_EXPERIENCE, SKILLS, PROJECTS)
+TABLES = CV_SECTIONS + (CONTACT,)
+TABLES_BY_NAME = {table.name: table for table in TABLES}
+
+# JSON API resource name -> table
+RESOURCES = {table.resource: table for table in TABLES}
+# The resources anyone may read and write over HTTP. Contact messages are
+# private: they are read in the token-guarded inbox, or moved with the CLI
+PUBLIC_RESOURCES = {table.resource: table for table in CV_SECTIONS}
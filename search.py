@@ -0,0 +1,521 @@
+"""In-process full-text search over the CV sections.
+
+``SearchIndex`` is an inverted index: every token of a document's
+searchable fields maps to the documents containing it, weighted by the
+field it came from. A query is tokenized the same way; every token must
+match (the last one as a prefix, so results follow typing) and documents
+are ranked by tf-idf.
+
+Each term's postings are also kept sorted by weight (built on first use
+and kept in order by single-row writes). A query reads every token's postings
+in that order, scores each new document with dictionary lookups, and
+stops once no unread document could reach the top ``limit`` (Fagin's
+threshold algorithm), so a common word costs a few dozen lookups rather
+than a pass over every document containing it. Typeahead sends the same
+prefixes over and over, so recent results are also kept until the next
+write.
+
+Each profile has an index of its own (``SearchIndexes``), filled from the
+database the first time the profile is searched and kept current by the
+repository write hooks: single-row writes update it in place, bulk writes
+and imports reindex the affected table. Rows are read outside the index
+lock and swapped in at the end, so queries keep being answered while a
+table is reloaded. Only the ``max_profiles`` profiles searched most
+recently keep their index in memory; a profile searched again after its
+index was dropped has it rebuilt.
+
+With a ``snapshot_dir`` every index is also saved there, one pickle per
+profile, after each build. A profile's first search then loads its
+snapshot and answers from it straight away, instead of reading every row
+first, while ``on_loaded`` has the index rebuilt from the database off
+the request path to catch up with writes made since the snapshot.
+
+The write hooks only see the writes of their own process. With a
+``version(profile, table)`` shared by every worker (the query cache's
+table generations), an index notes the generation each table was read
+at, and a search first reindexes the tables whose generation has moved
+since, as it does when another worker wrote to them.
+"""
+import bisect
+import heapq
+import math
+import os
+import pickle
+import re
+import threading
+from collections import OrderedDict, defaultdict
+
+SNAPSHOT_FORMAT = 1
+MAX_PREFIX_TERMS = 200  # vocabulary entries a one-letter prefix may expand to
+LOOKUP_TERMS = 8  # up to this many expansions, score a prefix by postings lookups
+CACHED_QUERIES = 1024  # recent results kept until the next write
+MAX_RELOAD_ATTEMPTS = 3
+
+_TOKEN = re.compile(r'\w+')
+
+# Not indexed; the last word of a query may still be one, as a prefix
+STOPWORDS = frozenset("""
+a an and are as at be by for from has have in is it its of on or that the this
+to was were will with
+""".split())
+
+
+def tokenize(text):
+    if text is None:
+        return []
+    return _TOKEN.findall(str(text).lower())
+
+
+def _rank(entry):
+    weight, doc = entry
+    return -weight, doc
+
+
+class _State:
+    """Postings, documents and sorted vocabulary of one index generation."""
+
+    __slots__ = ('postings', 'docs', 'terms', '_ranked')
+
+    def __init__(self, postings=None, docs=None, terms=None):
+        self.postings = defaultdict(dict, postings or {})  # term -> {doc: weight}
+        self.docs = docs or {}                              # doc -> (title, terms)
+        self.terms = terms or []                            # sorted vocabulary
+        self._ranked = {}                                   # term -> [(weight, doc)], heaviest first
+
+    def ranked(self, term):
+        ranked = self._ranked.get(term)
+        if ranked is None:
+            postings = self.postings.get(term) or {}
+            ranked = self._ranked[term] = sorted(((weight, doc) for doc, weight in postings.items()), key=_rank)
+        return ranked
+
+    def unrank(self):
+        """Drop the weight-ordered postings, before changing many documents."""
+        self._ranked.clear()
+
+    def add(self, doc, title, weights):
+        for term, weight in weights.items():
+            postings = self.postings[term]
+            if not postings:
+                bisect.insort(self.terms, term)
+            postings[doc] = weight
+            ranked = self._ranked.get(term)
+            if ranked is not None:
+                bisect.insort(ranked, (weight, doc), key=_rank)
+        self.docs[doc] = (title, tuple(weights))
+
+    def remove(self, doc):
+        entry = self.docs.pop(doc, None)
+        if entry is None:
+            return
+        for term in entry[1]:
+            postings = self.postings.get(term)
+            if postings is None:
+                continue
+            weight = postings.pop(doc, None)
+            ranked = self._ranked.get(term)
+            if ranked is not None and weight is not None:
+                del ranked[bisect.bisect_left(ranked, (-weight, doc), key=_rank)]
+            if not postings:
+                del self.postings[term]
+                i = bisect.bisect_left(self.terms, term)
+                if i < len(self.terms) and self.terms[i] == term:
+                    del self.terms[i]
+
+
+class SearchIndex:
+    """Inverted index over the rows of several tables.
+
+    ``fields`` maps a table name to ``{column: weight}`` and ``titles`` to
+    the column shown as each result's title. A row is stored as a single
+    int that encodes its table and id, so the postings dictionaries hold
+    nothing the garbage collector has to traverse; with tuples there, each
+    full collection walked half a million of them and slowed every request.
+    """
+
+    def __init__(self, fields, titles, cached_queries=CACHED_QUERIES):
+        self.fields = fields
+        self.titles = titles
+        self.cached_queries = cached_queries
+        self._tables = tuple(fields)
+        self._numbers = {table: number for number, table in enumerate(self._tables)}
+        self.ready = False
+        self._state = _State()
+        self._lock = threading.RLock()
+        self._generation = 0  # bumped by every write, to detect racing reloads
+        self.seen = {}  # table -> shared generation its rows were read at
+        self._cache = OrderedDict()  # (words, limit) -> (generation, results)
+        self.cache_hits = 0
+
+    def _document(self, table, row):
+        weights = defaultdict(float)
+        for column, weight in self.fields[table].items():
+            for term in tokenize(getattr(row, column)):
+                if term not in STOPWORDS:
+                    weights[term] += weight
+        return getattr(row, self.titles[table]), weights
+
+    def _doc(self, table, id):
+        return id * len(self._tables) + self._numbers[table]
+
+    # Writes
+
+    def apply(self, table, changes, generations=None):
+        """Apply ``{id: row or None}``; ``None`` means the row was deleted.
+
+        ``generations`` is the table's shared generation ``(before, after)``
+        the write; the index is only current after it if it was before.
+        """
+        if table not in self.fields:
+            return
+        with self._lock:
+            if generations is not None and self.seen.get(table) == generations[0]:
+                self.seen[table] = generations[1]
+            self._generation += 1
+            for id, row in changes.items():
+                self._state.remove(self._doc(table, id))
+                if row is not None:
+                    self._state.add(self._doc(table, id), *self._document(table, row))
+
+    def reload_table(self, table, load, seen=None):
+        """Reindex ``table`` from ``load()``, an iterable of its rows, read at shared generation ``seen``."""
+        if table not in self.fields:
+            return
+        for _ in range(MAX_RELOAD_ATTEMPTS):
+            generation = self._generation
+            documents = [(self._doc(table, row.id), *self._document(table, row)) for row in load()]
+            with self._lock:
+                if generation != self._generation:
+                    continue  # A write landed while loading; read again
+                self._state.unrank()
+                number, count = self._numbers[table], len(self._tables)
+                for doc in [doc for doc in self._state.docs if doc % count == number]:
+                    self._state.remove(doc)
+                for doc, title, weights in documents:
+                    self._state.add(doc, title, weights)
+                self.seen[table] = seen
+                self._generation += 1
+                return
+        raise RuntimeError(f"search index for {table} kept changing during reload")
+
+    def rebuild(self, loaders, generations=None):
+        """Replace the whole index from ``{table: load}``, read at shared ``{table: generation}``, and mark it ready."""
+        for _ in range(MAX_RELOAD_ATTEMPTS):
+            generation = self._generation
+            state = _State()
+            for table, load in loaders.items():
+                for row in load():
+                    state.add(self._doc(table, row.id), *self._document(table, row))
+            with self._lock:
+                if generation != self._generation:
+                    continue
+                self._state = state
+                self.seen = dict(generations or {})
+                self._generation += 1
+                self.ready = True
+                return
+        raise RuntimeError("search index kept changing during rebuild")
+
+    # Queries
+
+    def _expand(self, prefix):
+        terms = self._state.terms
+        start = end = bisect.bisect_left(terms, prefix)
+        while end < len(terms) and end - start < MAX_PREFIX_TERMS and terms[end].startswith(prefix):
+            end += 1
+        return terms[start:end]
+
+    def search(self, query, limit=20):
+        """``[(score, table, id, title)]`` best first; every token must match."""
+        words = tokenize(query)
+        if not words:
+            return []
+        tokens = [(word, False) for word in words[:-1] if word not in STOPWORDS] + [(words[-1], True)]
+        key = (tuple(words), limit)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None and cached[0] == self._generation:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+                return cached[1]
+            results = self._search(tokens, limit)
+            self._cache[key] = (self._generation, results)
+            self._cache.move_to_end(key)
+            if len(self._cache) > self.cached_queries:
+                self._cache.popitem(last=False)
+            return results
+
+    def _search(self, tokens, limit):
+        """Rank documents matching every token; the lock is held."""
+        state = self._state
+        total = len(state.docs) or 1
+
+        # Per token: the [(idf, term)] it matches and its documents, best first
+        sources, streams = [], []
+        for word, is_prefix in tokens:
+            terms = self._expand(word) if is_prefix else [word] if word in state.postings else []
+            if not terms:
+                return []
+            weighted = [(math.log(1 + total / len(state.postings[term])), term) for term in terms]
+            ranked = [self._stream(idf, state.ranked(term)) for idf, term in weighted]
+            sources.append((word, weighted))
+            streams.append(ranked[0] if len(ranked) == 1 else heapq.merge(*ranked, key=lambda entry: -entry[0]))
+
+        # Threshold algorithm: read every token's documents in step; no
+        # unseen document can beat the sum of where the readers are now
+        frontier = [math.inf] * len(streams)
+        top, seen = [], set()
+        while len(top) < limit or top[0][0] < sum(frontier):
+            for i, stream in enumerate(streams):
+                entry = next(stream, None)
+                if entry is None:
+                    # Every document with this token has been scored
+                    return self._results(state, top)
+                frontier[i], doc = entry
+                if doc in seen:
+                    continue
+                seen.add(doc)
+                score = 0.0
+                for word, weighted in sources:
+                    token_score = self._score(state, total, doc, word, weighted)
+                    if token_score is None:
+                        break
+                    score += token_score
+                else:
+                    if len(top) < limit:
+                        heapq.heappush(top, (score, doc))
+                    elif score > top[0][0]:
+                        heapq.heapreplace(top, (score, doc))
+        return self._results(state, top)
+
+    def _results(self, state, top):
+        count = len(self._tables)
+        best = sorted(top, key=lambda entry: (-entry[0], entry[1]))
+        return [(round(score, 4), self._tables[doc % count], doc // count, state.docs[doc][0])
+                for score, doc in best]
+
+    @staticmethod
+    def _stream(idf, ranked):
+        return ((idf * weight, doc) for weight, doc in ranked)
+
+    @staticmethod
+    def _score(state, total, doc, word, weighted):
+        """What ``doc`` scores for one query token, or None if it lacks it."""
+        best = None
+        if len(weighted) <= LOOKUP_TERMS:
+            for idf, term in weighted:
+                weight = state.postings[term].get(doc)
+                if weight is not None and (best is None or idf * weight > best):
+                    best = idf * weight
+            return best
+        # A short prefix expands to many terms; the document has only a few
+        for term in state.docs[doc][1]:
+            if term.startswith(word):
+                postings = state.postings[term]
+                score = math.log(1 + total / len(postings)) * postings[doc]
+                best = score if best is None or score > best else best
+        return best
+
+    def stats(self):
+        with self._lock:
+            state = self._state
+            return {
+                'ready': self.ready,
+                'documents': len(state.docs),
+                'terms': len(state.terms),
+                'postings': sum(len(p) for p in state.postings.values()),
+                'cached_queries': len(self._cache),
+                'cache_hits': self.cache_hits,
+            }
+
+    # Snapshots
+
+    def save(self, path):
+        """Write the index to ``path`` atomically."""
+        with self._lock:
+            state = self._state
+            data = pickle.dumps((SNAPSHOT_FORMAT, self._tables, dict(state.postings), state.docs, state.terms),
+                                protocol=pickle.HIGHEST_PROTOCOL)
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.tmp'  # Workers may save the same profile at once
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def load(self, path, generations=None):
+        """Fill the index from a snapshot; returns False if there is none usable.
+
+        The snapshot counts as read at ``generations``: the caller brings
+        it up to date.
+        """
+        try:
+            with open(path, 'rb') as f:
+                version, tables, postings, docs, terms = pickle.load(f)
+        except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+            return False
+        if version != SNAPSHOT_FORMAT or tables != self._tables:
+            return False  # Written by another version or for other tables
+        with self._lock:
+            self._state = _State(postings, docs, terms)
+            self.seen = dict(generations or {})
+            self._generation += 1
+            self.ready = True
+        return True
+
+
+class SearchIndexes:
+    """One ``SearchIndex`` per profile, for the ``max_profiles`` searched most recently.
+
+    ``load(profile)`` returns the ``{table: load}`` loaders ``rebuild()``
+    takes, for the rows of one profile. A profile's index is built on its
+    first search, in the searching thread, from its snapshot in
+    ``snapshot_dir`` if there is one; searches of the same profile
+    meanwhile wait for it, those of other profiles don't. After loading a
+    snapshot it calls ``on_loaded(profile)``, which should arrange for
+    ``refresh(profile)``. The per-index query cache holds
+    ``cached_queries`` results. ``version(profile, table)``, if given,
+    returns the table's generation as every worker sees it.
+    """
+
+    def __init__(self, fields, titles, load, max_profiles=256, cached_queries=64, snapshot_dir=None,
+                 on_loaded=None, version=None):
+        self.fields = fields
+        self.titles = titles
+        self._load = load
+        self.max_profiles = max_profiles
+        self.cached_queries = cached_queries
+        self.snapshot_dir = snapshot_dir
+        self._on_loaded = on_loaded
+        self._version = version
+        self._indexes = OrderedDict()  # profile -> (SearchIndex, build lock), least recently searched first
+        self._lock = threading.Lock()
+        self.builds = 0
+        self.loads = 0
+        self.evictions = 0
+        self.catch_ups = 0
+
+    def _generations(self, profile):
+        if self._version is None:
+            return {}
+        return {table: self._version(profile, table) for table in self.fields}
+
+    def _snapshot_path(self, profile):
+        return os.path.join(self.snapshot_dir, f'{profile}.pickle') if self.snapshot_dir else None
+
+    def _entry(self, profile, create):
+        with self._lock:
+            entry = self._indexes.get(profile)
+            if entry is not None:
+                self._indexes.move_to_end(profile)
+            elif create:
+                # In place before it is built, so writes landing during the
+                # build reach it and make the build read again
+                entry = self._indexes[profile] = (SearchIndex(self.fields, self.titles, self.cached_queries),
+                                                  threading.Lock())
+                if len(self._indexes) > self.max_profiles:
+                    self._indexes.popitem(last=False)
+                    self.evictions += 1
+            return entry
+
+    def index(self, profile):
+        """The profile's index, built from the database first if need be.
+
+        Raises what the loaders raise, or ``RuntimeError`` if the profile
+        kept changing during the build; the next search tries again.
+        """
+        index, build_lock = self._entry(profile, True)
+        if not index.ready:
+            with build_lock:
+                if not index.ready:
+                    path = self._snapshot_path(profile)
+                    if path and index.load(path, self._generations(profile)):
+                        with self._lock:
+                            self.loads += 1
+                        if self._on_loaded:
+                            self._on_loaded(profile)
+                    else:
+                        self._build(profile, index)
+        return index
+
+    def _build(self, profile, index):
+        index.rebuild(self._load(profile), self._generations(profile))
+        with self._lock:
+            self.builds += 1
+        path = self._snapshot_path(profile)
+        if path:
+            index.save(path)
+
+    def refresh(self, profile):
+        """Rebuild the profile's index from the database, if it has one in memory, and save it."""
+        entry = self._entry(profile, False)
+        if entry is not None:
+            with entry[1]:
+                self._build(profile, entry[0])
+
+    def save_all(self):
+        """Save the snapshot of every index in memory, with the writes applied since its build."""
+        if not self.snapshot_dir:
+            return
+        with self._lock:
+            indexes = [(profile, index) for profile, (index, _) in self._indexes.items() if index.ready]
+        for profile, index in indexes:
+            index.save(self._snapshot_path(profile))
+
+    def search(self, profile, query, limit=20):
+        index = self.index(profile)
+        if self._version is not None:
+            self._catch_up(profile, index)
+        return index.search(query, limit)
+
+    def _catch_up(self, profile, index):
+        """Reindex the tables other workers wrote to since the index read them."""
+        for table, generation in self._generations(profile).items():
+            if index.seen.get(table) != generation:
+                index.reload_table(table, self._load(profile)[table], generation)
+                with self._lock:
+                    self.catch_ups += 1
+
+    def apply(self, profile, table, changes, generations=None):
+        """Apply single-row ``changes`` to the profile's index, if it has one in memory.
+
+        ``generations`` is the table's shared generation ``(before, after)``
+        the write.
+        """
+        entry = self._entry(profile, False)
+        if entry is not None:
+            entry[0].apply(table, changes, generations)
+
+    def reload_table(self, profile, table):
+        """Reindex ``table`` in the profile's index, if it has one in memory."""
+        entry = self._entry(profile, False)
+        if entry is not None and entry[0].ready:
+            generation = self._version(profile, table) if self._version is not None else None
+            entry[0].reload_table(table, self._load(profile)[table], generation)
+
+    def drop(self, profile=None):
+        """Forget the profile's index (every index if None); the next search rebuilds it."""
+        with self._lock:
+            if profile is None:
+                self._indexes.clear()
+            else:
+                self._indexes.pop(profile, None)
+
+    def stats(self):
+        with self._lock:
+            indexes = [index for index, _ in self._indexes.values()]
+            counts = {
+                'profiles': len(indexes),
+                'max_profiles': self.max_profiles,
+                'builds': self.builds,
+                'snapshot_loads': self.loads,
+                'evictions': self.evictions,
+                'catch_ups': self.catch_ups,
+            }
+        for name in ('documents', 'terms', 'cached_queries', 'cache_hits'):
+            counts[name] = 0
+        for index in indexes:
+            for name, value in index.stats().items():
+                if name in counts:
+                    counts[name] += value
+        return counts
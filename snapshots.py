@@ -0,0 +1,186 @@
+"""Last known good rows of each list query, kept on local disk.
+
+Every time the app reads a list page's rows from the database it hands
+them to ``SnapshotStore.save``; if the database later fails or its circuit
+breaker is open, ``get`` returns what that same query returned last, so
+the page is served stale instead of as an error. Entries live in memory
+and are written to ``directory`` by a background thread, one pickle per
+query, renamed into place so a crash never leaves half a file. A
+restarted process reads them back on demand and can serve the public
+pages before the database is reachable at all.
+
+``save`` takes the table generation the rows were read at: rows read
+again at the generation already kept (the query cache's entry expired or
+was evicted) are the same rows, and are neither copied nor written again,
+so snapshots cost a file write per change rather than per cache miss.
+
+Snapshots are partitioned by profile, like the query cache
+(``PartitionedLRU``): a profile keeps at most ``profile_entries`` queries
+and drops its own least recently saved one beyond that, and beyond
+``max_entries`` in all the profile saved to least recently gives one up,
+in memory and on disk alike. A busy profile so cannot push every other
+profile's fallback rows out. Several workers share the directory: each
+writes and trims it holding ``.lock``, and trimming goes by the files on
+disk, whoever wrote them.
+"""
+import fcntl
+import hashlib
+import os
+import pickle
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import PartitionedLRU
+from static_site import write_atomic
+
+SNAPSHOT_FORMAT = 1
+SUFFIX = '.snapshot'
+
+
+class SnapshotStore:
+    """``{(profile, table, key): (saved_at, rows)}``, mirrored to ``directory`` (memory only if empty).
+
+    Rows are stored as given; ``get`` rebuilds those read from disk with
+    ``make_row``.
+    """
+
+    def __init__(self, directory, max_entries=512, profile_entries=None):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.profile_entries = profile_entries or max_entries
+        self._entries = PartitionedLRU(max_entries, self.profile_entries)  # profile -> (table, key) -> entry
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='snapshots')
+        self.saves = 0
+        self.unchanged = 0
+        self.writes = 0
+        self.served = 0
+        self.write_errors = 0
+        self.files = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            with self._directory_lock():
+                self._trim_files()
+
+    @staticmethod
+    def _file(profile, table, key):
+        # The profile leads, for trimming the files partition by partition
+        return f"{profile}-{table}-{hashlib.sha1(repr(key).encode()).hexdigest()[:20]}{SUFFIX}"
+
+    def save(self, table, key, rows, generation=None, profile=None):
+        """Remember ``rows``, read at table ``generation``, as the latest answer to ``(table, key)`` of ``profile``."""
+        entry = (time.time(), rows, generation)
+        with self._lock:
+            kept = self._entries.get(profile, (table, key))
+            if generation is not None and kept is not None and kept[2] == generation:
+                self.unchanged += 1
+                return
+            self._entries.put(profile, (table, key), entry)
+            self.saves += 1
+            if not self.directory:
+                return
+            idle = not self._pending
+            self._pending[(profile, table, key)] = entry
+        if idle:
+            self._executor.submit(self._flush)
+
+    def get(self, table, key, make_row=tuple, profile=None):
+        """``(saved_at, rows)`` last saved for ``(table, key)`` of ``profile``, or None."""
+        with self._lock:
+            entry = self._entries.get(profile, (table, key))
+        if entry is None and self.directory:
+            entry = self._read(profile, table, key, make_row)
+        if entry is None:
+            return None
+        with self._lock:
+            self.served += 1
+        return entry[:2]
+
+    def _read(self, profile, table, key, make_row):
+        try:
+            with open(os.path.join(self.directory, self._file(profile, table, key)), 'rb') as f:
+                version, file_table, file_key, saved_at, rows = pickle.load(f)
+        except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+            return None
+        if version != SNAPSHOT_FORMAT or (file_table, file_key) != (table, key):
+            return None
+        entry = (saved_at, [make_row(row) for row in rows], None)
+        with self._lock:
+            kept = self._entries.get(profile, (table, key))
+            if kept is not None:
+                return kept
+            self._entries.put(profile, (table, key), entry)
+            return entry
+
+    def _directory_lock(self):
+        """An exclusive lock on the directory, released when the returned file closes."""
+        lock = open(os.path.join(self.directory, '.lock'), 'a')
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return lock
+
+    def _flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        with self._directory_lock():
+            for (profile, table, key), (saved_at, rows, _) in pending.items():
+                name = self._file(profile, table, key)
+                # Plain tuples: the row classes are rebuilt from the schema on load
+                data = pickle.dumps((SNAPSHOT_FORMAT, table, key, saved_at, [tuple(row) for row in rows]),
+                                    protocol=pickle.HIGHEST_PROTOCOL)
+                try:
+                    write_atomic(os.path.join(self.directory, name), data)
+                except OSError as err:
+                    print(f"Error writing snapshot {name}: {err}")
+                    self.write_errors += 1
+                    continue
+                self.writes += 1
+            self._trim_files()
+
+    def _trim_files(self):
+        """Remove files as ``PartitionedLRU`` drops entries, oldest written first; the directory lock is held."""
+        partitions = {}  # profile -> [(mtime, name)]
+        for name in os.listdir(self.directory):
+            if name.endswith(SUFFIX):
+                try:
+                    mtime = os.path.getmtime(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                partitions.setdefault(name.split('-', 1)[0], []).append((mtime, name))
+        doomed = []
+        for files in partitions.values():
+            files.sort()
+            excess = max(0, len(files) - self.profile_entries)
+            doomed += files[:excess]
+            del files[:excess]
+        total = sum(len(files) for files in partitions.values())
+        # Beyond max_entries, the profiles written to least recently give up files first
+        for files in sorted(partitions.values(), key=lambda files: files[-1][0] if files else 0):
+            while total > self.max_entries and files:
+                doomed.append(files.pop(0))
+                total -= 1
+        for _, name in doomed:
+            try:
+                os.unlink(os.path.join(self.directory, name))
+            except OSError:
+                pass
+        self.files = total
+
+    def wait(self):
+        """Block until the snapshots saved so far are on disk."""
+        self._executor.submit(lambda: None).result()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'profiles': self._entries.partitions,
+                'evictions': self._entries.evictions,
+                'files': self.files,
+                'saves': self.saves,
+                'unchanged': self.unchanged,
+                'writes': self.writes,
+                'served': self.served,
+                'write_errors': self.write_errors,
+            }
@@ -0,0 +1,183 @@
+"""Pre-rendered static copies of the public pages.
+
+The home page, the five CV section pages and the full CV change only when
+a row is written, but are read all the time. ``StaticSite`` renders them
+through the app itself (so the files hold exactly what the routes would
+return) and writes them under an output directory as
+``<path>/index.html``, together with the app's static files, ready for
+nginx or a CDN to serve with no Python or database in the path. The
+add/edit/delete forms and ``/contact`` stay dynamic. A page path holds
+``<profile>`` where the profile's slug goes, and is rendered once for every
+profile.
+
+Every file is written to a temporary name in the same directory and
+renamed over the old one, so a reader sees either the previous page or
+the new one, never a partial file. After a write the app calls
+``schedule(table, slug)``: only the pages of that profile that show that
+table are re-rendered, in a background thread, and writes that arrive
+while a rebuild is pending are folded into it. ``flask freeze`` renders the whole site.
+
+Each worker process rebuilds after its own writes. With several workers,
+two rebuilds of a page can race; run ``flask freeze`` after bulk changes
+if that matters.
+"""
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+
+
+class Page:
+    """A public URL and the tables whose rows it shows."""
+
+    def __init__(self, path, tables=()):
+        self.path = path
+        self.tables = frozenset(tables)
+
+    def url(self, slug):
+        return self.path.replace('<profile>', slug)
+
+    def file(self, slug):
+        return os.path.join(self.url(slug).strip('/'), 'index.html')
+
+    def __repr__(self):
+        return f"Page({self.path!r})"
+
+
+def write_atomic(path, data):
+    """Replace ``path`` with ``data`` (bytes) in a single rename."""
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path) + '.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp, 0o644)  # mkstemp creates it private
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class StaticSite:
+    """Renders ``pages`` of ``app`` into ``output_dir``.
+
+    ``query`` is appended to every page URL; the app passes ``limit=0`` so
+    a list page holds all of its rows instead of the first page.
+    ``static_dirs`` are copied to the static URL path, by default just the
+    app's static folder. ``profiles()`` returns the slug of every profile.
+    """
+
+    def __init__(self, app, output_dir, pages, profiles, query='', static_dirs=None):
+        self.app = app
+        self.output_dir = output_dir
+        self.pages = list(pages)
+        self.profiles = profiles
+        self.query = query
+        self.static_dirs = static_dirs if static_dirs is not None else [app.static_folder]
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='static-site')
+        self.renders = 0
+        self.failures = 0
+        self.last_render_ms = 0.0
+
+    def render(self, page, slug):
+        """Render one page of a profile to its file; returns False (keeping the old file) on failure."""
+        start = time.perf_counter()
+        url = page.url(slug) + ('?' + self.query if self.query else '')
+        response = self.app.test_client().get(url)
+        if response.status_code != 200:
+            print(f"Error rendering {page.url(slug)}: status {response.status_code}")
+            self.failures += 1
+            return False
+        write_atomic(os.path.join(self.output_dir, page.file(slug)), response.get_data())
+        self.renders += 1
+        self.last_render_ms = (time.perf_counter() - start) * 1000.0
+        return True
+
+    def copy_static(self):
+        """Copy ``static_dirs`` to ``<output_dir>/<static url>``."""
+        target = os.path.join(self.output_dir, self.app.static_url_path.strip('/'))
+        copied = 0
+        for source in self.static_dirs:
+            if not source or not os.path.isdir(source):
+                continue
+            for root, _, files in os.walk(source):
+                for name in files:
+                    path = os.path.join(root, name)
+                    with open(path, 'rb') as f:
+                        write_atomic(os.path.join(target, os.path.relpath(path, source)), f.read())
+                    copied += 1
+        return copied
+
+    def build(self):
+        """Render every page of every profile and copy the static files;
+        returns the URLs that failed."""
+        failed = [page.url(slug) for slug in self.profiles() for page in self.pages if not self.render(page, slug)]
+        self.copy_static()
+        return failed
+
+    def schedule(self, table, slug=None):
+        """Re-render the profile's pages that show ``table`` (those of every
+        profile if ``slug`` is None), off the request path."""
+        pages = [page for page in self.pages if table in page.tables]
+        if not pages:
+            return
+        with self._lock:
+            idle = not self._pending
+            self._pending.update((page, slug) for page in pages)
+        if idle:
+            self._executor.submit(self._flush)
+
+    def _flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, set()
+        everyone = {page for page, slug in pending if slug is None}
+        if everyone:
+            try:
+                slugs = self.profiles()
+            except Exception as err:
+                print(f"Error listing profiles: {err}")
+                self.failures += 1
+                slugs = []
+            pending = {(page, slug) for page, slug in pending if page not in everyone}
+            pending.update((page, slug) for page in everyone for slug in slugs)
+        for page, slug in sorted(pending, key=lambda entry: (entry[1], entry[0].path)):
+            try:
+                self.render(page, slug)
+            except Exception as err:  # Keep serving the previous file
+                print(f"Error rendering {page.url(slug)}: {err}")
+                self.failures += 1
+
+    def wait(self):
+        """Block until the rebuilds scheduled so far have finished."""
+        self._executor.submit(lambda: None).result()
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            'pages': len(self.pages),
+            'pending': pending,
+            'renders': self.renders,
+            'failures': self.failures,
+            'last_render_ms': round(self.last_render_ms, 3),
+        }
+
+
+def init_cli(app, make_site):
+    """Register ``flask freeze``; ``make_site(output_dir)`` returns a ``StaticSite``."""
+
+    @app.cli.command('freeze')
+    @click.argument('output_dir', type=click.Path(file_okay=False), required=False)
+    def freeze_command(output_dir):
+        """Render every public page to static files in OUTPUT_DIR."""
+        site = make_site(output_dir)
+        failed = site.build()
+        if failed:
+            raise click.ClickException(f"Could not render: {', '.join(failed)}")
+        click.echo(f"Wrote {site.renders} pages to {site.output_dir}")
@@ -0,0 +1,233 @@
+"""Storage backends behind the connection pool.
+
+``STORAGE_BACKEND=mysql`` (the default) talks to a MySQL server through
+``mysql.connector``. ``STORAGE_BACKEND=sqlite`` uses an embedded SQLite
+database in WAL mode with memory-mapped I/O, so reads are in-process and
+need no database server; that is what a single-node deployment, the
+benchmarks and local development use.
+
+Both backends hand out DB-API connections that accept the ``%s``
+placeholders the app is written with, and both raise subclasses of
+``DatabaseError``. The schema comes from ``migrations``: SQLite databases
+are migrated on first connect, MySQL ones when ``auto_migrate`` is set or
+through ``flask migrate``.
+
+``query_timeout`` bounds each statement: MySQL aborts a ``SELECT`` that
+runs longer (``max_execution_time``), SQLite interrupts any statement, or
+any fetch of its rows, that does. ``is_unavailable`` tells those errors and
+failed connects, which the circuit breaker counts, from a statement the
+database rejected.
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import migrations
+
+try:
+    import mysql.connector
+except ImportError:  # Only needed for the MySQL backend
+    mysql = None
+
+# What the routes catch around queries, whichever backend is in use
+if mysql is not None:
+    DatabaseError = (sqlite3.Error, mysql.connector.Error)
+else:
+    DatabaseError = (sqlite3.Error,)
+
+MYSQL_QUERY_TIMEOUT = 3024  # ER_QUERY_TIMEOUT, max_execution_time exceeded
+
+
+def is_unavailable(err):
+    """Whether ``err`` means the database could not be reached or did not
+    answer in time, as opposed to rejecting the statement."""
+    if isinstance(err, sqlite3.OperationalError):
+        return True  # Interrupted, locked past busy_timeout, or unable to open the file
+    if mysql is not None and isinstance(err, mysql.connector.Error):
+        return (isinstance(err, (mysql.connector.errors.OperationalError, mysql.connector.errors.InterfaceError))
+                or err.errno == MYSQL_QUERY_TIMEOUT)
+    return False
+
+
+class MySQLBackend:
+    name = 'mysql'
+
+    def __init__(self, host, user, password, database, auto_migrate=False, connect_timeout=10.0,
+                 query_timeout=None):
+        if mysql is None:
+            raise RuntimeError("STORAGE_BACKEND=mysql needs the mysql-connector-python package")
+        self.params = dict(host=host, user=user, password=password, database=database,
+                           connection_timeout=max(1, round(connect_timeout)))
+        self.query_timeout = query_timeout
+        self._schema_ready = not auto_migrate
+        self._lock = threading.Lock()
+
+    def connect(self):
+        conn = mysql.connector.connect(**self.params)
+        if self.query_timeout:
+            cursor = conn.cursor()
+            cursor.execute("SET SESSION max_execution_time = %s", (int(self.query_timeout * 1000),))
+            cursor.close()
+        with self._lock:
+            if not self._schema_ready:
+                migrations.migrate(conn, self.name)
+                self._schema_ready = True
+        return conn
+
+    def migrate(self):
+        conn = mysql.connector.connect(**self.params)
+        try:
+            return migrations.migrate(conn, self.name)
+        finally:
+            conn.close()
+
+    def check(self, conn):
+        return conn.is_connected()
+
+
+class SQLiteCursor:
+    """Cursor that accepts the app's ``%s`` placeholders."""
+
+    # Statements are few and mostly fixed, but ``IN (%s, ...)`` lists vary
+    # with their length: the memo keeps the most recently used ones only
+    TRANSLATED_MAX = 512
+    _translated = OrderedDict()  # sql -> translated sql, least recently used first
+    _translated_lock = threading.Lock()
+
+    def __init__(self, cursor, conn):
+        self._cursor = cursor
+        self._conn = conn
+
+    @classmethod
+    def _sql(cls, sql):
+        with cls._translated_lock:
+            translated = cls._translated.get(sql)
+            if translated is not None:
+                cls._translated.move_to_end(sql)
+                return translated
+        translated = sql.replace('%s', '?')
+        with cls._translated_lock:
+            cls._translated[sql] = translated
+            if len(cls._translated) > cls.TRANSLATED_MAX:
+                cls._translated.popitem(last=False)
+        return translated
+
+    def execute(self, sql, params=()):
+        self._conn.timed(self._cursor.execute, self._sql(sql), params)
+
+    def executemany(self, sql, seq_params):
+        self._conn.timed(self._cursor.executemany, self._sql(sql), seq_params)
+
+    def fetchone(self):
+        return self._conn.timed(self._cursor.fetchone)
+
+    def fetchmany(self, size=1):
+        return self._conn.timed(self._cursor.fetchmany, size)
+
+    def fetchall(self):
+        return self._conn.timed(self._cursor.fetchall)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteConnection:
+    # SQLite instructions between checks of the query deadline
+    PROGRESS_INTERVAL = 10000
+
+    def __init__(self, conn, query_timeout=None):
+        self._conn = conn
+        self.query_timeout = query_timeout
+        self._deadline = None
+        if query_timeout:
+            conn.set_progress_handler(self._expired, self.PROGRESS_INTERVAL)
+
+    def _expired(self):
+        # A true result makes SQLite abort with OperationalError('interrupted')
+        return self._deadline is not None and time.monotonic() > self._deadline
+
+    def timed(self, fn, *args):
+        """``fn(*args)``, interrupted after ``query_timeout`` seconds."""
+        if not self.query_timeout:
+            return fn(*args)
+        self._deadline = time.monotonic() + self.query_timeout
+        try:
+            return fn(*args)
+        finally:
+            self._deadline = None
+
+    def cursor(self, *args, **kwargs):
+        # mysql.connector options such as buffered= have no meaning here
+        return SQLiteCursor(self._conn.cursor(), self)
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self._conn.close()
+
+
+class SQLiteBackend:
+    name = 'sqlite'
+
+    def __init__(self, path, mmap_size=256 * 1024 * 1024, busy_timeout=5.0, query_timeout=None):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.mmap_size = mmap_size
+        self.busy_timeout = busy_timeout
+        self.query_timeout = query_timeout
+        self._schema_ready = False
+        self._lock = threading.Lock()
+
+    def connect(self):
+        # Connections move between threads with the pool, one user at a time
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        with self._lock:
+            if not self._schema_ready:
+                migrations.migrate(conn, self.name)
+                self._schema_ready = True
+        return SQLiteConnection(conn, self.query_timeout)
+
+    def migrate(self):
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout)
+        try:
+            return migrations.migrate(conn, self.name)
+        finally:
+            conn.close()
+
+    def check(self, conn):
+        return True
+
+
+def create_backend(name, **config):
+    """Build the backend named by ``STORAGE_BACKEND``."""
+    if name == 'mysql':
+        return MySQLBackend(config['host'], config['user'], config['password'], config['database'],
+                            auto_migrate=config.get('auto_migrate', False),
+                            connect_timeout=config.get('connect_timeout', 10.0),
+                            query_timeout=config.get('query_timeout'))
+    if name == 'sqlite':
+        return SQLiteBackend(config['sqlite_path'], mmap_size=config.get('sqlite_mmap_size', 256 * 1024 * 1024),
+                             query_timeout=config.get('query_timeout'))
+    raise ValueError(f"unknown STORAGE_BACKEND {name!r}; use 'mysql' or 'sqlite'")
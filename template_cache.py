@@ -0,0 +1,56 @@
+"""Precompiled templates.
+
+Jinja compiles a template to Python the first time it is rendered, so the
+first request for each page after a deploy or worker recycle paid for
+parsing and compiling it (and ``base.html``) on top of the render.
+``init_app`` gives the environment a ``FileSystemBytecodeCache``, which
+keeps compiled templates on disk across restarts and shares them between
+workers. ``warm_up`` then loads every template, and builds the URL map's
+matcher, before the app serves a request: from the bytecode cache when it
+is current, compiling and caching it otherwise.
+
+``report`` combines the warm-up load times with the render histogram that
+``metrics`` keeps per template.
+"""
+import os
+import time
+
+from jinja2 import FileSystemBytecodeCache
+
+import metrics
+
+
+def init_app(app, cache_dir=None):
+    """Persist compiled templates in ``cache_dir`` (no cache if empty)."""
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+
+
+def warm_up(app):
+    """Load every template; returns ``{name: seconds}`` it took to load each."""
+    env = app.jinja_env
+    timings = {}
+    for name in env.list_templates(filter_func=lambda name: name.endswith('.html')):
+        start = time.perf_counter()
+        env.get_template(name)
+        timings[name] = time.perf_counter() - start
+    app.url_map.update()  # Compile the routing state machine now, not on the first request
+    return timings
+
+
+def report(load_times):
+    """Per-template load and render times, slowest total render first."""
+    renders = {labels[0]: (count, total) for labels, (count, total) in metrics.render_duration.snapshot().items()}
+    rows = []
+    for name in sorted(set(load_times) | set(renders)):
+        count, total = renders.get(name, (0, 0.0))
+        rows.append({
+            'template': name,
+            'load_ms': round(load_times.get(name, 0.0) * 1000, 3),
+            'renders': count,
+            'render_total_ms': round(total * 1000, 3),
+            'render_mean_ms': round(total / count * 1000, 3) if count else None,
+        })
+    rows.sort(key=lambda row: -row['render_total_ms'])
+    return rows
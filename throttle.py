@@ -0,0 +1,259 @@
+"""Rate limiting and duplicate suppression for the contact form.
+
+``ContactThrottle.check`` runs before a submission touches the queue or
+the database. It takes a token from the sender's bucket and from one
+bucket shared by all senders, both or neither (a sender turned away by
+the shared bucket keeps its own tokens), so neither a single client nor a botnet can
+write faster than the buckets refill, and it turns away a message whose
+content was already accepted within ``duplicate_window`` seconds (a
+double-clicked submit button, or a bot replaying one message). A message
+that then fails to be stored is handed to ``ContactThrottle.forget``, so
+the sender's retry is not taken for a duplicate.
+
+``LocalThrottleStore`` keeps the buckets in process, in an LRU of at most
+``max_clients`` senders: a sender evicted from it returns with a full
+bucket, which is what it would have had after being quiet that long.
+``SQLiteThrottleStore`` keeps them in a small SQLite file, so all workers
+on one host draw from the same buckets.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+GLOBAL_KEY = '*'
+
+
+def _refill(tokens, updated_at, capacity, rate, now):
+    return min(capacity, tokens + (now - updated_at) * rate)
+
+
+class LocalThrottleStore:
+    """Token buckets and message digests for a single process."""
+
+    def __init__(self, max_clients=10000, max_digests=10000):
+        self.max_clients = max_clients
+        self.max_digests = max_digests
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at), least recently used first
+        self._shared = {}              # GLOBAL_KEY -> (tokens, updated_at), never evicted
+        self._digests = OrderedDict()  # digest -> expires_at, oldest first
+        self._lock = threading.Lock()
+
+    def take(self, buckets, now):
+        """Take a token from each of ``buckets``, ``[(key, capacity, rate)]``, or from none.
+
+        Returns ``(key, wait)`` for the first bucket short of a token, with
+        the seconds it needs, or ``(None, 0.0)`` once all tokens are taken.
+        """
+        with self._lock:
+            levels = []
+            for key, capacity, rate in buckets:
+                store = self._shared if key == GLOBAL_KEY else self._buckets
+                tokens, updated_at = store.pop(key, (capacity, now))
+                tokens = _refill(tokens, updated_at, capacity, rate, now)
+                levels.append((store, key, tokens))
+            short = next(((key, (1 - tokens) / rate) for (_, key, tokens), (_, _, rate)
+                          in zip(levels, buckets) if tokens < 1), None)
+            for store, key, tokens in levels:
+                store[key] = (tokens if short else tokens - 1, now)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+            return short or (None, 0.0)
+
+    def remember(self, digest, window, now):
+        """Record ``digest`` for ``window`` seconds; False if it is already recorded."""
+        with self._lock:
+            while self._digests and next(iter(self._digests.values())) <= now:
+                self._digests.popitem(last=False)
+            if digest in self._digests:
+                return False
+            self._digests[digest] = now + window
+            if len(self._digests) > self.max_digests:
+                self._digests.popitem(last=False)
+            return True
+
+    def forget(self, digest):
+        """Drop ``digest``, recorded for a message that was not kept after all."""
+        with self._lock:
+            self._digests.pop(digest, None)
+
+    def clients(self):
+        with self._lock:
+            return len(self._buckets)
+
+
+class SQLiteThrottleStore:
+    """Token buckets and message digests shared through a local SQLite file."""
+
+    PRUNE_EVERY = 1000  # operations between deletions of full buckets and expired digests
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._operations = 0
+        # An SQLite connection must not be used on both sides of a fork
+        os.register_at_fork(after_in_child=self._after_fork)
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS throttle_buckets ("
+                "name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL, full_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS throttle_digests (digest TEXT PRIMARY KEY, expires_at REAL NOT NULL)"
+            )
+        # None stays open for a server to fork workers with
+        conn.close()
+        self._local = threading.local()
+
+    def _after_fork(self):
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _prune(self, conn, now):
+        self._operations += 1
+        if self._operations % self.PRUNE_EVERY == 0:
+            # A bucket that has refilled completely is the same as no bucket
+            conn.execute("DELETE FROM throttle_buckets WHERE full_at <= ?", (now,))
+            conn.execute("DELETE FROM throttle_digests WHERE expires_at <= ?", (now,))
+
+    def take(self, buckets, now):
+        """Take a token from each of ``buckets``, ``[(key, capacity, rate)]``, or from none.
+
+        Returns ``(key, wait)`` for the first bucket short of a token, with
+        the seconds it needs, or ``(None, 0.0)`` once all tokens are taken.
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")  # Read and update the buckets as one step across workers
+        try:
+            levels = []
+            for key, capacity, rate in buckets:
+                row = conn.execute("SELECT tokens, updated_at FROM throttle_buckets WHERE name = ?",
+                                   (key,)).fetchone()
+                levels.append(_refill(*(row or (capacity, now)), capacity, rate, now))
+            short = next(((key, (1 - tokens) / rate) for tokens, (key, _, rate) in zip(levels, buckets)
+                          if tokens < 1), None)
+            for tokens, (key, capacity, rate) in zip(levels, buckets):
+                if not short:
+                    tokens -= 1
+                conn.execute(
+                    "INSERT INTO throttle_buckets (name, tokens, updated_at, full_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at, "
+                    "full_at = excluded.full_at",
+                    (key, tokens, now, now + (capacity - tokens) / rate)
+                )
+            self._prune(conn, now)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return short or (None, 0.0)
+
+    def remember(self, digest, window, now):
+        """Record ``digest`` for ``window`` seconds; False if it is already recorded."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT expires_at FROM throttle_digests WHERE digest = ?", (digest,)).fetchone()
+            fresh = row is None or row[0] <= now
+            if fresh:
+                conn.execute("INSERT OR REPLACE INTO throttle_digests (digest, expires_at) VALUES (?, ?)",
+                             (digest, now + window))
+            self._prune(conn, now)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return fresh
+
+    def forget(self, digest):
+        """Drop ``digest``, recorded for a message that was not kept after all."""
+        conn = self._conn()
+        conn.execute("DELETE FROM throttle_digests WHERE digest = ?", (digest,))
+
+    def clients(self):
+        return self._conn().execute("SELECT COUNT(*) FROM throttle_buckets WHERE name != ?", (GLOBAL_KEY,)).fetchone()[0]
+
+
+def message_digest(profile_id, name, email, message):
+    """The same message from the same address to the same profile hashes the
+    same, whatever its spacing or case."""
+    text = '\0'.join(' '.join(str(part).split()).lower() for part in (profile_id, name, email, message))
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class ContactThrottle:
+    """Decides whether a contact submission may go through.
+
+    A sender's bucket holds ``ip_burst`` tokens and regains one every
+    ``ip_refill`` seconds; the bucket shared by all senders holds
+    ``global_burst`` and regains one every ``global_refill`` seconds. A
+    ``duplicate_window`` of 0 turns duplicate suppression off.
+    """
+
+    def __init__(self, store, ip_burst=5, ip_refill=60.0, global_burst=100, global_refill=1.0,
+                 duplicate_window=600.0):
+        self.store = store
+        self.ip_burst = ip_burst
+        self.ip_rate = 1.0 / ip_refill
+        self.global_burst = global_burst
+        self.global_rate = 1.0 / global_refill
+        self.duplicate_window = duplicate_window
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.limited_ip = 0
+        self.limited_global = 0
+        self.duplicates = 0
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def check(self, client, profile_id, name, email, message):
+        """``(verdict, retry_after)``; verdict is 'ok', 'ip', 'global' or 'duplicate'.
+
+        The buckets are shared by all profiles: a sender writing to many of
+        them is limited as if it wrote to one.
+        """
+        now = time.time()
+        short, wait = self.store.take([('ip:' + client, self.ip_burst, self.ip_rate),
+                                       (GLOBAL_KEY, self.global_burst, self.global_rate)], now)
+        if short == GLOBAL_KEY:
+            self._count('limited_global')
+            return 'global', wait
+        if short:
+            self._count('limited_ip')
+            return 'ip', wait
+        if self.duplicate_window and not self.store.remember(message_digest(profile_id, name, email, message),
+                                                             self.duplicate_window, now):
+            self._count('duplicates')
+            return 'duplicate', 0.0
+        self._count('allowed')
+        return 'ok', 0.0
+
+    def forget(self, profile_id, name, email, message):
+        """Undo the duplicate check of a message ``check`` allowed but that could not be stored."""
+        if self.duplicate_window:
+            self.store.forget(message_digest(profile_id, name, email, message))
+
+    def stats(self):
+        with self._lock:
+            counts = {
+                'allowed': self.allowed,
+                'limited_ip': self.limited_ip,
+                'limited_global': self.limited_global,
+                'duplicates': self.duplicates,
+            }
+        counts['tracked_clients'] = self.store.clients()
+        return counts
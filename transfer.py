@@ -0,0 +1,320 @@
+"""Streaming CSV / NDJSON import and export for the CV tables.
+
+Exports read the table through a streaming cursor and encode rows as they
+arrive. Imports parse the input one record at a time and insert it in
+``executemany`` batches, one transaction per batch. After every committed
+batch the number of records consumed so far is reported, so an interrupted
+import can resume where it stopped instead of starting over. Memory use
+stays flat for any table size in both directions.
+
+The same functions back the ``/<profile>/api/v1/<resource>/export`` and
+``import`` endpoints and the ``flask export-table`` / ``flask import-table``
+commands. Either way a transfer covers the rows of one profile, and the
+files carry no profile: an export of one profile imports into another.
+Contact messages are private, so only the commands move them.
+Exports carry each row's id, and imports leave it out so the database
+hands out new ones, unless asked to keep them (``--keep-ids``,
+``?keep_ids=1``), as when restoring rows that were deleted.
+"""
+import csv
+import io
+import json
+import os
+
+import click
+from flask import Blueprint, Response, jsonify, request
+
+from api import json_value
+from repository import DatabaseUnavailable
+from schema import PUBLIC_RESOURCES, RESOURCES
+from storage import DatabaseError
+
+FORMATS = ('csv', 'ndjson')
+CONTENT_TYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+
+class TransferError(Exception):
+    """A record could not be parsed or inserted.
+
+    ``records`` is how many records were committed before the failure,
+    i.e. where a resumed import should start. ``bad_input`` is true when
+    the input was at fault (a malformed record) rather than the database.
+    """
+
+    def __init__(self, message, records, bad_input=False):
+        super().__init__(message)
+        self.records = records
+        self.bad_input = bad_input
+
+
+def encode_rows(columns, rows, fmt, rows_per_chunk=500):
+    """Yield ``rows`` encoded as CSV (with a header) or NDJSON, in text chunks."""
+    buffer = io.StringIO()
+    if fmt == 'csv':
+        writer = csv.writer(buffer, lineterminator='\n')
+        writer.writerow(columns)
+        write = lambda row: writer.writerow(['' if v is None else v for v in row])
+    else:
+        write = lambda row: buffer.write(
+            json.dumps({c: json_value(v) for c, v in zip(columns, row)}) + '\n'
+        )
+
+    count = 0
+    for row in rows:
+        write(row)
+        count += 1
+        if count % rows_per_chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def decode_records(lines, fmt, allowed):
+    """Parse text ``lines`` into ``(columns, records)``.
+
+    ``records`` is a lazy iterator of tuples in ``columns`` order. For CSV
+    the header names the columns and empty fields become NULL; for NDJSON
+    the first object does, and every later object must carry the same keys.
+    """
+    lines = iter(lines)
+    if fmt == 'csv':
+        reader = csv.reader(lines)
+        columns = tuple(next(reader, ()))
+        records = (tuple(None if v == '' else v for v in row) for row in reader if row)
+    else:
+        first = None
+        for line in lines:
+            if line.strip():
+                first = json.loads(line)
+                break
+        columns = tuple(first) if isinstance(first, dict) else ()
+
+        def parse():
+            yield tuple(first[c] for c in columns)
+            for line in lines:
+                if not line.strip():
+                    continue
+                obj = json.loads(line)
+                if not isinstance(obj, dict) or set(obj) != set(columns):
+                    raise ValueError(f"record keys differ from the first record's: {sorted(columns)}")
+                yield tuple(obj[c] for c in columns)
+        records = parse() if columns else iter(())
+
+    unknown = [c for c in columns if c not in allowed]
+    if not columns or unknown:
+        raise ValueError(f"unknown or missing columns: {', '.join(unknown) or '(none)'}")
+    return columns, records
+
+
+def import_records(get_db_connection, table, columns, records, batch_size=500,
+                   skip=0, on_commit=None, profile_id=None, keep_ids=False):
+    """Insert ``records`` in batches; returns the total records consumed.
+
+    The first ``skip`` records are read and dropped, which is how a resumed
+    import fast-forwards past what an earlier run already committed.
+    ``on_commit(records)`` is called after each batch is committed. With a
+    ``profile_id`` every record is inserted as a row of that profile. An
+    ``id`` column is dropped unless ``keep_ids``.
+    """
+    extra = () if profile_id is None else (profile_id,)
+    id_at = columns.index('id') if 'id' in columns and not keep_ids else None
+    kept = columns if id_at is None else columns[:id_at] + columns[id_at + 1:]
+    names = kept + (('profile_id',) if extra else ())
+    sql = (f"INSERT INTO {table} ({', '.join(names)}) "
+           f"VALUES ({', '.join(['%s'] * len(names))})")
+    committed = seen = skip
+    mydb = get_db_connection()
+    if not mydb:
+        raise TransferError("Database connection failed.", committed)
+    with mydb:
+        cursor = mydb.cursor()
+        batch = []
+        try:
+            for position, record in enumerate(records):
+                if position < skip:
+                    continue
+                if len(record) != len(columns):
+                    raise ValueError(f"record {position} has {len(record)} fields, expected {len(columns)}")
+                record = tuple(record)
+                if id_at is not None:
+                    record = record[:id_at] + record[id_at + 1:]
+                batch.append(record + extra)
+                seen = position + 1
+                if len(batch) >= batch_size:
+                    cursor.executemany(sql, batch)
+                    mydb.commit()
+                    committed, batch = seen, []
+                    if on_commit:
+                        on_commit(committed)
+            if batch:
+                cursor.executemany(sql, batch)
+                mydb.commit()
+                committed = seen
+                if on_commit:
+                    on_commit(committed)
+        except (ValueError, csv.Error) as err:
+            mydb.rollback()
+            raise TransferError(str(err), committed, bad_input=True) from err
+        except DatabaseError as err:
+            mydb.rollback()
+            raise TransferError(str(err), committed) from err
+        finally:
+            cursor.close()
+    return committed
+
+
+class Checkpoint:
+    """Progress of a file import, kept next to it as JSON."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f).get('records', 0)
+        except (OSError, ValueError):
+            return 0
+
+    def save(self, records):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'records': records}, f)
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def format_for(path, fmt):
+    if fmt:
+        return fmt
+    return 'ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv'
+
+
+def make_transfer_blueprint(repositories, current_profile, batch_size=500):
+    """Export and import endpoints under ``/<profile>/api/v1/<resource>/``.
+
+    ``current_profile()`` returns the profile the request's URL names.
+    """
+    transfer = Blueprint('transfer', __name__, url_prefix='/<profile>/api/v1')
+
+    @transfer.route('/<resource>/export', methods=['GET'])
+    def export_resource(resource):
+        if resource not in PUBLIC_RESOURCES:
+            return jsonify(error="Unknown resource."), 404
+        fmt = request.args.get('format', 'csv')
+        if fmt not in FORMATS:
+            return jsonify(error=f"Format must be one of: {', '.join(FORMATS)}."), 400
+        repo = repositories[resource]
+        try:
+            rows = repo.stream(current_profile().id)
+        except DatabaseUnavailable:
+            return jsonify(error="Database connection failed."), 503
+        except DatabaseError as err:
+            print(f"Error exporting {repo.table.name}: {err}")
+            return jsonify(error=f"Unable to export {resource}."), 500
+        response = Response(encode_rows(repo.table.fields, rows, fmt), mimetype=CONTENT_TYPES[fmt])
+        response.headers['Content-Disposition'] = f'attachment; filename="{resource}.{fmt}"'
+        return response
+
+    @transfer.route('/<resource>/import', methods=['POST'])
+    def import_resource(resource):
+        """Load the request body; ``?skip=N`` resumes after N committed records.
+
+        ``?keep_ids=1`` inserts the records' ids instead of new ones.
+        """
+        if resource not in PUBLIC_RESOURCES:
+            return jsonify(error="Unknown resource."), 404
+        fmt = request.args.get('format', 'csv')
+        if fmt not in FORMATS:
+            return jsonify(error=f"Format must be one of: {', '.join(FORMATS)}."), 400
+        repo = repositories[resource]
+        profile_id = current_profile().id
+        skip = request.args.get('skip', 0, type=int)
+        keep_ids = request.args.get('keep_ids') == '1'
+        lines = (line.decode('utf-8') for line in request.stream)
+        try:
+            columns, records = decode_records(lines, fmt, repo.table.fields)
+            total = import_records(repo.get_db_connection, repo.table.name, columns, records,
+                                   batch_size=batch_size, skip=skip, profile_id=profile_id, keep_ids=keep_ids)
+        except ValueError as err:
+            return jsonify(error=str(err), records=skip), 400
+        except TransferError as err:
+            return jsonify(error=str(err), records=err.records), 400 if err.bad_input else 500
+        finally:
+            repo.changed(profile_id)
+        return jsonify(imported=total - skip, records=total)
+
+    return transfer
+
+
+def init_cli(app, repositories, profiles, default_profile, batch_size=500):
+    """Register ``flask export-table`` and ``flask import-table``.
+
+    Both work on the rows of the profile ``--profile`` names, looked up in
+    ``profiles`` (a ``ProfileDirectory``), ``default_profile`` by default.
+    """
+
+    def profile_option(command):
+        return click.option('--profile', 'slug', default=default_profile, show_default=True,
+                            help='Slug of the profile whose rows to transfer.')(command)
+
+    def find_profile(slug):
+        profile = profiles.get(slug)
+        if profile is None:
+            raise click.ClickException(f"No profile {slug!r}.")
+        return profile
+
+    @app.cli.command('export-table')
+    @click.argument('resource', type=click.Choice(sorted(RESOURCES)))
+    @click.argument('path', type=click.Path(dir_okay=False, allow_dash=True), default='-')
+    @click.option('--format', 'fmt', type=click.Choice(FORMATS), help='Defaults to the file extension.')
+    @profile_option
+    def export_table(resource, path, fmt, slug):
+        """Stream a profile's rows of a table to PATH (stdout by default)."""
+        fmt = format_for(path, fmt)
+        repo = repositories[resource]
+        rows = repo.stream(find_profile(slug).id)
+        with click.open_file(path, 'w', encoding='utf-8') as out:
+            for chunk in encode_rows(repo.table.fields, rows, fmt):
+                out.write(chunk)
+
+    @app.cli.command('import-table')
+    @click.argument('resource', type=click.Choice(sorted(RESOURCES)))
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--format', 'fmt', type=click.Choice(FORMATS), help='Defaults to the file extension.')
+    @click.option('--batch-size', type=int, default=batch_size, show_default=True)
+    @click.option('--restart', is_flag=True, help='Ignore any checkpoint and start from the first record.')
+    @click.option('--keep-ids', is_flag=True, help="Insert the records' ids instead of new ones.")
+    @profile_option
+    def import_table(resource, path, fmt, batch_size, restart, keep_ids, slug):
+        """Load PATH into a profile's rows of a table, resuming from PATH.checkpoint if present."""
+        fmt = format_for(path, fmt)
+        repo = repositories[resource]
+        profile_id = find_profile(slug).id
+        checkpoint = Checkpoint(path + '.checkpoint')
+        skip = 0 if restart else checkpoint.load()
+        if skip:
+            click.echo(f"Resuming after {skip} records")
+
+        with open(path, encoding='utf-8', newline='') as f:
+            try:
+                columns, records = decode_records(f, fmt, repo.table.fields)
+                total = import_records(repo.get_db_connection, repo.table.name, columns, records,
+                                       batch_size=batch_size, skip=skip, on_commit=checkpoint.save,
+                                       profile_id=profile_id, keep_ids=keep_ids)
+            except ValueError as err:
+                raise click.ClickException(str(err))
+            except TransferError as err:
+                checkpoint.save(err.records)
+                raise click.ClickException(f"{err} (committed {err.records} records; rerun to resume)")
+            finally:
+                repo.changed(profile_id)
+        checkpoint.clear()
+        click.echo(f"Imported {total - skip} records into {repo.table.name}")